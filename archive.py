@@ -0,0 +1,77 @@
+import datetime
+import email.parser
+import email.utils
+import re
+
+DATE = 'date'
+THREAD = 'thread'
+
+MESSAGE_ID_PATTERN = re.compile(r'<[^<>\s]+>')
+# emails without a readable date come first
+UNKNOWN_DATE = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+
+def read_headers(source):
+  """Parse the headers of an email given as EML filename or raw bytes, without its body"""
+  parser = email.parser.BytesHeaderParser()
+  if isinstance(source, bytes):
+    return parser.parsebytes(source)
+  if hasattr(source, 'read_headers'):
+    # email of a mailbox, see mailboxes.MailboxMessage
+    return parser.parsebytes(source.read_headers())
+  with open(source, 'rb') as file:
+    return parser.parse(file)
+
+def email_date(headers):
+  try:
+    date = email.utils.parsedate_to_datetime(headers.get('Date'))
+  except (TypeError, ValueError):
+    return UNKNOWN_DATE
+  if date.tzinfo == None:
+    date = date.replace(tzinfo=datetime.timezone.utc)
+  return date
+
+def order_emails(sources, order=DATE):
+  """
+  Order emails for an archive
+  Arguments:
+      sources: list of EML filenames, raw emails as bytes or mailboxes.MailboxMessage
+      order: DATE for the oldest email first,
+             THREAD to group the replies after the email they answer, threads ordered by their oldest email
+  Returns:
+      list of (source, bookmark level) tuples, level 2 for the replies inside a thread, 1 otherwise
+  """
+  emails = []
+  for index, source in enumerate(sources):
+    headers = read_headers(source)
+    message_ids = MESSAGE_ID_PATTERN.findall(str(headers.get('Message-ID', '')))
+    references = MESSAGE_ID_PATTERN.findall(str(headers.get('References', '')))
+    in_reply_to = MESSAGE_ID_PATTERN.findall(str(headers.get('In-Reply-To', '')))
+    emails.append({
+      'source': source,
+      'index': index,
+      'date': email_date(headers),
+      # emails without Message-ID are threads of their own
+      'id': message_ids[0] if len(message_ids) > 0 else index,
+      'parent': (in_reply_to or references or [None])[-1],
+      # the first reference is the start of the thread, even when that email is not in the archive
+      'root': (references or in_reply_to or [None])[0],
+    })
+  # emails with the same date keep the order they were given in
+  emails.sort(key=lambda entry: (entry['date'], entry['index']))
+  if order == DATE:
+    return [(entry['source'], 1) for entry in emails]
+
+  by_id = {entry['id']: entry for entry in emails}
+  threads = {}
+  for entry in emails:
+    # climb the replies up to the oldest email of the thread found in the archive
+    thread = entry
+    seen = set()
+    while thread['parent'] in by_id and thread['parent'] not in seen:
+      seen.add(thread['parent'])
+      thread = by_id[thread['parent']]
+    key = thread['root'] if thread['parent'] != None else thread['id']
+    # dictionaries keep the insertion order, so threads are ordered by their oldest email
+    threads.setdefault(key, []).append(entry)
+  return [(entry['source'], 1 if position == 0 else 2)
+          for thread in threads.values() for position, entry in enumerate(thread)]
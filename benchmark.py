@@ -0,0 +1,274 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+from profiling import STAGES, Profile, peak_rss
+
+# Every generator takes a random.Random and the index of the email, and returns an EmailMessage.
+# Nothing in the corpus refers to remote resources, so the benchmark runs offline.
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore '
+         'et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi').split()
+START_DATE = datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc)
+
+def text(rnd, words):
+  return ' '.join(rnd.choice(WORDS) for _ in range(words))
+
+def png(rnd, width, height):
+  """Return a PNG image of random colored stripes"""
+  rows = []
+  for y in range(height):
+    if y % 8 == 0:
+      color = bytes([rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)])
+    rows.append(b'\x00' + color * width)
+  def chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+  return (b'\x89PNG\r\n\x1a\n'
+    + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+    + chunk(b'IDAT', zlib.compress(b''.join(rows)))
+    + chunk(b'IEND', b''))
+
+def new_message(rnd, index, subject):
+  message = EmailMessage()
+  message['From'] = 'Sender %d <sender%d@example.com>' % (index, index)
+  message['To'] = 'Recipient <recipient@example.com>'
+  message['Cc'] = 'Copy <copy@example.com>'
+  message['Subject'] = '%s %d: %s' % (subject, index, text(rnd, 5))
+  message['Date'] = format_datetime(START_DATE + datetime.timedelta(hours=index))
+  message['Message-ID'] = '<%s-%d@example.com>' % (subject.lower().replace(' ', '-'), index)
+  return message
+
+def plain_email(rnd, index):
+  message = new_message(rnd, index, 'Plain')
+  message.set_content('\n\n'.join(text(rnd, 80) for _ in range(40)))
+  return message
+
+def newsletter_email(rnd, index):
+  message = new_message(rnd, index, 'Newsletter')
+  message.set_content(text(rnd, 200))
+  rows = []
+  for i in range(300):
+    rows.append('<tr><td id="cell%d" style="display:inline-block;width:100%%;padding:4px;color:#%06x">'
+      '<a name="a%d" href="#cell%d">%s</a></td><td style="font-size:12px">%s</td></tr>'
+      % (i, rnd.randrange(2**24), i, i, text(rnd, 4), text(rnd, 30)))
+  message.add_alternative('<html><head><style>td { font-family: sans-serif; }</style></head><body>'
+    '<table style="width:100%%">%s</table></body></html>' % ''.join(rows), subtype='html')
+  return message
+
+def inline_images_email(rnd, index):
+  message = new_message(rnd, index, 'Inline images')
+  message.set_content(text(rnd, 50))
+  images = ''.join('<p>%s<img src="cid:image%d@example.com"></p>' % (text(rnd, 20), i) for i in range(30))
+  message.add_alternative('<html><body>%s</body></html>' % images, subtype='html')
+  html_part = message.get_payload()[1]
+  for i in range(30):
+    html_part.add_related(png(rnd, 120, 40), 'image', 'png', cid='<image%d@example.com>' % i)
+  return message
+
+def large_attachments_email(rnd, index):
+  message = new_message(rnd, index, 'Large attachments')
+  message.set_content(text(rnd, 100))
+  for i in range(3):
+    message.add_attachment(rnd.randbytes(4 * 1024 * 1024), maintype='application', subtype='octet-stream', filename='data%d.bin' % i)
+  return message
+
+def nested_email(rnd, index):
+  message = plain_email(rnd, index)
+  for depth in range(5):
+    forward = new_message(rnd, index, 'Fwd level %d' % depth)
+    forward.set_content(text(rnd, 40))
+    forward.add_alternative('<html><body><p>%s<img src="cid:logo%d@example.com"></p></body></html>' % (text(rnd, 40), depth), subtype='html')
+    forward.get_payload()[1].add_related(png(rnd, 64, 64), 'image', 'png', cid='<logo%d@example.com>' % depth)
+    forward.add_attachment(message)
+    message = forward
+  return message
+
+def deep_markup_email(rnd, index):
+  message = new_message(rnd, index, 'Deep markup')
+  message.set_content(text(rnd, 50))
+  depth = 600
+  message.add_alternative('<html><body>%s%s%s</body></html>' % ('<div style="margin-left:1px">' * depth, text(rnd, 50), '</div>' * depth), subtype='html')
+  return message
+
+SHAPES = {
+  'plain': plain_email,
+  'newsletter': newsletter_email,
+  'inline_images': inline_images_email,
+  'large_attachments': large_attachments_email,
+  'nested': nested_email,
+  'deep_markup': deep_markup_email,
+}
+
+def fix_boundaries(message, prefix):
+  """Replace the random MIME boundaries so the same seed always produces the same bytes"""
+  # walk also goes through the parts of attached emails
+  for number, part in enumerate(message.walk()):
+    if part.get_content_maintype() == 'multipart':
+      part.set_boundary('==%s-%d==' % (prefix, number))
+
+def generate_corpus(directory, count, seed=0):
+  """
+  Write `count` emails of every shape to directory
+  Returns:
+      dictionary of shape to list of EML filenames
+  """
+  corpus = {}
+  for shape, generator in SHAPES.items():
+    rnd = random.Random('%s-%s' % (seed, shape))
+    corpus[shape] = []
+    for index in range(count):
+      message = generator(rnd, index)
+      fix_boundaries(message, '%s-%d' % (shape, index))
+      filename = os.path.join(directory, '%s-%03d.eml' % (shape, index))
+      with open(filename, 'wb') as file:
+        file.write(message.as_bytes())
+      corpus[shape].append(filename)
+  return corpus
+
+# modules console.py must not import before it knows there is something to convert or watch
+HEAVY_MODULES = ['weasyprint', 'eml_parser', 'html5lib', 'tinycss2', 'watchdog', 'PIL', 'send2trash', 'pydyf']
+BASE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+def measure_startup(repeat=5):
+  """
+  Measure how long `console.py --help` takes in a fresh interpreter
+  Returns:
+      result dictionary with the best time of repeat runs and the heavy modules imported
+  """
+  command = [sys.executable, os.path.join(BASE_DIRECTORY, 'console.py'), '--help']
+  times = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+    times.append(time.perf_counter() - start)
+  # -X importtime lists every imported module on stderr, nested modules are indented
+  output = subprocess.run([sys.executable, '-X', 'importtime'] + command[1:], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True).stderr
+  imported = set(line.split('|')[-1].strip() for line in output.splitlines() if line.startswith('import time:'))
+  return {'seconds': min(times), 'heavy_modules': [module for module in HEAVY_MODULES if module in imported]}
+
+def run_shape(filenames, repeat):
+  """
+  Convert the files of one shape in the current process
+  Returns:
+      result dictionary of the shape
+  """
+  from common import convert
+  # the first conversion loads fonts and stylesheets, keep it out of the measure
+  convert(filenames[0])
+  start_rss = peak_rss()
+  records = []
+  start = time.perf_counter()
+  for _ in range(repeat):
+    for filename in filenames:
+      profile = Profile(filename)
+      convert(filename, False, profile)
+      records.append(profile.record)
+  seconds = time.perf_counter() - start
+  email_bytes = sum(record['sizes']['email_bytes'] for record in records)
+  return {
+    'files': len(records),
+    'seconds': seconds,
+    'files_per_second': len(records) / seconds,
+    'megabytes_per_second': email_bytes / 2**20 / seconds,
+    'peak_rss_mb': peak_rss() / 2**20,
+    'rss_growth_mb': (peak_rss() - start_rss) / 2**20,
+    'stages': {stage: statistics.median(record['stages'][stage]['seconds'] for record in records) for stage in STAGES},
+  }
+
+def compare(results, baseline, tolerance):
+  """
+  Compare results to a baseline
+  Returns:
+      list of regression messages
+  """
+  regressions = []
+  for shape, result in results.items():
+    if shape == 'startup':
+      if len(result['heavy_modules']) > 0:
+        regressions.append('startup: console.py --help imports %s' % ', '.join(result['heavy_modules']))
+      # ignore differences too small to be measured reliably
+      if shape in baseline and result['seconds'] > max(baseline[shape]['seconds'] * (1 + tolerance), baseline[shape]['seconds'] + 0.02):
+        regressions.append('startup: %.3fs, baseline %.3fs' % (result['seconds'], baseline[shape]['seconds']))
+      continue
+    if shape not in baseline:
+      continue
+    base = baseline[shape]
+    if result['files_per_second'] < base['files_per_second'] * (1 - tolerance):
+      regressions.append('%s: throughput %.2f files/s, baseline %.2f files/s' % (shape, result['files_per_second'], base['files_per_second']))
+    if result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+      regressions.append('%s: peak RSS %.1f MB, baseline %.1f MB' % (shape, result['peak_rss_mb'], base['peak_rss_mb']))
+    for stage in STAGES:
+      # ignore stages too short to be measured reliably
+      if result['stages'][stage] > max(base['stages'][stage] * (1 + tolerance), 0.005):
+        regressions.append('%s: %s stage %.3fs, baseline %.3fs' % (shape, stage, result['stages'][stage], base['stages'][stage]))
+  return regressions
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark EML to PDF conversion on a synthetic corpus.', prog='python benchmark.py')
+  parser.add_argument('-n', '--count', dest='count', type=int, default=5,
+                      help='Number of emails generated per shape (default: 5)')
+  parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=1,
+                      help='Number of times every email is converted (default: 1)')
+  parser.add_argument('-s', '--shape', dest='shapes', action='append', choices=list(SHAPES.keys()),
+                      help='Only run this shape, can be repeated (default: all shapes)')
+  parser.add_argument('--startup-only', dest='startupOnly', action='store_true',
+                      help='Only measure the start time of console.py, not the conversions (default: NO)')
+  parser.add_argument('--seed', dest='seed', type=int, default=0,
+                      help='Seed of the corpus generator (default: 0)')
+  parser.add_argument('--corpus', dest='corpus', default=None, metavar='directory',
+                      help='Keep the generated corpus in this directory (default: a temporary directory)')
+  parser.add_argument('-b', '--baseline', dest='baseline', default='benchmark_baseline.json', metavar='file',
+                      help='Baseline results to compare to (default: benchmark_baseline.json)')
+  parser.add_argument('--save-baseline', dest='saveBaseline', action='store_true',
+                      help='Store the results as the new baseline (default: NO)')
+  parser.add_argument('-t', '--tolerance', dest='tolerance', type=float, default=0.2,
+                      help='Relative slowdown or memory growth reported as a regression (default: 0.2)')
+  args = parser.parse_args()
+
+  results = {'startup': measure_startup()}
+  print('%-18s %6.3f s to show --help%s' % ('startup', results['startup']['seconds'],
+    ', imports ' + ', '.join(results['startup']['heavy_modules']) if len(results['startup']['heavy_modules']) > 0 else ''))
+
+  with tempfile.TemporaryDirectory() as temporary_directory:
+    directory = args.corpus or temporary_directory
+    os.makedirs(directory, exist_ok=True)
+    corpus = generate_corpus(directory, args.count, args.seed) if not args.startupOnly else {}
+
+    for shape in [] if args.startupOnly else args.shapes or SHAPES.keys():
+      # a fresh process per shape, so that the peak memory belongs to that shape only
+      with ProcessPoolExecutor(max_workers=1) as executor:
+        results[shape] = executor.submit(run_shape, corpus[shape], args.repeat).result()
+      result = results[shape]
+      print('%-18s %6.2f files/s %8.2f MB/s %8.1f MB peak  %s' % (
+        shape, result['files_per_second'], result['megabytes_per_second'], result['peak_rss_mb'],
+        ' '.join('%s %.3fs' % (stage, result['stages'][stage]) for stage in STAGES)))
+
+  if args.saveBaseline:
+    with open(args.baseline, 'w') as file:
+      json.dump(results, file, indent=2)
+    print('Baseline stored to ' + args.baseline)
+  else:
+    baseline = {}
+    if os.path.isfile(args.baseline):
+      with open(args.baseline, 'r') as file:
+        baseline = json.load(file)
+    regressions = compare(results, baseline, args.tolerance)
+    if len(regressions) > 0:
+      print('Regressions compared to %s:\n  %s' % (args.baseline, '\n  '.join(regressions)))
+      sys.exit(1)
+    if len(baseline) > 0:
+      print('No regression compared to ' + args.baseline)
+
+if __name__ == '__main__':
+  main()
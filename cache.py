@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+# Bump this when a change in common.py changes the produced PDF files,
+# so that PDF files rendered by older code are not considered up to date anymore
+CONVERTER_VERSION = '2'
+
+BASE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+CHUNK_SIZE = 1024 * 1024
+# directory of the cache files of this program in the cache directory of the user
+CACHE_DIRECTORY_NAME = 'eml-to-pdf'
+
+def user_cache_directory():
+  """
+  Return the directory of the cache files of the current user, creating it if needed:
+  ~/Library/Caches/eml-to-pdf on macOS, $XDG_CACHE_HOME/eml-to-pdf or ~/.cache/eml-to-pdf elsewhere
+  """
+  if sys.platform == 'darwin':
+    base = os.path.expanduser('~/Library/Caches')
+  else:
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+  directory = os.path.join(base, CACHE_DIRECTORY_NAME)
+  os.makedirs(directory, exist_ok=True)
+  return directory
+
+def file_hash(filename):
+  """Return the SHA-256 hex digest of a file, read in chunks so big emails are not loaded at once"""
+  digest = hashlib.sha256()
+  with open(filename, 'rb') as file:
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+def data_hash(data):
+  """Return the SHA-256 hex digest of bytes, like file_hash for an email that is not in a file"""
+  return hashlib.sha256(data).hexdigest()
+
+def converter_version(options={}):
+  """
+  Fingerprint everything other than the email that changes the PDF output
+  Arguments:
+      options: dictionary of keyword arguments of common.Converter
+  Returns:
+      hex digest of the converter version and options, header template, stylesheet and WeasyPrint version
+  """
+  digest = hashlib.sha256(CONVERTER_VERSION.encode())
+  digest.update(json.dumps(options, sort_keys=True).encode())
+  for name in ('header.html', 'stylesheets.css'):
+    with open(os.path.join(BASE_DIRECTORY, name), 'rb') as file:
+      digest.update(file.read())
+  # imported here because it is slow to import and only needed when there is something to convert
+  import importlib.metadata
+  try:
+    digest.update(importlib.metadata.version('weasyprint').encode())
+  except importlib.metadata.PackageNotFoundError:
+    pass
+  return digest.hexdigest()
+
+class ConversionCache:
+  """
+  Persistent record of the PDF files produced from EML files, stored in a SQLite file.
+  A PDF file is current when it was rendered from an EML file with the same content by the same
+  converter version, and the PDF file was not changed or removed since.
+  """
+
+  def __init__(self, path, options={}):
+    """
+    Arguments:
+        path: SQLite file of the cache
+        options: dictionary of keyword arguments of common.Converter used for the conversions
+    """
+    self.version = converter_version(options)
+    self.lock = threading.Lock()
+    self.connection = sqlite3.connect(path, check_same_thread=False)
+    with self.lock, self.connection:
+      self.connection.execute("""
+        CREATE TABLE IF NOT EXISTS conversions (
+          pdf_filename TEXT PRIMARY KEY,
+          eml_hash TEXT NOT NULL,
+          version TEXT NOT NULL,
+          pdf_hash TEXT NOT NULL,
+          pdf_size INTEGER NOT NULL,
+          pdf_mtime INTEGER NOT NULL
+        )""")
+
+  def is_current(self, pdf_filename, eml_hash):
+    """Check if pdf_filename was rendered from an EML file with content hash eml_hash and is unchanged since"""
+    with self.lock:
+      row = self.connection.execute(
+        "SELECT eml_hash, version, pdf_size, pdf_mtime FROM conversions WHERE pdf_filename = ?",
+        (os.path.abspath(pdf_filename),)).fetchone()
+    if row == None or row[0] != eml_hash or row[1] != self.version:
+      return False
+    try:
+      stat = os.stat(pdf_filename)
+    except OSError:
+      return False
+    # size and modification time tell us the PDF file is untouched without hashing it again
+    return stat.st_size == row[2] and stat.st_mtime_ns == row[3]
+
+  def store(self, pdf_filename, eml_hash):
+    """Record that pdf_filename was just rendered from an EML file with content hash eml_hash"""
+    stat = os.stat(pdf_filename)
+    pdf_hash = file_hash(pdf_filename)
+    with self.lock, self.connection:
+      self.connection.execute(
+        "INSERT OR REPLACE INTO conversions (pdf_filename, eml_hash, version, pdf_hash, pdf_size, pdf_mtime) VALUES (?, ?, ?, ?, ?, ?)",
+        (os.path.abspath(pdf_filename), eml_hash, self.version, pdf_hash, stat.st_size, stat.st_mtime_ns))
+
+  def close(self):
+    with self.lock:
+      self.connection.close()
@@ -0,0 +1,63 @@
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+
+# Keep this module free of the conversion libraries: it is imported by the thin client,
+# which should start instantly and leave the heavy lifting to the server started with `console.py --serve`
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'eml2pdf.sock')
+
+class RemoteConversionError(Exception):
+  """Conversion failed inside the server, the message contains the server side traceback"""
+
+def submit(filenames, socket_path=DEFAULT_SOCKET, log=False):
+  """
+  Send EML files to a running conversion server and yield the results in completion order
+  Arguments:
+      filenames: list of EML filenames
+      socket_path: Unix domain socket the server listens on
+      log: ask the server to store output to log files
+  Returns:
+      generator of (filename, pdf_filename, exception) tuples, exception is None on success
+  """
+  # the server may run from another directory, so always send absolute paths
+  paths = {os.path.abspath(filename): filename for filename in filenames}
+  request = {'filenames': list(paths.keys()), 'log': log}
+  with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+    connection.connect(socket_path)
+    connection.sendall((json.dumps(request) + '\n').encode())
+    with connection.makefile('rb') as response:
+      for line in response:
+        result = json.loads(line)
+        filename = paths.get(result.get('filename'), result.get('filename'))
+        if result.get('error') == None:
+          yield filename, result.get('pdf_filename'), None
+        else:
+          yield filename, None, RemoteConversionError(result.get('error'))
+
+def main():
+  parser = argparse.ArgumentParser(description='Convert EML to PDF with a running conversion server.', prog='python client.py')
+  parser.add_argument('filenames', metavar='eml_files', type=str, nargs='+',
+                      help='EML filenames')
+  parser.add_argument('-s', '--socket', dest='socket', default=DEFAULT_SOCKET, metavar='path',
+                      help='Socket of the conversion server (default: %s)' % DEFAULT_SOCKET)
+  parser.add_argument('-l', '--log', dest='logFile', action='store_true',
+                      help='Store output to a log file (default: NO)')
+  args = parser.parse_args()
+
+  failed = False
+  try:
+    for filename, pdf_filename, error in submit(args.filenames, args.socket, args.logFile):
+      if error == None:
+        print(pdf_filename)
+      else:
+        failed = True
+        print('Failed to convert %s:\n%s' % (filename, error), file=sys.stderr)
+  except OSError as e:
+    parser.exit(2, 'Cannot connect to the conversion server at %s (%s). Start it with: python console.py --serve\n' % (args.socket, e))
+  sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+  main()
@@ -1,9 +1,6 @@
 
-import eml_parser
-from weasyprint import HTML, Attachment, CSS
-from io import BytesIO
 import base64
-from send2trash import send2trash
+from io import BytesIO
 import json
 import datetime
 import sys
@@ -12,10 +9,31 @@ import tinycss2
 import html
 import logging
 import os
+import re
+import itertools
+from profiling import NullProfile
+from spool import attachment_file, attachment_chunks, attachment_data, parse_email, DEFAULT_SPOOL_THRESHOLD
+from images import ImageOptimizer, DEFAULT_IMAGE_QUALITY
+from fetcher import CachingUrlFetcher, find_urls, DEFAULT_CACHE_SIZE, DEFAULT_FETCH_TIMEOUT
+from nested import NestedEmailParser, is_email, content_hash, content_ids, DEFAULT_NESTED_DEPTH
+import plaintext
 
 TEXT_PLAIN = 'text/plain'
 TEXT_HTML = 'text/html'
 RECURSION_LIMIT = 5000
+# header.html and stylesheets.css are next to this file, whatever the current directory is
+BASE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# cid:CONTENT_ID reference to an attachment. The content ID ends at a space, a quote, an angle bracket, a parenthesis
+# or the end of the body, like in src="cid:a", src=cid:a> or url(cid:a), and the slash of an unquoted self-closing tag
+# like src=cid:a/> is not part of it. The whole content ID must match, cid:img10 does not refer to img1.
+CONTENT_ID_PATTERN = re.compile(r'cid:([^\s"\'<>()]+?)(?=/?>|[\s"\'<>()]|$)')
+
+# in an archive, every email gets a bookmark and the headings of the emails don't
+ARCHIVE_STYLESHEET = """
+h1, h2, h3, h4, h5, h6 { bookmark-level: none; }
+.archive-email-1 { bookmark-level: 1; bookmark-label: attr(data-bookmark); }
+.archive-email-2 { bookmark-level: 2; bookmark-label: attr(data-bookmark); }
+"""
 
 # Some HTML has multiple nested element, so python catches "RecursionError: maximum recursion depth exceeded in comparison"
 # We need this to increase the limit
@@ -30,11 +48,6 @@ class RecursionLimit:
   def __exit__(self, type, value, tb):
       sys.setrecursionlimit(self.old_limit)
 
-class NamedBytesIO(BytesIO):
-  def __init__(self,*args,**kwargs):
-    BytesIO.__init__(self, *args)
-    self.name = kwargs.get('name')
-
 def json_serial(obj):
   if isinstance(obj, datetime.datetime):
       serial = obj.isoformat()
@@ -45,15 +58,185 @@ def check_attribute(obj, name, value):
   return hasattr(obj, name) and getattr(obj, name) == value
 
 
-def parse_attachments(parsed_eml, ep, body):
+def read_email(source):
+  """Return the raw email given as filename, bytes or binary file object"""
+  if isinstance(source, (bytes, bytearray)):
+    return source
+  if hasattr(source, 'read'):
+    return source.read()
+  with open(source, 'rb') as file:
+    return file.read()
+
+def choose_body(parsed_eml):
+  """
+  Choose the body to show of a parsed email: its HTML body, else its plain text body
+  Returns:
+      body: content of the body
+      is_html: whether the body is HTML
+  """
+  bodies = {}
+  # we only parse for the first two bodies for content type text/plain and text/html
+  # because some emails are plain and contain an other emails in the attachments
+  for body in parsed_eml['body'][:2]:
+    if (body.get('content_type') != None):
+      if (bodies.get(body.get('content_type')) == None): # only accept the first of each content_type if there are multiple
+        bodies[body.get('content_type')] = body.get('content')
+    
+  content_string = bodies.get(TEXT_PLAIN) if bodies.get(TEXT_HTML) == None else bodies.get(TEXT_HTML)
+  if (content_string == None): # when there is no body content as text/plain or text/html, we use no type content
+    no_type_content = ''
+    for body in parsed_eml['body']:
+      if (body.get('content_type') == None):
+        no_type_content = no_type_content + body.get('content')
+      else:
+        break
+    content_string = no_type_content
+  return content_string, bodies.get(TEXT_HTML) != None
+
+def index_content_ids(attachments, nested_content_ids):
+  """
+  Index the attachments that can be placed in the body by content ID, so that all cid:CONTENT_ID references
+  are replaced in one pass over the body instead of copying the whole body once per attachment
+  Arguments:
+      attachments: list of attachments of the parsed email
+      nested_content_ids: content IDs of the attachments of nested emails, which are not placed in the body
+  Returns:
+      dictionary of content ID without angle brackets to (index of the attachment, content type)
+  """
+  inline_attachments = {}
+  for index, attachment in enumerate(attachments):
+    if (
+      attachment.get('content_header') != None 
+      and attachment.get('part') != None
+      and attachment.get('content_header').get('content-id') != None 
+      and attachment.get('content_header').get('content-id')[0] != None
+      and attachment.get('content_header').get('content-id')[0] not in nested_content_ids
+    ):
+      content_id = attachment.get('content_header').get('content-id')[0][1:-1] 
+      # content type is like: image/png; name="image001.png"
+      # we don't need the name after ;
+      content_type = attachment.get('content_header').get('content-type')[0]
+      if (';' in  content_type): 
+        content_type = content_type[:content_type.index(';')] 
+      # when several attachments have the same content ID, the first one is used
+      if content_type and content_id not in inline_attachments:
+        inline_attachments[content_id] = (index, content_type)
+  return inline_attachments
+
+def placed_content_ids(nested_email):
+  """
+  Find the attachments of a nested email shown after the body that are placed in its body, or in the bodies of the emails nested in it,
+  like inline_content_ids does when the nested email is shown
+  Arguments:
+      nested_email: NestedEmail shown after the body
+  Returns:
+      set of the content IDs of the placed attachments, with their angle brackets
+  """
+  excluded = set()
+  for child in nested_email.children:
+    excluded.update(placed_content_ids(child))
+  attachments = nested_email.parsed_eml.get('attachment') or []
+  inline_attachments = index_content_ids(attachments, excluded)
+  body, _ = choose_body(nested_email.parsed_eml)
+  placed = set(excluded)
+  for content_id in CONTENT_ID_PATTERN.findall(body):
+    if content_id in inline_attachments:
+      placed.add(attachments[inline_attachments[content_id][0]].get('content_header').get('content-id')[0])
+  return placed
+
+def nested_content_ids(nested_emails, inline_nested):
+  """
+  Find the attachments of nested emails that are not attached with the email containing them.
+  eml_parser lists the attachments of nested emails with the attachments of the email containing them.
+  An attached nested email holds its attachments, but a nested email shown after the body only shows the images placed in its body.
+  Arguments:
+      nested_emails: list of NestedEmail of the emails attached to an email
+      inline_nested: whether the nested emails are shown after the body instead of attached
+  Returns:
+      set of the content IDs of the attachments, with their angle brackets
+  """
+  ids = set()
+  for nested_email in nested_emails:
+    ids.update(placed_content_ids(nested_email) if inline_nested else content_ids(nested_email.parsed_eml))
+  return ids
+
+def inline_content_ids(attachments, body, nested_content_ids, image_optimizer=None):
+  """
+  Replace images in the body with attached images
+  Arguments:
+      attachments: list of attachments of the parsed email
+      body: body content of the email
+      nested_content_ids: content IDs of the attachments of nested emails, which are not placed in the body
+      image_optimizer: ImageOptimizer applied to the images placed in the body
+  Returns:
+      body: new content body
+      placed: set of the indexes of the attachments placed in the body
+  """
+  inline_attachments = index_content_ids(attachments, nested_content_ids)
+
+  # find the content ID in the form cid:CONTENT_ID and replace it with base64 representation of the images
+  data_uris = {}
+  def replace_content_id(match):
+    if match.group(1) not in inline_attachments:
+      return match.group(0)
+    index, content_type = inline_attachments[match.group(1)]
+    if index not in data_uris:
+      # only the images placed in the body are decoded from their MIME part and encoded again in base64
+      data = base64.b64encode(attachment_data(attachments[index]))
+      if image_optimizer != None:
+        content_type, data = image_optimizer.optimize(content_type, data)
+      data_uris[index] = 'data:' + content_type + ';base64,' + data.decode()
+    return data_uris[index]
+  body = CONTENT_ID_PATTERN.sub(replace_content_id, body)
+  return body, set(data_uris)
+
+def attached_files(attachments, placed, nested_content_ids, shown_emails):
+  """
+  Find the attachments to attach to the PDF
+  Arguments:
+      attachments: list of attachments of the parsed email
+      placed: indexes of the attachments placed in the body
+      nested_content_ids: content IDs of the attachments of nested emails
+      shown_emails: content hashes of the nested emails shown in the PDF
+  Returns:
+      list of (index, filename) of the attachments to attach
+  """
+  files = []
+  for index, attachment in enumerate(attachments):
+    if (
+      attachment.get('content_header') == None 
+      or attachment.get('part') == None
+      # Only attach file if it was not placed somewhere in html or in nested emails
+      or index in placed
+      or (attachment.get('content_header').get('content-id') != None 
+          and attachment.get('content_header').get('content-id')[0] != None
+          and attachment.get('content_header').get('content-id')[0] in nested_content_ids)
+      or (is_email(attachment) and content_hash(attachment) in shown_emails)
+    ):
+      continue
+    attachment_filename = attachment.get('filename')
+    content_type = attachment.get('content_header').get('content-type')[0]
+    # when the attachment is an email but the filename does not contain an extension
+    if '.' not in attachment_filename:
+      if content_type.lower().startswith('message/rfc822'):
+        attachment_filename = 'Mail Attachment.eml'
+      elif content_type.lower().startswith('image/'):
+        attachment_filename = attachment.get('filename') + '.' + content_type.lower()[len('image/'):]
+    files.append((index, attachment_filename))
+  return files
+
+def parse_attachments(parsed_eml, nested_emails, body, image_optimizer=None, spool_threshold=DEFAULT_SPOOL_THRESHOLD, inline_nested=False):
   """
   Parse eml for attachments and replace images in the body with attached images 
   Arguments:
       parsed_eml: parsed result of the email
-      ep: parser
+      nested_emails: list of NestedEmail of the emails attached to the email
       body: body content of he email
+      image_optimizer: ImageOptimizer applied to the images placed in the body
+      spool_threshold: attachments larger than this number of bytes are decoded to temporary files instead of memory
+      inline_nested: the nested emails are shown after the body, so they are not attached
   Returns:
-      attachments: list of Attachment object
+      attachments: list of file objects of the attachments, named after their filename
       attachment_filenames: list of attachment filenames
       body: new content body
   """
@@ -62,244 +245,526 @@ def parse_attachments(parsed_eml, ep, body):
   attachments = []
   attachment_filenames = []
   if (parsed_eml.get('attachment') != None):
-    # parse nested emails for content_id of nested attachments
+    # content IDs of the attachments of nested emails,
     # so that we knows which attachments are for nested emails, then we don't include those attachments in the main email
-    nested_content_ids = []
-    for attachment in parsed_eml.get('attachment'):
-      content_type = attachment.get('content_header').get('content-type')[0]
-      if content_type.lower().startswith('message/rfc822'):
-        nested_raw_email = base64.b64decode(attachment.get('raw'))
-        nested_parsed_eml = ep.decode_email_bytes(nested_raw_email)
-        if (nested_parsed_eml.get('attachment') != None):
-          for nested_attachment in nested_parsed_eml.get('attachment'):
-            if (nested_attachment.get('content_header').get('content-id') 
-                and len(nested_attachment.get('content_header').get('content-id')) > 0):
-              nested_content_ids = nested_content_ids + nested_attachment.get('content_header').get('content-id')
-
-    for attachment in parsed_eml.get('attachment'):
-      # attachment['raw'] is not actually raw. They are base64 encoded by eml_parser before returning to us.
-      if (
-        attachment.get('content_header') != None 
-        and attachment.get('raw') != None
-      ):
-        found_and_replaced = False
-        if (attachment.get('content_header').get('content-id') != None 
-            and attachment.get('content_header').get('content-id')[0] != None):
-          if (attachment.get('content_header').get('content-id')[0] in nested_content_ids):
-            found_and_replaced = True
-          else:
-            # find the content ID in the form cid:CONTENT_ID and replace it with base64 representation of the images
-            content_id = attachment.get('content_header').get('content-id')[0][1:-1] 
-            find = 'cid:' + content_id
-            
-            # content type is like: image/png; name="image001.png"
-            # we don't need the name after ;
-            content_type = attachment.get('content_header').get('content-type')[0]
-            if (';' in  content_type): 
-              content_type = content_type[:content_type.index(';')] 
-            
-            # find and replace 
-            if (content_id != None and find in body and content_type):
-              repl = 'data:' + content_type + ';base64,' + attachment.get('raw').decode()
-              body = body.replace(find, repl)
-              found_and_replaced = True
-
-        # Only attach file if it was not placed somewhere in html or in nested emails
-        if not found_and_replaced:
-          attachment_filename = attachment.get('filename')
-          content_type = attachment.get('content_header').get('content-type')[0]
-          # when the attachment is an email but the filename does not contain an extension
-          if '.' not in attachment_filename:
-            if content_type.lower().startswith('message/rfc822'):
-              attachment_filename = 'Mail Attachment.eml'
-            elif content_type.lower().startswith('image/'):
-              attachment_filename = attachment.get('filename') + '.' + content_type.lower()[len('image/'):]
-
-          file = NamedBytesIO(base64.b64decode(attachment.get('raw')), name=attachment_filename)
-          attachments.append(Attachment(file_obj=file))
-          attachment_filenames.append(attachment_filename)
+    excluded_content_ids = nested_content_ids(nested_emails, inline_nested)
+    shown_emails = set(node.key for nested_email in nested_emails for node in nested_email.walk()) if inline_nested else set()
+
+    body, placed = inline_content_ids(parsed_eml.get('attachment'), body, excluded_content_ids, image_optimizer)
+
+    for index, attachment_filename in attached_files(parsed_eml.get('attachment'), placed, excluded_content_ids, shown_emails):
+      attachment = parsed_eml.get('attachment')[index]
+      file = attachment_file(attachment_chunks(attachment), attachment_filename, spool_threshold)
+      # the encoded content held by the MIME part is not needed anymore
+      attachment['part'] = None
+      attachments.append(file)
+      attachment_filenames.append(attachment_filename)
   return [attachments, attachment_filenames, body]
 
-def generate_header(parsed_eml, attachment_filenames):
+def strip_id(element):
   """
-  Generate the header section contain to/from/cc/bcc/subject/attachments
+  Because of bug: https://github.com/Kozea/WeasyPrint/issues/1733 
+  cause attachments failed to be attached, so we need to delete the ID attribute of any tags
+  """
+  if 'id' in element.attrib:
+    del element.attrib['id']
+
+def strip_anchor_name(element):
+  """Same as strip_id for the name attribute of anchor tags"""
+  if element.tag == 'a' and 'name' in element.attrib:
+    del element.attrib['name']
+
+def fix_inline_block_width(element):
+  """
+  element with display:inline-block and width:100% can create truncate issue in rendering PDF
+  here if the element has both of those styles, we remove display:inline-block
+  """
+  style = element.attrib.get('style')
+  # most styles can't contain both declarations, skip parsing those
+  if style == None or '%' not in style or 'inline-block' not in style.lower():
+    return
+  declarations = tinycss2.parse_declaration_list(style)
+  found_width_100_percent = False
+  found_display_inline_block = False
+  for d in declarations:
+    if check_attribute(d, 'name', 'display') and hasattr(d, 'value') and len(d.value) > 0 and check_attribute(d.value[0], 'lower_value', 'inline-block'):
+      found_display_inline_block = True
+    if check_attribute(d, 'name', 'width') and hasattr(d, 'value') and len(d.value) > 0 and check_attribute(d.value[0], 'type', 'percentage') and check_attribute(d.value[0], 'value', 100):
+      found_width_100_percent = True
+    
+  if found_width_100_percent and found_display_inline_block:
+    new_styles = []
+    for d in declarations:
+      if not (hasattr(d, 'name') and d.name == 'display' and len(d.value) > 0 and d.value[0].lower_value == 'inline-block'):
+        new_styles.append(d.serialize())
+    element.attrib['style'] = ';'.join(new_styles)
+
+def rewrite_tree(elements, rewriters):
+  """
+  Apply the rewriters to the parsed HTML in a single traversal
+  Arguments:
+      elements: root element returned by html5lib.parse
+      rewriters: list of functions changing an element in place
+  """
+  # like the '*//*' path, the html, head and body elements are not rewritten
+  for top_element in elements:
+    for element in itertools.islice(top_element.iter(), 1, None):
+      for rewriter in rewriters:
+        rewriter(element)
+
+def serialize(elements):
+  """Produce the HTML string of parsed HTML"""
+  s = html5lib.serializer.HTMLSerializer()
+  walker = html5lib.getTreeWalker("etree")
+  stream = walker(elements)
+  output = s.serialize(stream)
+  return ''.join(output)
+
+# rows of the header section, with the key of their text in header_fields
+HEADER_ROWS = [('From:', 'from'), ('Subject:', 'subject'), ('Date:', 'date'), ('To:', 'to'),
+               ('CC:', 'cc'), ('BCC:', 'bcc'), ('Attachments:', 'attachments')]
+
+def header_fields(parsed_eml, attachment_filenames):
+  """
+  Read the fields of the header section
   Arguments:
       parsed_eml: parsed result of the email
       attachment_filenames: list of attachment filenames
   Returns:
-      HTML string of the header 
+      dictionary of from/subject/date/to/cc/bcc/attachments to their text, None for the rows to hide
   """
+  headers = parsed_eml.get('header')
 
-  # create a header section to contain to, from, subject and date
-  with open("header.html", "r") as file:
-    header = file.read()
-  
   # From section
-  from_email = parsed_eml.get('header').get('from')
+  from_email = headers.get('from')
   # if there is header, use header because there is name of email address there
-  if (parsed_eml.get('header').get('header') != None 
-      and parsed_eml.get('header').get('header').get('from') 
-      and len(parsed_eml.get('header').get('header').get('from')) > 0):
-    from_email = html.escape(parsed_eml.get('header').get('header').get('from')[0])
+  if (headers.get('header') != None 
+      and headers.get('header').get('from') 
+      and len(headers.get('header').get('from')) > 0):
+    from_email = headers.get('header').get('from')[0]
 
-  subject = html.escape(parsed_eml.get('header').get('subject'))
+  subject = headers.get('subject')
 
   # Date section
-  if (parsed_eml.get('header').get('received') != None 
-    and len(parsed_eml.get('header').get('received')) > 0):
+  if (headers.get('received') != None 
+    and len(headers.get('received')) > 0):
     # received date in local time
-    date = parsed_eml.get('header').get('received')[0].get('date').astimezone().strftime('%-d %B %Y at %-I:%M:%S %p')
-  elif parsed_eml.get('header').get('date') != None:
+    date = headers.get('received')[0].get('date').astimezone().strftime('%-d %B %Y at %-I:%M:%S %p')
+  elif headers.get('date') != None:
     # if received date is not available, use sent date
-    date = parsed_eml.get('header').get('date').astimezone().strftime('%-d %B %Y at %-I:%M:%S %p')
+    date = headers.get('date').astimezone().strftime('%-d %B %Y at %-I:%M:%S %p')
   else:
     date = 'Unknown'
 
   # To section
-  to_emails = ', '.join(parsed_eml.get('header').get('to'))
-  if (parsed_eml.get('header').get('header') != None 
-      and parsed_eml.get('header').get('header').get('to') 
-      and len(parsed_eml.get('header').get('header').get('to')) > 0):
-    to_emails = html.escape(parsed_eml.get('header').get('header').get('to')[0])
+  to_emails = ', '.join(headers.get('to'))
+  if (headers.get('header') != None 
+      and headers.get('header').get('to') 
+      and len(headers.get('header').get('to')) > 0):
+    to_emails = headers.get('header').get('to')[0]
 
   # CC section
-  display_cc = parsed_eml.get('header').get('cc') != None and len(parsed_eml.get('header').get('cc')) > 0
-  cc_row_display = 'table-row' if display_cc else 'none'
-  cc_emails = ''
-  if (display_cc):
-    cc_emails = ', '.join(parsed_eml.get('header').get('cc'))
+  cc_emails = None
+  if headers.get('cc') != None and len(headers.get('cc')) > 0:
+    cc_emails = ', '.join(headers.get('cc'))
     # if there is header, use header because there is name of email address there
-    if (parsed_eml.get('header').get('header') != None 
-        and parsed_eml.get('header').get('header').get('cc') 
-        and len(parsed_eml.get('header').get('header').get('cc')) > 0):
-      cc_emails = html.escape(parsed_eml.get('header').get('header').get('cc')[0])
+    if (headers.get('header') != None 
+        and headers.get('header').get('cc') 
+        and len(headers.get('header').get('cc')) > 0):
+      cc_emails = headers.get('header').get('cc')[0]
 
   # BCC section
-  display_bcc = parsed_eml.get('header').get('header').get('bcc') != None and len(parsed_eml.get('header').get('header').get('bcc')) > 0
-  bcc_row_display = 'table-row' if display_bcc else 'none'
-  bcc_emails = ''
-  if (parsed_eml.get('header').get('header') != None 
-      and parsed_eml.get('header').get('header').get('bcc') 
-      and len(parsed_eml.get('header').get('header').get('bcc')) > 0):
-    bcc_emails = html.escape(parsed_eml.get('header').get('header').get('bcc')[0])
-
-  attachment_row_display = 'table-row' if len(attachment_filenames) > 0 else 'none'
-  attachment_filenames = ', '.join(attachment_filenames)
-  header = header % (from_email, subject, date, to_emails, cc_row_display, cc_emails, bcc_row_display, bcc_emails, attachment_row_display, attachment_filenames)
-  return header
-
-def convert(filename, log=False):
-  if log:
+  bcc_emails = None
+  if (headers.get('header') != None 
+      and headers.get('header').get('bcc') 
+      and len(headers.get('header').get('bcc')) > 0):
+    bcc_emails = headers.get('header').get('bcc')[0]
+
+  attachments = ', '.join(attachment_filenames) if len(attachment_filenames) > 0 else None
+  return {'from': from_email, 'subject': subject, 'date': date, 'to': to_emails,
+          'cc': cc_emails, 'bcc': bcc_emails, 'attachments': attachments}
+
+def generate_header(parsed_eml, attachment_filenames, template=None):
+  """
+  Generate the header section contain to/from/cc/bcc/subject/attachments
+  Arguments:
+      parsed_eml: parsed result of the email
+      attachment_filenames: list of attachment filenames
+      template: content of header.html, read from the file when not given
+  Returns:
+      HTML string of the header 
+  """
+
+  # create a header section to contain to, from, subject and date
+  if template == None:
+    with open(os.path.join(BASE_DIRECTORY, 'header.html'), 'r') as file:
+      template = file.read()
+
+  fields = header_fields(parsed_eml, attachment_filenames)
+  values = []
+  for label, key in HEADER_ROWS:
+    # the rows after To are hidden when they are empty
+    if key in ('cc', 'bcc', 'attachments'):
+      values.append('table-row' if fields[key] != None else 'none')
+    values.append(html.escape(fields[key] or ''))
+  return template % tuple(values)
+
+class Converter:
+  """
+  Convert EML files to PDF.
+  The header template, the stylesheet and the font configuration are loaded once
+  and shared by all the files converted with the same converter.
+  """
+
+  def __init__(self, max_dpi=None, image_quality=DEFAULT_IMAGE_QUALITY, spool_threshold=DEFAULT_SPOOL_THRESHOLD,
+               url_cache=None, url_cache_size=DEFAULT_CACHE_SIZE, fetch_timeout=DEFAULT_FETCH_TIMEOUT, offline=False,
+               fast_plain_text=True, inline_nested=False, nested_depth=DEFAULT_NESTED_DEPTH):
+    """
+    Arguments:
+        max_dpi: downscale and recompress the images placed in the body to this resolution on the page, None to keep them as they are
+        image_quality: JPEG quality of the recompressed images
+        spool_threshold: attachments larger than this number of bytes are decoded to temporary files instead of memory
+        url_cache: SQLite file caching remote images and stylesheets, None to fetch them again for every email
+        url_cache_size: maximum number of bytes of the URL cache
+        fetch_timeout: seconds to wait for the server of a remote image or stylesheet
+        offline: replace remote images and stylesheets that are not in the URL cache by placeholders instead of fetching them
+        fast_plain_text: draw plain text emails directly with the standard PDF fonts instead of the WeasyPrint layout, when their characters allow it
+        inline_nested: show the attached emails, like forwarded emails, after the body instead of attaching them
+        nested_depth: with inline_nested, emails nested deeper than this stay attached to the email containing them
+    """
+    self.spool_threshold = spool_threshold
+    self.fast_plain_text = fast_plain_text
+    self.inline_nested = inline_nested
+    # without inline_nested, only the emails attached directly are parsed, for the content IDs of their attachments
+    self.nested_parser = NestedEmailParser(nested_depth if inline_nested else 1, spool_threshold=spool_threshold)
+    self.url_fetcher = CachingUrlFetcher(url_cache, url_cache_size, fetch_timeout, offline)
+    self.image_optimizer = None if max_dpi == None else ImageOptimizer(max_dpi, image_quality)
+    with open(os.path.join(BASE_DIRECTORY, 'header.html'), 'r') as file:
+      self.header_template = file.read()
+    # weasyprint is imported by the converter, so that the helpers of this module are usable without its native libraries
+    from weasyprint import CSS
+    from weasyprint.text.fonts import FontConfiguration
+    self.font_config = FontConfiguration()
+    self.stylesheets = [CSS(os.path.join(BASE_DIRECTORY, 'stylesheets.css'), font_config=self.font_config)]
+    self.log_handler = None
+    self.archive_stylesheet = None
+
+  def convert(self, source, log=False, profile=None, pdf_filename=None):
+    """
+    Convert an email to a PDF file
+    Arguments:
+        source: EML filename, raw email as bytes or binary file object to read it from
+        log: store output to log files
+        profile: Profile recording the time, memory and sizes of each stage, nothing is recorded by default
+        pdf_filename: PDF file or binary file object to write, by default the EML filename with a .pdf extension
+    Returns:
+        PDF filename or file object
+    """
+    if pdf_filename == None:
+      if not isinstance(source, (str, os.PathLike)):
+        raise ValueError('pdf_filename is required when converting an email that is not read from a file')
+      pdf_filename = os.path.splitext(source)[0] + '.pdf'
+    if profile == None:
+      profile = NullProfile()
+    if log:
+      self.start_log()
+
+    message = self.read_message(source, log, profile)
+
+    # the nested emails shown after the body need the WeasyPrint layout
+    if self.fast_plain_text and not message['is_html'] and len(message['nested_emails']) == 0:
+      with profile.stage('html'):
+        fields = header_fields(message['parsed_eml'], message['attachment_filenames'])
+        rows = [(label, fields[key]) for label, key in HEADER_ROWS if fields[key] != None]
+        fast = plaintext.can_render(message['body'], *[text for _, text in rows])
+      if fast:
+        with profile.stage('layout'):
+          pages = plaintext.layout(rows, message['body'])
+        profile.size('pages', len(pages))
+        with profile.stage('write'):
+          plaintext.write_pdf(pages, message['attachments'], pdf_filename)
+        return pdf_filename
+
+    from weasyprint import Attachment
+    with RecursionLimit(RECURSION_LIMIT):
+      document = self.render_message(message, log, profile)
+      profile.size('pages', len(document.pages))
+      with profile.stage('write'):
+        document.write_pdf(target=pdf_filename, attachments=[Attachment(file_obj=file) for file in message['attachments']])
+    return pdf_filename
+
+  def convert_archive(self, entries, pdf_filename, log=False):
+    """
+    Convert many emails into one PDF file, each email starting on a new page with a bookmark.
+    The emails are laid out one by one with the shared stylesheets and fonts, then their pages are written once by WeasyPrint.
+    The laid out pages of all the emails stay in memory until the PDF file is written, so the memory used grows
+    with the number of pages of the archive; the attachments larger than the spool threshold wait in temporary files.
+    Arguments:
+        entries: list of (source, bookmark level) tuples in the order of the archive, source like in convert
+        pdf_filename: PDF file or binary file object to write
+        log: store output to log files
+    Returns:
+        list of (index in entries, exception) tuples of the emails that could not be converted and are missing from the archive
+    """
+    from weasyprint import Attachment
+    if log:
+      self.start_log()
+    if self.archive_stylesheet == None:
+      from weasyprint import CSS
+      self.archive_stylesheet = CSS(string=ARCHIVE_STYLESHEET, font_config=self.font_config)
+
+    documents = []
+    attachments = []
+    failed = []
+    # an archive is not profiled
+    profile = NullProfile()
+    with RecursionLimit(RECURSION_LIMIT):
+      try:
+        for index, (source, level) in enumerate(entries):
+          message = None
+          try:
+            message = self.read_message(source, log, profile)
+            fields = header_fields(message['parsed_eml'], message['attachment_filenames'])
+            label = '%s (%s)' % (fields['subject'] or 'No subject', fields['date'])
+            documents.append(self.render_message(message, log, profile, (level, label)))
+          except Exception as e:
+            if message != None:
+              for file in message['attachments']:
+                file.close()
+            failed.append((index, e))
+            continue
+          # the embedded files tell which email they belong to
+          for file in message['attachments']:
+            attachments.append((file, 'Email %d: %s' % (index + 1, label)))
+
+        if len(documents) == 0:
+          raise ValueError('None of the emails could be converted')
+        pages = [page for document in documents for page in document.pages]
+        documents[0].copy(pages).write_pdf(target=pdf_filename, attachments=[
+          Attachment(file_obj=file, description=description) for file, description in attachments])
+      finally:
+        for file, _ in attachments:
+          file.close()
+    return failed
+
+  def start_log(self):
+    """Create the log directory and send the WeasyPrint messages to log/weasyprint.log"""
     if not os.path.exists('log'):
       os.makedirs('log')
 
-    logger = logging.getLogger('weasyprint')
-    logger.addHandler(logging.FileHandler('log/weasyprint.log'))
-
-  # Decode input file
-  with open(filename, 'rb') as file:
-    raw_email = file.read()
-  
-  ep = eml_parser.EmlParser(include_raw_body=True, include_attachment_data=True)
-  parsed_eml = ep.decode_email_bytes(raw_email)
-
-  if log:
-    # log the json for debug purpose
-    with open("log/json.json", "w") as file:
-      file.write(json.dumps(parsed_eml, default=json_serial))
-  
-  # Parse body
-  bodies = {}
-  # we only parse for the first two bodies for content type text/plain and text/html
-  # because some emails are plain and contain an other emails in the attachments
-  for body in parsed_eml['body'][:2]:
-    if (body.get('content_type') != None):
-      if (bodies.get(body.get('content_type')) == None): # only accept the first of each content_type if there are multiple
-        bodies[body.get('content_type')] = body.get('content')
+    if self.log_handler == None:
+      self.log_handler = logging.FileHandler('log/weasyprint.log')
+      logging.getLogger('weasyprint').addHandler(self.log_handler)
+
+  def read_message(self, source, log, profile):
+    """
+    Parse an email, choose its body and decode its attachments
+    Arguments:
+        source: EML filename, raw email as bytes or binary file object to read it from
+        log: store output to log files
+        profile: Profile recording the time, memory and sizes of each stage
+    Returns:
+        dictionary with parsed_eml, body, is_html, attachments (file objects) and attachment_filenames
+    """
+    # Decode input file
+    with profile.stage('parse'):
+      raw_email = read_email(source)
     
-  content_string = bodies.get(TEXT_PLAIN) if bodies.get(TEXT_HTML) == None else bodies.get(TEXT_HTML)
-  if (content_string == None): # when there is no body content as text/plain or text/html, we use no type content
-    no_type_content = ''
-    for body in parsed_eml['body']:
-      if (body.get('content_type') == None):
-        no_type_content = no_type_content + body.get('content')
-      else:
-        break
-    content_string = no_type_content
+      parsed_eml = parse_email(raw_email, self.spool_threshold)
+    profile.size('email_bytes', len(raw_email))
+    # everything we need is in parsed_eml now
+    del raw_email
+
+    if log:
+      # log the json for debug purpose
+      with open("log/json.json", "w") as file:
+        file.write(json.dumps(parsed_eml, default=json_serial))
+    
+    # Parse body
+    content_string, is_html = choose_body(parsed_eml)
 
-  attachments, attachment_filenames, content_string = parse_attachments(parsed_eml, ep, content_string)
-  header = generate_header(parsed_eml, attachment_filenames)
+    profile.size('body_bytes', len(content_string.encode()))
+    profile.size('attachments', len(parsed_eml.get('attachment') or []))
+    profile.size('attachment_bytes', sum(attachment.get('size', 0) for attachment in parsed_eml.get('attachment') or []))
 
-  if bodies.get(TEXT_HTML) == None:
-    content_string = "<pre>%s</pre>" % html.escape(content_string)
-    content_string = header + content_string
-  else:
-    elements = html5lib.parse(content_string, namespaceHTMLElements=False)
-    if len(attachments) > 0: 
-      # Because of bug: https://github.com/Kozea/WeasyPrint/issues/1733 
-      # cause attachments failed to be attached, so we need to look for:
-      # - Any tags with ID attribute
-      # - Anchor tag with name attribute
-      # parse HTML to find the above cases and delete the attributes
-      elements_with_ids = elements.findall('*//*[@id]')
-      for element in elements_with_ids:
-        del element.attrib['id']
-      anchor_with_names = elements.findall('*//a[@name]')
-      for element in anchor_with_names:
-        del element.attrib['name']
-
-    # element with display:inline-block and width:100% can create truncate issue in rendering PDF
-    # here if any element has both of those styles, we remove display:inline-block
-    elements_with_styles = elements.findall('*//*[@style]')
-    for element in elements_with_styles:
-      declarations = tinycss2.parse_declaration_list(element.attrib['style'])
-      found_width_100_percent = False
-      found_display_inline_block = False
-      for d in declarations:
-        if check_attribute(d, 'name', 'display') and hasattr(d, 'value') and len(d.value) > 0 and check_attribute(d.value[0], 'lower_value', 'inline-block'):
-          found_display_inline_block = True
-        if check_attribute(d, 'name', 'width') and hasattr(d, 'value') and len(d.value) > 0 and check_attribute(d.value[0], 'type', 'percentage') and check_attribute(d.value[0], 'value', 100):
-          found_width_100_percent = True
-        
-      if found_width_100_percent and found_display_inline_block:
-        new_styles = []
-        for d in declarations:
-          if not (hasattr(d, 'name') and d.name == 'display' and len(d.value) > 0 and d.value[0].lower_value == 'inline-block'):
-            new_styles.append(d.serialize())
-        element.attrib['style'] = ';'.join(new_styles)
-        
-    # insert header to first child body element if possible
-    # we don't insert to body element because in some emails the first element is a page. 
-    # so anything we put before the first element will push the first element to the 2nd page. 
-    header_inserted = False
-    body_element = elements.find('body') or elements.find('*//body')
-    if (body_element != None):
-      header_elements = html5lib.parse(header, namespaceHTMLElements=False)
-      for child in body_element:
-        child.insert(0, header_elements)
-        # if there is text in child, we want the header element to stay before the text
-        header_elements.tail, child.text = child.text, None
-        header_inserted = True
-        break
+    with profile.stage('attachments'):
+      nested_emails = self.nested_parser.nested_emails(parsed_eml)
+      attachments, attachment_filenames, content_string = parse_attachments(
+        parsed_eml, nested_emails, content_string, self.image_optimizer, self.spool_threshold, self.inline_nested)
+    profile.size('nested_emails', sum(len(list(nested_email.walk())) for nested_email in nested_emails))
+
+    return {'parsed_eml': parsed_eml, 'body': content_string, 'is_html': is_html,
+            'attachments': attachments, 'attachment_filenames': attachment_filenames,
+            'nested_emails': nested_emails if self.inline_nested else []}
+
+  def render_message(self, message, log, profile, bookmark=None):
+    """
+    Lay out an email read by read_message with WeasyPrint
+    Arguments:
+        message: dictionary returned by read_message
+        log: store output to log files
+        profile: Profile recording the time, memory and sizes of each stage
+        bookmark: (level, label) of the bookmark of the email in an archive, None for a single email
+    Returns:
+        WeasyPrint Document
+    """
+    stylesheets = self.stylesheets
+    with profile.stage('html'):
+      header = generate_header(message['parsed_eml'], message['attachment_filenames'], self.header_template)
+      if bookmark != None:
+        # the archive stylesheet turns this into the bookmark of the email
+        header = '<div class="archive-email-%d" data-bookmark="%s">%s</div>' % (bookmark[0], html.escape(bookmark[1]), header)
+        stylesheets = stylesheets + [self.archive_stylesheet]
+      # the IDs of the emails of an archive would collide, and an archive has the attachments of all its emails
+      content_string = self.prepare_html(message['body'], header, message['is_html'], bookmark != None or len(message['attachments']) > 0)
+      content_string += ''.join(self.nested_section(nested_email) for nested_email in message['nested_emails'])
 
-    # produce the new HTML string after removing IDs attributes
-    s = html5lib.serializer.HTMLSerializer()
-    walker = html5lib.getTreeWalker("etree")
-    stream = walker(elements)
-    output = s.serialize(stream)
-    if not header_inserted:
-      content_string = header
+    if log:
+      # log the html for debug purpose
+      with open("log/html.html", "w") as file:
+        file.write(content_string)
+    try:
+      with profile.stage('layout'):
+        # fetch the remote images and stylesheets all at once instead of one after the other during the layout
+        self.url_fetcher.prefetch(find_urls(content_string))
+        from weasyprint import HTML
+        return HTML(string=content_string, url_fetcher=self.url_fetcher).render(stylesheets=stylesheets, font_config=self.font_config)
+    finally:
+      self.url_fetcher.clear()
+
+  def nested_section(self, nested_email):
+    """
+    Produce the HTML showing a nested email after the body of the email containing it
+    Arguments:
+        nested_email: NestedEmail to show, with the emails nested in it
+    Returns:
+        HTML string of its header, its body and the sections of its nested emails
+    """
+    parsed_eml = nested_email.parsed_eml
+    attachments = parsed_eml.get('attachment') or []
+    excluded_content_ids = nested_content_ids(nested_email.children, True)
+    shown_emails = set(node.key for child in nested_email.children for node in child.walk())
+
+    content_string, is_html = choose_body(parsed_eml)
+    content_string, placed = inline_content_ids(attachments, content_string, excluded_content_ids, self.image_optimizer)
+    # the files of nested emails are attached to the PDF with the files of the converted email, the header only lists them
+    attachment_filenames = [filename for _, filename in attached_files(attachments, placed, excluded_content_ids, shown_emails)]
+    header = generate_header(parsed_eml, attachment_filenames, self.header_template)
+
+    if not is_html:
+      content_string = "<pre>%s</pre>" % html.escape(content_string)
     else:
-      content_string = ''
-    for item in output:
-      content_string = content_string + item
-
-  if log:
-    # log the html for debug purpose
-    with open("log/html.html", "w") as file:
-      file.write(content_string)
-  file_witout_extension = os.path.splitext(filename)[0]
-  pdf_filename = file_witout_extension + '.pdf'
-  with RecursionLimit(RECURSION_LIMIT):
-    HTML(string=content_string).write_pdf(target=pdf_filename, attachments=attachments, stylesheets=[CSS('stylesheets.css')])
-  return pdf_filename
+      elements = html5lib.parse(content_string, namespaceHTMLElements=False)
+      # the IDs of the nested email could collide with the ones of the email containing it
+      rewrite_tree(elements, [strip_id, strip_anchor_name, fix_inline_block_width])
+      # the head, with styles meant for the nested email only, is left out
+      body_element = elements.find('body') or elements.find('*//body')
+      if body_element != None:
+        body_element.tag = 'div'
+        body_element.attrib.clear()
+        elements = body_element
+      content_string = serialize(elements)
+
+    sections = ''.join(self.nested_section(child) for child in nested_email.children)
+    return '<div class="nested-email">%s%s%s</div>' % (header, content_string, sections)
+
+  def prepare_html(self, content_string, header, is_html, has_attachments):
+    """
+    Produce the HTML to render from the body of the email
+    Arguments:
+        content_string: body of the email
+        header: HTML of the header section
+        is_html: whether the body is HTML or plain text
+        has_attachments: whether files are attached to the PDF
+    Returns:
+        HTML string
+    """
+    if not is_html:
+      content_string = "<pre>%s</pre>" % html.escape(content_string)
+      content_string = header + content_string
+    else:
+      elements = html5lib.parse(content_string, namespaceHTMLElements=False)
+      rewriters = [fix_inline_block_width]
+      if has_attachments: 
+        rewriters = [strip_id, strip_anchor_name] + rewriters
+      rewrite_tree(elements, rewriters)
+
+      # insert header to first child body element if possible
+      # we don't insert to body element because in some emails the first element is a page. 
+      # so anything we put before the first element will push the first element to the 2nd page. 
+      header_inserted = False
+      body_element = elements.find('body') or elements.find('*//body')
+      if (body_element != None):
+        header_elements = html5lib.parse(header, namespaceHTMLElements=False)
+        for child in body_element:
+          # comments can't hold the header
+          if not isinstance(child.tag, str):
+            continue
+          child.insert(0, header_elements)
+          # if there is text in child, we want the header element to stay before the text
+          header_elements.tail, child.text = child.text, None
+          header_inserted = True
+          break
+
+      # produce the new HTML string after removing IDs attributes
+      content_string = serialize(elements)
+      if not header_inserted:
+        content_string = header + content_string
+    return content_string
+
+# converter of the current process, created on first use
+converter = None
+
+def configure(options):
+  """
+  Create the converter of the current process, also used as initializer of worker processes
+  Arguments:
+      options: dictionary of keyword arguments of Converter
+  """
+  global converter
+  converter = Converter(**options)
+
+def convert(source, log=False, profile=None, pdf_filename=None):
+  """
+  Convert an email to a PDF file, reusing the converter of the current process
+  Arguments:
+      source: EML filename, raw email as bytes or binary file object to read it from
+      log: store output to log files
+      profile: Profile recording the time, memory and sizes of each stage, nothing is recorded by default
+      pdf_filename: PDF file or binary file object to write, by default the EML filename with a .pdf extension
+  Returns:
+      PDF filename or file object
+  """
+  global converter
+  if converter == None:
+    converter = Converter()
+  return converter.convert(source, log, profile, pdf_filename)
+
+def convert_bytes(source, log=False, profile=None):
+  """
+  Convert an email to a PDF in memory, without writing any file
+  Arguments:
+      source: raw email as bytes, binary file object to read it from or EML filename
+      log: store output to log files
+      profile: Profile recording the time, memory and sizes of each stage, nothing is recorded by default
+  Returns:
+      PDF as bytes
+  """
+  output = BytesIO()
+  convert(source, log, profile, output)
+  return output.getvalue()
+
+def convert_archive(entries, pdf_filename, log=False):
+  """
+  Convert many emails into one PDF file, reusing the converter of the current process
+  Arguments:
+      entries: list of (source, bookmark level) tuples in the order of the archive, see archive.order_emails
+      pdf_filename: PDF file or binary file object to write
+      log: store output to log files
+  Returns:
+      list of (index in entries, exception) tuples of the emails missing from the archive
+  """
+  global converter
+  if converter == None:
+    converter = Converter()
+  return converter.convert_archive(entries, pdf_filename, log)
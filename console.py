@@ -1,19 +1,29 @@
 import argparse
 import os
-from common import convert
-from send2trash import send2trash
+import client
+from cache import ConversionCache, file_hash, data_hash, user_cache_directory
+import mailboxes
+from journal import Journal
+from profiling import profile_convert, summarize
+from images import DEFAULT_IMAGE_QUALITY
+from spool import DEFAULT_SPOOL_THRESHOLD
+from fetcher import DEFAULT_CACHE_SIZE, DEFAULT_FETCH_TIMEOUT
+from nested import DEFAULT_NESTED_DEPTH
+from supervisor import LimitExceeded, SupervisedPool
+import json
+import shutil
+import time
 import traceback
-from watchdog.events import FileSystemEventHandler
-from watchdog.observers import Observer
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
 import logging
 import sys
 
 logger = logging.getLogger('console.py')
 formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 logger.setLevel(logging.INFO)
-handler = logging.StreamHandler(sys.stdout)
-handler.setFormatter(formatter)
-logger.addHandler(handler)
+stream_handler = logging.StreamHandler(sys.stdout)
+stream_handler.setFormatter(formatter)
+logger.addHandler(stream_handler)
 
 def dir_path(path):
   if os.path.isdir(path):
@@ -21,8 +31,262 @@ def dir_path(path):
   else:
     raise argparse.ArgumentTypeError(f"{path} is not a valid directory")
 
+def positive_int(value):
+  try:
+    number = int(value)
+  except ValueError:
+    number = 0
+  if number > 0:
+    return number
+  else:
+    raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+
+def positive_float(value):
+  try:
+    number = float(value)
+  except ValueError:
+    number = 0
+  if number > 0:
+    return number
+  else:
+    raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+
+# The conversion libraries (weasyprint, eml_parser, html5lib...) and watchdog take a while to import,
+# so they are only imported once we know there is something to convert or watch:
+# --help, argument errors and "PDF files exist, do nothing" answer at once.
+
+def load_converter():
+  """Import the conversion libraries and create the converter of this process with the options of the command line"""
+  import common
+  if common.converter == None:
+    common.configure(converter_options)
+  return common
+
+def conversion_task():
+  """Function converting one email, in this process or in worker processes"""
+  if args.profile:
+    return profile_convert
+  from common import convert
+  return convert
+
+def convert_files(filenames, jobs=1, log=False, socket_path=None, executor=None, task=None):
+  """
+  Convert EML files to PDF and yield the results in completion order
+  Arguments:
+      filenames: list of EML filenames
+      jobs: number of worker processes, 1 converts in the current process
+      log: store output to log files
+      socket_path: send the files to the conversion server listening on this socket instead
+      executor: process pool to use instead of starting one
+      task: function converting one file, called with the filename and log, common.convert by default
+  Returns:
+      generator of (filename, result of task, exception) tuples, exception is None on success
+  """
+  if socket_path != None:
+    yield from client.submit(filenames, socket_path, log)
+    return
+  if task == None:
+    task = conversion_task()
+
+  if executor != None:
+    yield from convert_in_pool(executor, filenames, log, task)
+    return
+
+  jobs = min(jobs, len(filenames))
+  if jobs == 0:
+    return
+  if jobs <= 1 and not is_supervised():
+    load_converter()
+    for filename in filenames:
+      try:
+        yield filename, task(filename, log), None
+      except Exception as e:
+        yield filename, None, e
+    return
+
+  with new_pool(jobs) as executor:
+    yield from convert_in_pool(executor, filenames, log, task)
+
+def is_supervised():
+  """Check if conversions run under the time or memory limit of the command line"""
+  return args.timeout != None or args.maxMemory != None
+
+def new_pool(jobs):
+  """Start worker processes converting with the converter options and limits of the command line"""
+  from common import configure
+  if is_supervised():
+    max_rss = args.maxMemory * 2**20 if args.maxMemory != None else None
+    return SupervisedPool(jobs, args.timeout, max_rss, initializer=configure, initargs=(converter_options,))
+  return ProcessPoolExecutor(max_workers=jobs, initializer=configure, initargs=(converter_options,))
+
+def convert_in_pool(executor, filenames, log, task):
+  futures = {executor.submit(task, filename, log): filename for filename in filenames}
+  for future in as_completed(futures):
+    try:
+      yield futures[future], future.result(), None
+    except Exception as e:
+      yield futures[future], None, e
+
+def convert_messages(messages, jobs=1, log=False, task=None):
+  """
+  Convert emails read lazily from a mailbox and yield the results in completion order.
+  Only a few emails per worker are read ahead, so memory does not grow with the size of the mailbox.
+  Arguments:
+      messages: iterable of (PDF filename, raw email as bytes) tuples
+      jobs: number of worker processes, 1 converts in the current process
+      log: store output to log files
+      task: function converting one email, called with the raw email, log and pdf_filename, common.convert by default
+  Returns:
+      generator of (PDF filename, result of task, exception) tuples, exception is None on success
+  """
+  if task == None:
+    task = conversion_task()
+  if jobs <= 1 and not is_supervised():
+    load_converter()
+    for pdf_filename, raw_email in messages:
+      try:
+        yield pdf_filename, task(raw_email, log, pdf_filename=pdf_filename), None
+      except Exception as e:
+        yield pdf_filename, None, e
+    return
+
+  with new_pool(jobs) as executor:
+    futures = {}
+    def completed(futures_done):
+      for future in futures_done:
+        pdf_filename = futures.pop(future)
+        try:
+          yield pdf_filename, future.result(), None
+        except Exception as e:
+          yield pdf_filename, None, e
+
+    for pdf_filename, raw_email in messages:
+      futures[executor.submit(task, raw_email, log, pdf_filename=pdf_filename)] = pdf_filename
+      if len(futures) >= 2 * jobs:
+        yield from completed(wait(futures, return_when=FIRST_COMPLETED).done)
+    yield from completed(as_completed(list(futures)))
+
+def quarantine(filename, reason, raw_email=None):
+  """
+  Move an EML file that could not be converted within the limits to the quarantine directory,
+  with a text file telling why
+  Arguments:
+      filename: EML file, or name to give to the email in the quarantine directory
+      reason: message of the failure
+      raw_email: raw email as bytes to write instead of moving filename
+  Returns:
+      path of the email in the quarantine directory
+  """
+  os.makedirs(args.quarantine, exist_ok=True)
+  name = os.path.splitext(os.path.basename(filename))[0]
+  target = os.path.join(args.quarantine, name + '.eml')
+  number = 1
+  while os.path.exists(target):
+    number += 1
+    target = os.path.join(args.quarantine, '%s (%d).eml' % (name, number))
+  if raw_email == None:
+    shutil.move(filename, target)
+  else:
+    with open(target, 'wb') as file:
+      file.write(raw_email)
+  with open(os.path.splitext(target)[0] + '.reason.txt', 'w') as file:
+    file.write('%s\n%s\n%s\n' % (os.path.abspath(filename), time.strftime('%Y-%m-%d %H:%M:%S'), reason))
+  logger.info("Quarantine " + filename + " to " + target + ": " + reason)
+  return target
+
+def process_mailbox(path):
+  """Convert the emails of a mbox file or Maildir directory to PDF files in a directory next to it"""
+  directory = mailboxes.output_directory(path)
+  if os.path.exists(directory) and not args.forceWrite:
+    logger.info("Do nothing for " + path + " because " + directory + " exists. If you want to overwrite existing PDF files, please use -f flag")
+    return
+
+  os.makedirs(directory, exist_ok=True)
+  logger.info("Convert the emails of " + path + " to " + directory)
+  skipped = []
+  eml_hashes = {}
+  # emails being converted, to write them to the quarantine directory when they exceed the limits
+  raw_emails = {}
+  def pending_messages():
+    for pdf_filename, raw_email in mailboxes.iterate_pdf_targets(path):
+      if conversion_cache != None:
+        eml_hashes[pdf_filename] = data_hash(raw_email)
+        if conversion_cache.is_current(pdf_filename, eml_hashes[pdf_filename]):
+          skipped.append(pdf_filename)
+          continue
+      if is_supervised():
+        raw_emails[pdf_filename] = raw_email
+      yield pdf_filename, raw_email
+
+  converted = 0
+  failed_filenames = []
+  records = []
+  for pdf_filename, result, error in convert_messages(pending_messages(), args.jobs, args.logFile):
+    eml_hash = eml_hashes.pop(pdf_filename, None)
+    raw_email = raw_emails.pop(pdf_filename, None)
+    if error == None:
+      converted += 1
+      if args.profile:
+        records.append(result[1])
+      if conversion_cache != None:
+        conversion_cache.store(pdf_filename, eml_hash)
+    else:
+      failed_filenames.append(os.path.basename(pdf_filename))
+      # only the emails over the limits are to blame, not a broken installation or a crashed worker
+      if isinstance(error, LimitExceeded):
+        quarantine(pdf_filename, str(error), raw_email)
+      else:
+        traceback.print_exception(type(error), error, error.__traceback__)
+
+  message = 'Converted %d email(s) of %s, %d were up to date' % (converted, path, len(skipped))
+  if len(failed_filenames) > 0:
+    message += '. These emails have issues during conversion to PDF:\n\n\t%s' % ('\n\t'.join(failed_filenames))
+  logger.info(message)
+  write_profile(records)
+
+  if args.openPdf:
+    os.system('open "%s"' % directory)
+
+def write_profile(records):
+  """Append profile records to log/profile.jsonl and print their summary"""
+  if len(records) > 0:
+    with open('log/profile.jsonl', 'a') as file:
+      for record in records:
+        file.write(json.dumps(record) + '\n')
+    logger.info(summarize(records))
+
+def process_pipe(filename=None):
+  """
+  Convert one email read from stdin, or from a file, and write the PDF to stdout
+  Returns:
+      exit status
+  """
+  source = sys.stdin.buffer.read() if filename == None else filename
+  try:
+    from common import convert_bytes
+    if is_supervised():
+      with new_pool(1) as pool:
+        pdf = pool.submit(convert_bytes, source, args.logFile).result()
+    else:
+      load_converter()
+      pdf = convert_bytes(source, args.logFile)
+  except LimitExceeded as e:
+    logger.info("Stop the conversion because it " + str(e))
+    return 1
+  except Exception:
+    traceback.print_exc()
+    return 1
+  sys.stdout.buffer.write(pdf)
+  sys.stdout.buffer.flush()
+  return 0
+
 def process_files(filenames):
-  """Convert list of EML files to PDF"""
+  """
+  Convert list of EML files to PDF
+  Returns:
+      dictionary of the files that failed to convert to their error message
+      list of the files that were not converted because PDF files exist or they don't exist
+  """
   exists = False
   for filename in filenames:
     pdf_filename = filename.replace(".eml", ".pdf")
@@ -32,25 +296,52 @@ def process_files(filenames):
 
   if exists and not args.forceWrite:
     logger.info("Do nothing because there are PDF existing files. If you want to overwrite existing PDF files, please use -f flag")
-    return
+    return {}, list(filenames)
 
   failed_filenames = []
+  errors = {}
+  skipped_filenames = []
   converted_filenames = []
   success_filenames = []
+  eml_filenames = []
+  eml_hashes = {}
   for filename in filenames:
     file_extension = os.path.splitext(filename)[-1]
     if file_extension.lower() == ".eml":
-      try:
-        if os.path.exists(filename):
-          pdf_filename = convert(filename, args.logFile)  
-          converted_filenames.append(filename)  
-          success_filenames.append('"' + pdf_filename + '"')
-        else: 
-          logger.info("File " + filename + ' does not exist')
-      except Exception as e:
-        failed_filenames.append(filename)
-        traceback.print_exc()
-        
+      if os.path.exists(filename):
+        if conversion_cache != None:
+          # skip the conversion when the PDF file was rendered from the same content before
+          eml_hashes[filename] = file_hash(filename)
+          pdf_filename = os.path.splitext(filename)[0] + '.pdf'
+          if conversion_cache.is_current(pdf_filename, eml_hashes[filename]):
+            logger.info("Skip " + filename + " because its PDF file is up to date")
+            success_filenames.append('"' + pdf_filename + '"')
+            continue
+        eml_filenames.append(filename)
+      else:
+        logger.info("File " + filename + ' does not exist')
+        skipped_filenames.append(filename)
+
+  records = []
+  for filename, result, error in convert_files(eml_filenames, args.jobs, args.logFile, args.socket if args.connect else None, watch_executor):
+    if error == None:
+      pdf_filename = result
+      if args.profile:
+        pdf_filename, record = result
+        records.append(record)
+      converted_filenames.append(filename)
+      success_filenames.append('"' + pdf_filename + '"')
+      if conversion_cache != None:
+        conversion_cache.store(pdf_filename, eml_hashes[filename])
+    else:
+      failed_filenames.append(filename)
+      errors[filename] = str(error)
+      # only the emails over the limits are to blame, not a broken installation or a crashed worker
+      if isinstance(error, LimitExceeded):
+        quarantine(filename, str(error))
+      else:
+        traceback.print_exception(type(error), error, error.__traceback__)
+
   message = None
   if len(filenames) == len(success_filenames) and len(success_filenames) > 0:
     message = 'All files were converted successfully!'
@@ -58,6 +349,7 @@ def process_files(filenames):
     message = 'These files have issues during conversion to PDF:\n\n\t%s' % ('\n\t'.join(failed_filenames))
 
   if args.delete:
+    from send2trash import send2trash
     for filename in converted_filenames:
       send2trash(filename)
   
@@ -65,40 +357,77 @@ def process_files(filenames):
     os.system("open " + " ".join(success_filenames))
   if message != None:
     logger.info(message)
+  write_profile(records)
+  return errors, skipped_filenames
   
     
-class EmlPdfEventHandler(FileSystemEventHandler):
-  """Convert EML file to PDF"""
+def process_archive(paths):
+  """
+  Convert EML files and the emails of mailboxes into the one PDF file given with --archive
+  Returns:
+      exit status, 0 when all the emails are in the archive
+  """
+  if os.path.exists(args.archive) and not args.forceWrite:
+    logger.info("Do nothing because " + args.archive + " exists. If you want to overwrite it, please use -f flag")
+    return 0
 
-  def __init__(self, logger=None):
-    super().__init__()
+  import archive
+  sources = []
+  errors = 0
+  for path in paths:
+    if mailboxes.mailbox_type(path) != None:
+      # the emails of the mailboxes are read again one at a time when they are converted
+      sources.extend(mailboxes.iterate_messages(path))
+    elif os.path.splitext(path)[-1].lower() == ".eml" and os.path.exists(path):
+      sources.append(path)
+    elif os.path.exists(path):
+      logger.info("File " + path + ' is not an EML file or mailbox')
+      errors += 1
+    else:
+      logger.info("File " + path + ' does not exist')
+      errors += 1
+  if len(sources) == 0:
+    return 1
 
-  def on_moved(self, event):
-    super().on_moved(event)
-    if not event.is_directory:
-      logger.info("Move " + event.dest_path)
-      process_files([event.dest_path]) 
-
-  def on_created(self, event):
-    super().on_created(event)
-
-    if not event.is_directory:
-      logger.info("Create " + event.src_path)
-      process_files([event.src_path]) 
-
-  def on_deleted(self, event):
-    super().on_deleted(event)
+  logger.info("Convert %d email(s) to %s" % (len(sources), args.archive))
+  entries = archive.order_emails(sources, args.order)
+  common = load_converter()
+  try:
+    failed = common.convert_archive(entries, args.archive, args.logFile)
+  except Exception:
+    traceback.print_exc()
+    logger.info("Could not convert the emails to " + args.archive)
+    return 1
 
-  def on_modified(self, event):
-    super().on_modified(event)
+  message = 'All emails were converted to ' + args.archive
+  if len(failed) > 0:
+    for _, error in failed:
+      traceback.print_exception(type(error), error, error.__traceback__)
+    message = 'These emails have issues during conversion to PDF and are missing from %s:\n\n\t%s' % (
+      args.archive, '\n\t'.join(str(entries[index][0]) for index, _ in failed))
+  logger.info(message)
+  if args.openPdf:
+    os.system('open "%s"' % args.archive)
+  return 1 if len(failed) > 0 or errors > 0 else 0
 
-    if not event.is_directory:
-      logger.info("Modify " + event.src_path)
-      process_files([event.src_path]) 
+def process_job(filenames):
+  """Convert queued EML files to PDF and record the outcome in the journal"""
+  for filename in filenames:
+    journal.start(filename)
+  errors, skipped_filenames = process_files(filenames)
+  for filename in filenames:
+    if filename in errors:
+      # quarantined files are not tried again
+      journal.fail(filename, errors[filename], retry=os.path.exists(filename))
+    elif filename in skipped_filenames:
+      journal.skip(filename)
+    else:
+      journal.finish(filename)
+  return errors
 
 parser = argparse.ArgumentParser(description='Convert EML to PDF.', prog='python console.py')
 parser.add_argument('filenames', metavar='eml_files', type=str, nargs='*',
-                    help='EML filenames')
+                    help='EML filenames, mbox files or Maildir directories')
 parser.add_argument('-d', '--delete', dest='delete', action='store_true',
                     help='Keep the EML files after conversion (default: NO)')
 parser.add_argument('-f', '--force', dest='forceWrite', action='store_true',
@@ -109,29 +438,181 @@ parser.add_argument('-l', '--log', dest='logFile', action='store_true',
                     help='Store output to a log file (default: NO)')
 parser.add_argument('-w', '--watch', dest='watch', type=dir_path, default=None, metavar='directory',
                     help='Watch a directory and all subdirectories of it for EML files')
-args = parser.parse_args()
+parser.add_argument('--debounce', dest='debounce', type=float, default=2.0, metavar='seconds',
+                    help='When watching, wait until a file did not change for this long before converting it (default: 2)')
+parser.add_argument('--journal', dest='journal', default=None, metavar='file',
+                    help='When watching, file recording the conversions so they resume after a restart (default: one file per watched directory in the user cache directory)')
+parser.add_argument('--retries', dest='retries', type=positive_int, default=3, metavar='N',
+                    help='When watching, total number of attempts to convert a file, including the first one, waiting longer after each failure (default: 3)')
+parser.add_argument('-j', '--jobs', dest='jobs', type=positive_int, default=1, metavar='N',
+                    help='Number of worker processes converting files in parallel (default: 1)')
+parser.add_argument('-c', '--cache', dest='cache', default=None, metavar='file',
+                    help='File recording converted EML files, so that unchanged files are not converted again (default: cache.sqlite in the user cache directory)')
+parser.add_argument('--no-cache', dest='noCache', action='store_true',
+                    help='Convert all files again without using the cache file (default: NO)')
+parser.add_argument('--max-dpi', dest='maxDpi', type=positive_int, default=None, metavar='dpi',
+                    help='Downscale inline images larger than the page at this resolution and recompress them (default: keep images as they are)')
+parser.add_argument('--image-quality', dest='imageQuality', type=positive_int, default=DEFAULT_IMAGE_QUALITY, metavar='quality',
+                    help='JPEG quality of the images recompressed with --max-dpi, from 1 to 95 (default: %d)' % DEFAULT_IMAGE_QUALITY)
+parser.add_argument('--spool-threshold', dest='spoolThreshold', type=positive_int, default=DEFAULT_SPOOL_THRESHOLD // 2**20, metavar='MB',
+                    help='Attachments larger than this are decoded to temporary files instead of memory (default: %d)' % (DEFAULT_SPOOL_THRESHOLD // 2**20))
+parser.add_argument('--no-fast-text', dest='noFastText', action='store_true',
+                    help='Render plain text emails with WeasyPrint like HTML emails instead of drawing them directly (default: NO)')
+parser.add_argument('--inline-nested', dest='inlineNested', action='store_true',
+                    help='Show attached emails, like forwarded emails, after the body instead of attaching them as EML files (default: NO)')
+parser.add_argument('--nested-depth', dest='nestedDepth', type=positive_int, default=DEFAULT_NESTED_DEPTH, metavar='N',
+                    help='With --inline-nested, emails nested deeper than this stay attached as EML files (default: %d)' % DEFAULT_NESTED_DEPTH)
+parser.add_argument('--url-cache', dest='urlCache', default=None, metavar='file',
+                    help='File caching remote images and stylesheets, so that an image found in many emails is downloaded once (default: urls.sqlite in the user cache directory)')
+parser.add_argument('--url-cache-size', dest='urlCacheSize', type=positive_int, default=DEFAULT_CACHE_SIZE // 2**20, metavar='MB',
+                    help='Maximum size of the URL cache file, the least recently used resources are removed first (default: %d)' % (DEFAULT_CACHE_SIZE // 2**20))
+parser.add_argument('--fetch-timeout', dest='fetchTimeout', type=positive_float, default=DEFAULT_FETCH_TIMEOUT, metavar='seconds',
+                    help='Give up on a remote image or stylesheet when its server does not answer within this time (default: %d)' % DEFAULT_FETCH_TIMEOUT)
+parser.add_argument('--offline', dest='offline', action='store_true',
+                    help='Do not use the network, remote images and stylesheets that are not in the URL cache are replaced by placeholders (default: NO)')
+parser.add_argument('--timeout', dest='timeout', type=positive_float, default=None, metavar='seconds',
+                    help='Stop the conversion of a file taking longer than this and move the file to the quarantine directory (default: no limit)')
+parser.add_argument('--max-memory', dest='maxMemory', type=positive_int, default=None, metavar='MB',
+                    help='Stop the conversion of a file using more memory than this and move the file to the quarantine directory (default: no limit)')
+parser.add_argument('--quarantine', dest='quarantine', default='quarantine', metavar='directory',
+                    help='Directory receiving the files stopped by --timeout or --max-memory, with the reason (default: quarantine)')
+parser.add_argument('--stdout', dest='stdout', action='store_true',
+                    help='Write the PDF to stdout instead of a file, reading the email from stdin when no file is given or the file is - (default: NO)')
+parser.add_argument('-a', '--archive', dest='archive', default=None, metavar='pdf_file',
+                    help='Convert all the emails of the files and mailboxes into this one PDF file, with a bookmark per email')
+parser.add_argument('--order', dest='order', choices=['date', 'thread'], default='date',
+                    help='Order of the emails in the archive: oldest first, or replies grouped after the email they answer (default: date)')
+parser.add_argument('-p', '--profile', dest='profile', action='store_true',
+                    help='Measure time and memory of each conversion stage, store them to log/profile.jsonl and print a summary (default: NO)')
+parser.add_argument('--serve', dest='serve', action='store_true',
+                    help='Run a conversion server with warm worker processes listening on the socket')
+parser.add_argument('--connect', dest='connect', action='store_true',
+                    help='Send the files to a running conversion server instead of converting them here')
+parser.add_argument('--socket', dest='socket', default=client.DEFAULT_SOCKET, metavar='path',
+                    help='Socket of the conversion server (default: %s)' % client.DEFAULT_SOCKET)
 
-if (args.logFile):
-  if not os.path.exists('log'):
-    os.makedirs('log')
-  handler = logging.FileHandler('log/console.txt')
-  handler.setFormatter(formatter)
-  logger.addHandler(handler)
+if __name__ == '__main__':
+  args = parser.parse_args()
 
-if len(args.filenames) == 0 and args.watch == None:
-  parser.error('Please specify filenames to convert or a directory to watch')
+  # the server converts with the options it was started with, so they can't be changed by a client
+  if args.connect:
+    converter_arguments = [('--max-dpi', 'maxDpi'), ('--image-quality', 'imageQuality'), ('--spool-threshold', 'spoolThreshold'),
+                           ('--no-fast-text', 'noFastText'), ('--inline-nested', 'inlineNested'), ('--nested-depth', 'nestedDepth'),
+                           ('--url-cache', 'urlCache'), ('--url-cache-size', 'urlCacheSize'), ('--fetch-timeout', 'fetchTimeout'),
+                           ('--offline', 'offline')]
+    changed = [name for name, dest in converter_arguments if getattr(args, dest) != parser.get_default(dest)]
+    if len(changed) > 0:
+      parser.error('%s not available with --connect, give them to the server started with --serve' % ', '.join(changed))
 
-if len(args.filenames) > 0:
-  process_files(args.filenames)
-  
-if args.watch != None:
-  event_handler = EmlPdfEventHandler()
-  observer = Observer()
-  observer.schedule(event_handler, args.watch, recursive=True)
-  observer.start()
-  try:
-    while observer.is_alive():
-      observer.join(1)
-  finally:
-    observer.stop()
-    observer.join()
+  # the cache files are kept with the other caches of the user instead of the current directory
+  if args.cache == None and not args.noCache:
+    args.cache = os.path.join(user_cache_directory(), 'cache.sqlite')
+  if args.urlCache == None:
+    args.urlCache = os.path.join(user_cache_directory(), 'urls.sqlite')
+  if args.journal == None and args.watch != None:
+    # the journal resumes the files it knows about, so every watched directory has its own
+    args.journal = os.path.join(user_cache_directory(), 'journal-%s.sqlite' % data_hash(os.path.abspath(args.watch).encode())[:16])
+
+  converter_options = {
+    'max_dpi': args.maxDpi,
+    'image_quality': args.imageQuality,
+    'spool_threshold': args.spoolThreshold * 2**20,
+    'url_cache': args.urlCache,
+    'url_cache_size': args.urlCacheSize * 2**20,
+    'fetch_timeout': args.fetchTimeout,
+    'offline': args.offline,
+    'fast_plain_text': not args.noFastText,
+    'inline_nested': args.inlineNested,
+    'nested_depth': args.nestedDepth,
+  }
+
+  if args.logFile or args.profile:
+    if not os.path.exists('log'):
+      os.makedirs('log')
+  if args.logFile:
+    handler = logging.FileHandler('log/console.txt')
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+  if args.stdout or args.filenames == ['-']:
+    # stdout carries the PDF, so messages go to stderr
+    stream_handler.setStream(sys.stderr)
+    if len(args.filenames) > 1 or args.watch != None or args.serve:
+      parser.error('--stdout converts one email, from stdin or a file')
+    if args.profile:
+      parser.error('--profile is not available with --stdout')
+    sys.exit(process_pipe(args.filenames[0] if len(args.filenames) == 1 and args.filenames[0] != '-' else None))
+
+  if args.archive != None and (args.watch != None or args.serve or args.connect or args.profile):
+    parser.error('--archive is not available with --watch, --serve, --connect or --profile')
+  if args.profile and args.connect:
+    parser.error('--profile is not available with --connect')
+  if is_supervised() and (args.connect or args.serve):
+    parser.error('--timeout and --max-memory are not available with --connect or --serve')
+
+  if len(args.filenames) == 0 and args.watch == None and not args.serve:
+    parser.error('Please specify filenames to convert, a directory to watch or --serve')
+  if args.serve and args.watch != None:
+    parser.error('Please use either --serve or --watch')
+
+  # where attachments are decoded and remote resources are cached does not change the PDF files, so it is left out of the cache fingerprint
+  output_options = {name: value for name, value in converter_options.items() if name not in ('spool_threshold', 'url_cache', 'url_cache_size')}
+  conversion_cache = None if args.noCache else ConversionCache(args.cache, output_options)
+  watch_executor = None
+
+  # mbox files and Maildir directories are converted email by email, other files as EML files
+  if args.archive != None:
+    sys.exit(process_archive(args.filenames))
+
+  mailbox_paths = [filename for filename in args.filenames if mailboxes.mailbox_type(filename) != None]
+  if args.connect and len(mailbox_paths) > 0:
+    # the server converts EML files, the emails of a mailbox are not files it can read
+    parser.error('mailboxes are not available with --connect: ' + ', '.join(mailbox_paths))
+  eml_filenames = [filename for filename in args.filenames if filename not in mailbox_paths]
+  if len(eml_filenames) > 0:
+    process_files(eml_filenames)
+  for path in mailbox_paths:
+    process_mailbox(path)
+
+  if args.serve:
+    from server import serve
+    serve(args.socket, args.jobs, converter_options)
+
+  if args.watch != None:
+    # conversions run in worker processes, so the observer thread only queues files
+    # and deep HTML gets the stack of a main thread
+    from watcher import ConversionQueue, EmlPdfEventHandler, find_unconverted
+    from watchdog.observers import Observer
+    watch_executor = new_pool(args.jobs)
+    journal = Journal(args.journal, args.retries)
+    queue = ConversionQueue(process_job, args.jobs, args.debounce)
+    queue.start()
+    event_handler = EmlPdfEventHandler(queue, journal, args.quarantine)
+    observer = Observer()
+    observer.schedule(event_handler, args.watch, recursive=True)
+    observer.start()
+    try:
+      # catch up with the files interrupted by a crash and the files that arrived while we were not watching
+      interrupted = []
+      for filename in journal.recover():
+        if os.path.exists(filename):
+          interrupted.append(filename)
+          queue.put(filename)
+        else:
+          journal.forget(filename)
+      unconverted = [filename for filename in find_unconverted(args.watch) if os.path.abspath(filename) not in interrupted]
+      for filename in unconverted:
+        event_handler.enqueue(filename)
+      logger.info("Resume %d interrupted and queue %d unconverted file(s)" % (len(interrupted), len(unconverted)))
+
+      while observer.is_alive():
+        observer.join(1)
+        for filename in journal.retry_due():
+          logger.info("Retry " + filename)
+          queue.put(filename)
+    finally:
+      observer.stop()
+      observer.join()
+      queue.stop()
+      watch_executor.shutdown()
+      journal.close()
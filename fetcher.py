@@ -0,0 +1,170 @@
+import base64
+import html
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_FETCH_TIMEOUT = 10
+DEFAULT_CACHE_SIZE = 200 * 1024 * 1024
+PREFETCH_THREADS = 8
+
+# remote resources WeasyPrint loads while rendering: images, stylesheets linked with rel=stylesheet and url() in CSS,
+# but not scripts, icons or the targets of links, which it never loads
+URL_PATTERN = re.compile(
+  r'''(?:<img\b[^>]*?(?<![\w-])src\s*=\s*|<link\b(?=[^>]*?(?<![\w-])rel\s*=\s*["']?[^"'>]*?\bstylesheet\b)[^>]*?(?<![\w-])href\s*=\s*)["']?(https?://[^"'\s>]+)'''
+  r'''|\burl\(\s*["']?(https?://[^"'\s)]+)''',
+  re.IGNORECASE)
+
+# transparent 1x1 GIF replacing remote images in offline mode
+PLACEHOLDER_IMAGE = base64.b64decode('R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7')
+
+def find_urls(content_string):
+  """Return the remote URLs of the resources of an HTML document, in order and without duplicates"""
+  urls = {}
+  for match in URL_PATTERN.finditer(content_string):
+    urls[html.unescape(match.group(1) or match.group(2))] = True
+  return list(urls)
+
+def is_remote(url):
+  return url.lower().startswith(('http://', 'https://'))
+
+class UrlCache:
+  """
+  Resources fetched from the network, stored in a SQLite file shared by all the worker processes.
+  When the cache is larger than its maximum size, the least recently used resources are removed.
+  """
+
+  def __init__(self, path, max_size=DEFAULT_CACHE_SIZE):
+    """
+    Arguments:
+        path: SQLite file of the cache
+        max_size: maximum number of bytes of the cached resources
+    """
+    self.max_size = max_size
+    self.lock = threading.Lock()
+    # the file is written by several worker processes, so wait for the others instead of failing
+    self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    with self.lock, self.connection:
+      self.connection.execute("""
+        CREATE TABLE IF NOT EXISTS resources (
+          url TEXT PRIMARY KEY,
+          mime_type TEXT,
+          encoding TEXT,
+          redirected_url TEXT,
+          filename TEXT,
+          data BLOB NOT NULL,
+          size INTEGER NOT NULL,
+          used REAL NOT NULL
+        )""")
+      self.connection.execute("CREATE INDEX IF NOT EXISTS resources_used ON resources (used)")
+
+  def get(self, url):
+    """Return the cached result of url like a WeasyPrint URL fetcher, None when it is not cached"""
+    with self.lock, self.connection:
+      row = self.connection.execute(
+        "SELECT mime_type, encoding, redirected_url, filename, data FROM resources WHERE url = ?", (url,)).fetchone()
+      if row == None:
+        return None
+      self.connection.execute("UPDATE resources SET used = ? WHERE url = ?", (time.time(), url))
+    return {'mime_type': row[0], 'encoding': row[1], 'redirected_url': row[2], 'filename': row[3], 'string': row[4]}
+
+  def store(self, url, result):
+    """Store the result of a URL fetcher for url, with its content in result['string']"""
+    data = result['string']
+    if len(data) > self.max_size:
+      return
+    with self.lock, self.connection:
+      self.connection.execute(
+        "INSERT OR REPLACE INTO resources (url, mime_type, encoding, redirected_url, filename, data, size, used) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (url, result.get('mime_type'), result.get('encoding'), result.get('redirected_url'), result.get('filename'), data, len(data), time.time()))
+      total = self.connection.execute("SELECT TOTAL(size) FROM resources").fetchone()[0]
+      if total > self.max_size:
+        # remove the least recently used resources until the cache fits
+        removed = 0
+        for url, size in self.connection.execute("SELECT url, size FROM resources ORDER BY used").fetchall():
+          if total - removed <= self.max_size:
+            break
+          self.connection.execute("DELETE FROM resources WHERE url = ?", (url,))
+          removed += size
+
+  def close(self):
+    with self.lock:
+      self.connection.close()
+
+class CachingUrlFetcher:
+  """
+  URL fetcher for WeasyPrint with a timeout, an optional cache on disk and an offline mode.
+  The remote resources of a document are fetched in parallel by prefetch before the layout,
+  then WeasyPrint gets them from memory.
+  """
+
+  def __init__(self, cache_path=None, cache_size=DEFAULT_CACHE_SIZE, timeout=DEFAULT_FETCH_TIMEOUT, offline=False):
+    """
+    Arguments:
+        cache_path: SQLite file caching the fetched resources, None to only keep them during a conversion
+        cache_size: maximum number of bytes of the cache file
+        timeout: seconds to wait for a server before giving up on a resource
+        offline: never use the network, remote resources not in the cache are replaced by placeholders
+    """
+    self.cache = None if cache_path == None else UrlCache(cache_path, cache_size)
+    self.timeout = timeout
+    self.offline = offline
+    # resources of the document being converted, by URL, with the exception when fetching failed
+    self.resources = {}
+
+  def __call__(self, url, timeout=None, ssl_context=None):
+    # weasyprint is imported when fetching, so that the command line reads the defaults of this module without loading it
+    from weasyprint import default_url_fetcher
+    if not is_remote(url):
+      return default_url_fetcher(url, timeout or self.timeout, ssl_context)
+    if url not in self.resources:
+      self.resources[url] = self.fetch(url)
+    result = self.resources[url]
+    if isinstance(result, Exception):
+      # failures are remembered, so a missing image used many times in the document only waits once
+      raise result
+    return dict(result)
+
+  def fetch(self, url):
+    """Return the result of url from the cache, the network or a placeholder, or the exception raised fetching it"""
+    if self.cache != None:
+      result = self.cache.get(url)
+      if result != None:
+        return result
+    if self.offline:
+      return self.placeholder(url)
+    from weasyprint import default_url_fetcher
+    try:
+      result = default_url_fetcher(url, self.timeout)
+      if 'file_obj' in result:
+        file = result.pop('file_obj')
+        try:
+          result['string'] = file.read()
+        finally:
+          file.close()
+    except Exception as e:
+      return e
+    if self.cache != None:
+      self.cache.store(url, result)
+    return result
+
+  def placeholder(self, url):
+    if os.path.splitext(url.split('?')[0])[-1].lower() == '.css':
+      return {'string': b'', 'mime_type': 'text/css', 'redirected_url': url}
+    return {'string': PLACEHOLDER_IMAGE, 'mime_type': 'image/gif', 'redirected_url': url}
+
+  def prefetch(self, urls):
+    """Fetch the given URLs in parallel, so that the layout does not wait for them one by one"""
+    urls = [url for url in urls if url not in self.resources]
+    if len(urls) == 0:
+      return
+    with ThreadPoolExecutor(max_workers=min(PREFETCH_THREADS, len(urls))) as executor:
+      for url, result in zip(urls, executor.map(self.fetch, urls)):
+        self.resources[url] = result
+
+  def clear(self):
+    """Forget the resources of the document, they stay in the cache file"""
+    self.resources = {}
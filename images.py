@@ -0,0 +1,85 @@
+import base64
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+# size of the A4 page of stylesheets.css without its 1cm margins, in inches
+PAGE_WIDTH = (210 - 20) / 25.4
+PAGE_HEIGHT = (297 - 20) / 25.4
+
+DEFAULT_IMAGE_QUALITY = 80
+CACHE_SIZE = 512
+
+class ImageOptimizer:
+  """
+  Downscale inline images to the resolution they can have on the page and recompress them.
+  Results are cached by content hash, so an image seen in many emails (like a logo in a signature)
+  is only processed once per process.
+  """
+
+  def __init__(self, max_dpi, quality=DEFAULT_IMAGE_QUALITY):
+    """
+    Arguments:
+        max_dpi: resolution of an image filling the page, larger images are downscaled to it
+        quality: JPEG quality of the recompressed images, from 1 to 95
+    """
+    # Pillow is installed with weasyprint, import it now to fail early when it is missing
+    import PIL.Image
+    self.max_size = (round(PAGE_WIDTH * max_dpi), round(PAGE_HEIGHT * max_dpi))
+    self.quality = quality
+    self.cache = OrderedDict()
+    self.lock = threading.Lock()
+
+  def optimize(self, content_type, data):
+    """
+    Arguments:
+        content_type: MIME type of the image, like image/png
+        data: base64 encoded image
+    Returns:
+        MIME type and base64 encoded data of the optimized image, the given ones when it could not be improved
+    """
+    if content_type.lower() not in ('image/jpeg', 'image/jpg', 'image/pjpeg', 'image/png'):
+      return content_type, data
+    key = hashlib.sha256(data).digest()
+    with self.lock:
+      if key in self.cache:
+        self.cache.move_to_end(key)
+        return self.cache[key]
+    result = self.process(content_type, data)
+    with self.lock:
+      self.cache[key] = result
+      if len(self.cache) > CACHE_SIZE:
+        self.cache.popitem(last=False)
+    return result
+
+  def process(self, content_type, data):
+    from PIL import Image, ImageOps
+    try:
+      image = Image.open(io.BytesIO(base64.b64decode(data)))
+      image.load()
+    except Exception:
+      # leave images Pillow can't read to WeasyPrint
+      return content_type, data
+
+    original_size = image.size
+    is_jpeg = image.format == 'JPEG'
+    # the orientation saved by phones is lost when saving again, so apply it now
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail(self.max_size, Image.LANCZOS)
+
+    output = io.BytesIO()
+    if is_jpeg:
+      if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+      image.save(output, 'JPEG', quality=self.quality, optimize=True)
+      optimized_type = 'image/jpeg'
+    else:
+      image.save(output, 'PNG', optimize=True)
+      optimized_type = 'image/png'
+    optimized = base64.b64encode(output.getvalue())
+
+    # keep the original when it was small enough and recompressing did not make it smaller
+    if image.size == original_size and len(optimized) >= len(data):
+      return content_type, data
+    return optimized_type, optimized
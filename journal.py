@@ -0,0 +1,139 @@
+import os
+import sqlite3
+import threading
+import time
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+# not converted because its PDF file exists or the file is gone
+SKIPPED = 'skipped'
+
+# failed conversions are retried after 1, 2, 4, ... minutes
+RETRY_DELAY = 60
+
+class Journal:
+  """
+  Persistent state of the conversions of a watched directory, stored in a SQLite file.
+  Every state change is committed at once, so after a crash we know which files were
+  waiting or being converted and can convert them again.
+  """
+
+  def __init__(self, path, max_attempts=3):
+    """
+    Arguments:
+        path: SQLite file of the journal
+        max_attempts: number of times a file is converted before giving up on it
+    """
+    self.max_attempts = max_attempts
+    self.lock = threading.Lock()
+    self.connection = sqlite3.connect(path, check_same_thread=False)
+    with self.lock, self.connection:
+      self.connection.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+          filename TEXT PRIMARY KEY,
+          state TEXT NOT NULL,
+          attempts INTEGER NOT NULL DEFAULT 0,
+          next_attempt REAL,
+          error TEXT,
+          updated REAL NOT NULL,
+          size INTEGER,
+          mtime INTEGER
+        )""")
+      # journals written before size and mtime were recorded
+      columns = [row[1] for row in self.connection.execute("PRAGMA table_info(jobs)")]
+      for column in ('size', 'mtime'):
+        if column not in columns:
+          self.connection.execute("ALTER TABLE jobs ADD COLUMN %s INTEGER" % column)
+
+  def execute(self, sql, parameters=()):
+    with self.lock, self.connection:
+      return self.connection.execute(sql, parameters).fetchall()
+
+  def add(self, filename):
+    """
+    Record a new or changed file to convert.
+    A failed file with the same size and modification time as before keeps its attempts and
+    its next attempt, so that finding it again after a restart does not reset its retries.
+    Returns:
+        whether the file is to convert now, False for a failed file waiting for its next attempt
+    """
+    filename = os.path.abspath(filename)
+    try:
+      stat = os.stat(filename)
+      size, mtime = stat.st_size, stat.st_mtime_ns
+    except OSError:
+      size, mtime = None, None
+    unchanged = "jobs.state = '%s' AND excluded.size IS NOT NULL AND jobs.size IS excluded.size AND jobs.mtime IS excluded.mtime" % FAILED
+    with self.lock, self.connection:
+      self.connection.execute("""
+        INSERT INTO jobs (filename, state, attempts, updated, size, mtime) VALUES (?, ?, 0, ?, ?, ?)
+        ON CONFLICT (filename) DO UPDATE SET
+          state = CASE WHEN {0} THEN jobs.state ELSE excluded.state END,
+          attempts = CASE WHEN {0} THEN jobs.attempts ELSE 0 END,
+          next_attempt = CASE WHEN {0} THEN jobs.next_attempt ELSE NULL END,
+          error = CASE WHEN {0} THEN jobs.error ELSE NULL END,
+          updated = excluded.updated, size = excluded.size, mtime = excluded.mtime""".format(unchanged),
+        (filename, PENDING, time.time(), size, mtime))
+      state = self.connection.execute("SELECT state FROM jobs WHERE filename = ?", (filename,)).fetchone()[0]
+    return state == PENDING
+
+  def start(self, filename):
+    self.execute(
+      "UPDATE jobs SET state = ?, attempts = attempts + 1, updated = ? WHERE filename = ?",
+      (RUNNING, time.time(), os.path.abspath(filename)))
+
+  def finish(self, filename):
+    self.execute(
+      "UPDATE jobs SET state = ?, next_attempt = NULL, error = NULL, updated = ? WHERE filename = ?",
+      (DONE, time.time(), os.path.abspath(filename)))
+
+  def skip(self, filename):
+    """Record a file that was not converted because its PDF file exists or the file is gone"""
+    self.execute(
+      "UPDATE jobs SET state = ?, next_attempt = NULL, error = NULL, updated = ? WHERE filename = ?",
+      (SKIPPED, time.time(), os.path.abspath(filename)))
+
+  def fail(self, filename, error=None, retry=True):
+    """Record a failed conversion and, unless retry is False, schedule the next attempt with an exponential backoff"""
+    filename = os.path.abspath(filename)
+    now = time.time()
+    rows = self.execute("SELECT attempts FROM jobs WHERE filename = ?", (filename,))
+    attempts = rows[0][0] if len(rows) > 0 else 1
+    next_attempt = now + RETRY_DELAY * 2 ** (attempts - 1) if retry and attempts < self.max_attempts else None
+    self.execute(
+      "UPDATE jobs SET state = ?, next_attempt = ?, error = ?, updated = ? WHERE filename = ?",
+      (FAILED, next_attempt, error, now, filename))
+
+  def forget(self, filename):
+    self.execute("DELETE FROM jobs WHERE filename = ?", (os.path.abspath(filename),))
+
+  def recover(self):
+    """
+    Put back the files that were being converted when the watcher stopped
+    Returns:
+        list of filenames waiting to be converted
+    """
+    self.execute("UPDATE jobs SET state = ? WHERE state = ?", (PENDING, RUNNING))
+    return [row[0] for row in self.execute("SELECT filename FROM jobs WHERE state = ?", (PENDING,))]
+
+  def retry_due(self):
+    """
+    Move the failed files whose next attempt is due back to pending
+    Returns:
+        list of filenames to convert again
+    """
+    now = time.time()
+    with self.lock, self.connection:
+      rows = self.connection.execute(
+        "SELECT filename FROM jobs WHERE state = ? AND next_attempt IS NOT NULL AND next_attempt <= ?",
+        (FAILED, now)).fetchall()
+      self.connection.executemany(
+        "UPDATE jobs SET state = ?, updated = ? WHERE filename = ?",
+        [(PENDING, now, row[0]) for row in rows])
+    return [row[0] for row in rows]
+
+  def close(self):
+    with self.lock:
+      self.connection.close()
@@ -0,0 +1,203 @@
+import email.header
+import io
+import os
+import re
+
+# emails are read one at a time from these mailboxes, so a mailbox of any size is converted in constant memory
+MBOX = 'mbox'
+MAILDIR = 'maildir'
+
+# end of the headers of an email
+HEADER_END_PATTERN = re.compile(rb'\r?\n\r?\n')
+SUBJECT_PATTERN = re.compile(rb'^subject:[ \t]*(.*(?:\r?\n[ \t].*)*)', re.IGNORECASE | re.MULTILINE)
+UNSAFE_CHARACTERS_PATTERN = re.compile(r'[^\w \-.,()&+\']+')
+# line starting an email in a mbox file, with the sender and the date: "From someone@example.com Mon Jan  3 01:05:34 2022"
+FROM_LINE_PATTERN = re.compile(rb'From \S+ +[A-Za-z]{3} +[A-Za-z]{3} +\d{1,2} +\d{1,2}:\d{2}')
+# "From " lines of the bodies are quoted as ">From ", and ">From " lines as ">>From "
+QUOTED_FROM_PATTERN = re.compile(rb'>+From ')
+
+def mailbox_type(path):
+  """
+  Detect mailboxes
+  Returns:
+      MBOX for a mbox file or a directory exported by Apple Mail containing one,
+      MAILDIR for a Maildir directory, None for anything else
+  """
+  if os.path.isdir(path):
+    if os.path.isdir(os.path.join(path, 'cur')) and os.path.isdir(os.path.join(path, 'new')):
+      return MAILDIR
+    if os.path.isfile(os.path.join(path, 'mbox')):
+      return MBOX
+    return None
+  if os.path.isfile(path) and os.path.splitext(path)[-1].lower() != '.eml':
+    if os.path.splitext(path)[-1].lower() == '.mbox':
+      return MBOX
+    with open(path, 'rb') as file:
+      if FROM_LINE_PATTERN.match(file.readline(1000)):
+        return MBOX
+  return None
+
+def unquote_from(line):
+  """Remove the quote added to a ">From " line of a body when it was written to a mbox file"""
+  if QUOTED_FROM_PATTERN.match(line):
+    return line[1:]
+  return line
+
+def iterate_mbox(path):
+  """
+  Read the emails of a mbox file one by one
+  Returns:
+      generator of raw emails as bytes
+  """
+  if os.path.isdir(path):
+    path = os.path.join(path, 'mbox')
+  with open(path, 'rb') as file:
+    lines = None
+    previous_blank = True
+    for line in file:
+      # a "From " line with a sender and a date after an empty line starts the next email,
+      # "From " lines in the body are quoted as ">From "
+      if previous_blank and FROM_LINE_PATTERN.match(line):
+        if lines != None:
+          yield b''.join(lines)
+        lines = []
+      elif lines != None:
+        lines.append(unquote_from(line))
+      previous_blank = line in (b'\n', b'\r\n')
+    if lines != None:
+      yield b''.join(lines)
+
+def maildir_filenames(path):
+  """Return the files of the emails of a Maildir directory, in the order of their filenames"""
+  filenames = []
+  for subdirectory in ('cur', 'new'):
+    for name in sorted(os.listdir(os.path.join(path, subdirectory))):
+      filename = os.path.join(path, subdirectory, name)
+      if not name.startswith('.') and os.path.isfile(filename):
+        filenames.append(filename)
+  return filenames
+
+def iterate_maildir(path):
+  """
+  Read the emails of a Maildir directory one by one, in the order of their filenames
+  Returns:
+      generator of raw emails as bytes
+  """
+  for filename in maildir_filenames(path):
+    with open(filename, 'rb') as file:
+      yield file.read()
+
+def iterate_mailbox(path):
+  """Read the emails of a mbox file or a Maildir directory one by one"""
+  if mailbox_type(path) == MAILDIR:
+    return iterate_maildir(path)
+  return iterate_mbox(path)
+
+class MailboxMessage:
+  """
+  Position of an email in a mailbox, to read the email when it is needed instead of keeping it in memory.
+  Like a file object, read returns the raw email.
+  """
+
+  def __init__(self, mailbox, number, filename, offset=None, length=None):
+    """
+    Arguments:
+        mailbox: path of the mbox file or Maildir directory
+        number: position of the email in the mailbox, from 1
+        filename: file containing the email, the mbox file or a file of the Maildir directory
+        offset: position of the email in a mbox file, after its "From " line, None when the email is the whole file
+        length: number of bytes of the email in a mbox file
+    """
+    self.mailbox = mailbox
+    self.number = number
+    self.filename = filename
+    self.offset = offset
+    self.length = length
+
+  def read(self):
+    with open(self.filename, 'rb') as file:
+      if self.offset == None:
+        return file.read()
+      file.seek(self.offset)
+      return b''.join(unquote_from(line) for line in io.BytesIO(file.read(self.length)))
+
+  def read_headers(self):
+    """Return the raw headers of the email, without reading its body"""
+    lines = []
+    with open(self.filename, 'rb') as file:
+      file.seek(self.offset or 0)
+      size = 0
+      for line in file:
+        size += len(line)
+        if line in (b'\n', b'\r\n') or (self.length != None and size > self.length):
+          break
+        lines.append(line)
+    return b''.join(lines)
+
+  def __str__(self):
+    return 'email %d of %s' % (self.number, self.mailbox)
+
+def iterate_messages(path):
+  """
+  Find the emails of a mbox file or a Maildir directory without reading them
+  Returns:
+      generator of MailboxMessage
+  """
+  if mailbox_type(path) == MAILDIR:
+    for number, filename in enumerate(maildir_filenames(path), start=1):
+      yield MailboxMessage(path, number, filename)
+    return
+
+  filename = os.path.join(path, 'mbox') if os.path.isdir(path) else path
+  with open(filename, 'rb') as file:
+    number = 0
+    start = None
+    offset = 0
+    previous_blank = True
+    # the emails are split like in iterate_mbox
+    for line in file:
+      if previous_blank and FROM_LINE_PATTERN.match(line):
+        if start != None:
+          yield MailboxMessage(path, number, filename, start, offset - start)
+        number += 1
+        start = offset + len(line)
+      previous_blank = line in (b'\n', b'\r\n')
+      offset += len(line)
+    if start != None:
+      yield MailboxMessage(path, number, filename, start, offset - start)
+
+def output_directory(path):
+  """Directory receiving the PDF files of a mailbox: "Inbox.mbox" gives "Inbox PDF" next to it"""
+  path = os.path.normpath(path)
+  return os.path.splitext(path)[0] + ' PDF'
+
+def pdf_name(index, raw_email):
+  """
+  Name of the PDF file of an email of a mailbox, made of its position and its subject, like "00042 - Meeting notes.pdf"
+  Only the headers are read, the email is not parsed.
+  """
+  header_end = HEADER_END_PATTERN.search(raw_email)
+  headers = raw_email[:header_end.start()] if header_end else raw_email
+  match = SUBJECT_PATTERN.search(headers)
+  subject = ''
+  if match:
+    subject = re.sub(r'\s+', ' ', match.group(1).decode('utf-8', 'replace'))
+    try:
+      # decode subjects like =?utf-8?q?...?=
+      subject = str(email.header.make_header(email.header.decode_header(subject)))
+    except Exception:
+      pass
+    subject = UNSAFE_CHARACTERS_PATTERN.sub('_', subject).strip(' ._')[:80]
+  if subject:
+    return '%05d - %s.pdf' % (index, subject)
+  return '%05d.pdf' % index
+
+def iterate_pdf_targets(path):
+  """
+  Read the emails of a mailbox one by one with the PDF filename to write each of them to
+  Returns:
+      generator of (PDF filename, raw email as bytes) tuples
+  """
+  directory = output_directory(path)
+  for index, raw_email in enumerate(iterate_mailbox(path), start=1):
+    yield os.path.join(directory, pdf_name(index, raw_email)), raw_email
@@ -1,10 +1,8 @@
 import easygui
 
-from send2trash import send2trash
 import traceback
 from pathlib import Path
 import os
-from common import convert
 
 def main():
   # read settings file for recent open path
@@ -45,6 +43,8 @@ def main():
     perform_conversion(filenames)
 
 def perform_conversion(filenames):
+  # the conversion libraries are imported once files are chosen, so that the file dialog opens at once
+  from common import convert
   failed_filenames = []
   for filename in filenames:
     try:
@@ -61,6 +61,7 @@ def perform_conversion(filenames):
     Do you want to delete the EML files?
   """ % message, choices=("[D]elete", "[K]eep (Esc)"),)):
       print("EML file is in Trash bin now")
+      from send2trash import send2trash
       for filename in filenames:
         if filename not in failed_filenames:
           send2trash(filename)
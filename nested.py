@@ -0,0 +1,121 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from spool import attachment_data, parse_email, DEFAULT_SPOOL_THRESHOLD
+
+# emails nested deeper than this are not parsed, they stay attached to the email containing them
+DEFAULT_NESTED_DEPTH = 8
+# maximum number of bytes of the nested emails kept parsed
+DEFAULT_PARSE_CACHE_SIZE = 64 * 1024 * 1024
+
+def is_email(attachment):
+  """Check if an attachment of spool.parse_email is an email, like a forwarded email"""
+  content_type = (attachment.get('content_header') or {}).get('content-type') or ['']
+  return content_type[0].lower().startswith('message/rfc822')
+
+def content_hash(attachment):
+  """SHA-256 of the decoded content of an attachment of spool.parse_email"""
+  if attachment.get('hash') != None and attachment.get('hash').get('sha256') != None:
+    return attachment.get('hash').get('sha256')
+  return hashlib.sha256(attachment_data(attachment)).hexdigest()
+
+def content_ids(parsed_eml):
+  """Return the content IDs of all the attachments of a parsed email, including the ones of the emails nested in it"""
+  ids = set()
+  for attachment in parsed_eml.get('attachment') or []:
+    header = attachment.get('content_header') or {}
+    if header.get('content-id'):
+      ids.update(header.get('content-id'))
+  return ids
+
+class NestedEmail:
+  """An email attached to another email, with the emails attached to it"""
+
+  def __init__(self, index, key, depth, parsed_eml, children):
+    """
+    Arguments:
+        index: index of the email in the attachments of the email containing it
+        key: content hash of the raw email
+        depth: 1 for an email attached to the converted email, 2 for an email attached to that one...
+        parsed_eml: parsed result of the email
+        children: list of NestedEmail attached to this email, empty when the depth limit is reached
+    """
+    self.index = index
+    self.key = key
+    self.depth = depth
+    self.parsed_eml = parsed_eml
+    self.children = children
+
+  def walk(self):
+    """Yield this email and the emails nested in it"""
+    yield self
+    for child in self.children:
+      yield from child.walk()
+
+class NestedEmailParser:
+  """
+  Parse the emails attached to an email into a tree.
+  eml_parser lists the attachments of nested emails, including the nested emails themselves, with the
+  attachments of the email containing them. Here every nested email is decoded once, the emails found
+  inside it are not taken again as its siblings, and the parsed emails are cached by content hash,
+  so a forwarded email seen in many emails is only decoded once per process.
+  """
+
+  def __init__(self, max_depth=DEFAULT_NESTED_DEPTH, cache_size=DEFAULT_PARSE_CACHE_SIZE, spool_threshold=DEFAULT_SPOOL_THRESHOLD):
+    """
+    Arguments:
+        max_depth: depth of the deepest nested emails to parse, at least 1
+        cache_size: maximum number of bytes of the raw emails kept parsed
+        spool_threshold: attachments larger than this number of bytes are decoded to temporary files instead of memory
+    """
+    self.max_depth = max(1, max_depth)
+    self.cache_size = cache_size
+    self.spool_threshold = spool_threshold
+    self.cache = OrderedDict()
+    self.cached_bytes = 0
+    self.lock = threading.Lock()
+
+  def parse(self, attachment, key):
+    """Return the parsed result of an email attachment of spool.parse_email, from the cache when it was already parsed"""
+    with self.lock:
+      if key in self.cache:
+        self.cache.move_to_end(key)
+        return self.cache[key][0]
+    raw_email = attachment_data(attachment)
+    parsed_eml = parse_email(raw_email, self.spool_threshold)
+    # the temporary files of the spooled attachments belong to the conversion of this email
+    spooled = any(child.get('file') != None for child in parsed_eml.get('attachment') or [])
+    if len(raw_email) <= self.cache_size and not spooled:
+      with self.lock:
+        if key not in self.cache:
+          self.cache[key] = (parsed_eml, len(raw_email))
+          self.cached_bytes += len(raw_email)
+        while self.cached_bytes > self.cache_size:
+          _, (_, size) = self.cache.popitem(last=False)
+          self.cached_bytes -= size
+    return parsed_eml
+
+  def nested_emails(self, parsed_eml, depth=1):
+    """
+    Arguments:
+        parsed_eml: parsed result of an email
+        depth: depth of the emails attached to that email
+    Returns:
+        list of NestedEmail of the emails attached to the email, in the order of its attachments
+    """
+    nested = []
+    # the emails nested in an earlier attachment, they are listed again after it
+    inside = set()
+    for index, attachment in enumerate(parsed_eml.get('attachment') or []):
+      if not is_email(attachment) or attachment.get('part') == None:
+        continue
+      key = content_hash(attachment)
+      if key in inside:
+        continue
+      child_eml = self.parse(attachment, key)
+      # the nested emails are known from the attachments list without parsing them
+      inside.update(content_hash(child_attachment) for child_attachment in child_eml.get('attachment') or []
+                    if is_email(child_attachment) and child_attachment.get('part') != None)
+      children = self.nested_emails(child_eml, depth + 1) if depth < self.max_depth else []
+      nested.append(NestedEmail(index, key, depth, child_eml, children))
+    return nested
@@ -0,0 +1,221 @@
+import hashlib
+import re
+import zlib
+import pydyf
+
+# Plain text emails are drawn directly with the standard PDF fonts, which every PDF reader has,
+# so there is no HTML layout and no font to embed. The standard fonts only have the characters of
+# Windows-1252, other emails go through WeasyPrint.
+ENCODING = 'cp1252'
+
+# A4 page with the 1cm margins of stylesheets.css, in points
+PAGE_WIDTH = 595.28
+PAGE_HEIGHT = 841.89
+MARGIN = 28.35
+
+# header table of header.html: 80% of the default font size, labels in a 64pt column
+HEADER_FONT_SIZE = 9.6
+HEADER_LINE_HEIGHT = 11.5
+HEADER_ROW_SPACING = 2.5
+LABEL_WIDTH = 64
+LABEL_SPACING = 4
+BODY_FONT_SIZE = 10
+BODY_LINE_HEIGHT = 12
+# width of every Courier character, in thousandths of the font size
+COURIER_WIDTH = 600
+TAB_SIZE = 8
+
+# widths of the characters from space to ~ in thousandths of the font size, from the Adobe font metrics
+HELVETICA_WIDTHS = [
+  278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+  556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+  1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+  667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+  333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+  556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584]
+HELVETICA_BOLD_WIDTHS = [
+  278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+  556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+  975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+  667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+  333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+  611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584]
+# width used for the characters outside of the table, mostly accented letters
+DEFAULT_WIDTH = 556
+
+FONTS = {'F1': 'Helvetica', 'F2': 'Helvetica-Bold', 'F3': 'Courier'}
+
+# control characters other than tabs and line breaks can't be drawn
+CONTROL_PATTERN = re.compile(r'[\x00-\x08\x0b-\x1f\x7f]')
+
+def can_render(*texts):
+  """Check if texts only use characters of the standard PDF fonts"""
+  try:
+    for text in texts:
+      text.encode(ENCODING)
+  except UnicodeEncodeError:
+    return False
+  return True
+
+def text_width(text, font_size, widths=HELVETICA_WIDTHS):
+  return sum(widths[ord(c) - 32] if 32 <= ord(c) <= 126 else DEFAULT_WIDTH for c in text) * font_size / 1000
+
+def wrap_words(text, width, font_size):
+  """Split text in lines no wider than width, breaking between words, or inside words longer than a line"""
+  lines = []
+  line = ''
+  for word in re.findall(r'\S+\s*', text):
+    if text_width(line + word.rstrip(), font_size) <= width:
+      line += word
+      continue
+    if line:
+      lines.append(line.rstrip())
+      line = ''
+    while text_width(word.rstrip(), font_size) > width:
+      end = len(word) - 1
+      while end > 1 and text_width(word[:end], font_size) > width:
+        end -= 1
+      lines.append(word[:end])
+      word = word[end:]
+    line = word
+  if line.strip() or len(lines) == 0:
+    lines.append(line.rstrip())
+  return lines
+
+def wrap_lines(text, columns):
+  """Split text in lines of at most columns characters, keeping its line breaks and spaces"""
+  lines = []
+  for line in CONTROL_PATTERN.sub(' ', text.replace('\r\n', '\n').replace('\r', '\n')).split('\n'):
+    line = line.expandtabs(TAB_SIZE).rstrip()
+    while len(line) > columns:
+      lines.append(line[:columns])
+      line = line[columns:]
+    lines.append(line)
+  # like <pre>, the last line break does not make an empty line
+  if len(lines) > 1 and lines[-1] == '':
+    lines.pop()
+  return lines
+
+def pdf_string(text):
+  """PDF literal string of text in the encoding of the standard fonts"""
+  data = text.encode(ENCODING)
+  return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+def show_text(font, font_size, x, y, text):
+  return b'BT /%s %g Tf %.2f %.2f Td %s Tj ET' % (font.encode(), font_size, x, y, pdf_string(text))
+
+def layout(fields, body):
+  """
+  Place the header and the body of a plain text email on pages
+  Arguments:
+      fields: list of (label, text) tuples of the header rows to show
+      body: plain text body
+  Returns:
+      list of pages, each a list of PDF drawing operators
+  """
+  pages = [[]]
+  y = PAGE_HEIGHT - MARGIN
+
+  # header, with labels aligned right in their column like header.html
+  label_width = max([LABEL_WIDTH] + [text_width(label + ' ', HEADER_FONT_SIZE, HELVETICA_BOLD_WIDTHS) for label, _ in fields])
+  value_x = MARGIN + label_width + LABEL_SPACING
+  value_width = PAGE_WIDTH - MARGIN - value_x
+  for label, text in fields:
+    y -= HEADER_ROW_SPACING
+    label_x = MARGIN + label_width - text_width(label, HEADER_FONT_SIZE, HELVETICA_BOLD_WIDTHS)
+    pages[-1].append(show_text('F2', HEADER_FONT_SIZE, label_x, y - HEADER_FONT_SIZE, label))
+    for line in wrap_words(CONTROL_PATTERN.sub(' ', text), value_width, HEADER_FONT_SIZE):
+      if y - HEADER_LINE_HEIGHT < MARGIN:
+        pages.append([])
+        y = PAGE_HEIGHT - MARGIN
+      pages[-1].append(show_text('F1', HEADER_FONT_SIZE, value_x, y - HEADER_FONT_SIZE, line))
+      y -= HEADER_LINE_HEIGHT
+
+  # the <hr/> closing the header
+  y -= HEADER_FONT_SIZE / 2
+  pages[-1].append(b'0.5 G 0.75 w %.2f %.2f m %.2f %.2f l S' % (MARGIN, y, PAGE_WIDTH - MARGIN, y))
+  y -= BODY_FONT_SIZE
+
+  columns = int((PAGE_WIDTH - 2 * MARGIN) * 1000 / (COURIER_WIDTH * BODY_FONT_SIZE))
+  for line in wrap_lines(body, columns):
+    if y - BODY_LINE_HEIGHT < MARGIN:
+      pages.append([])
+      y = PAGE_HEIGHT - MARGIN
+    if line:
+      pages[-1].append(show_text('F3', BODY_FONT_SIZE, MARGIN, y - BODY_FONT_SIZE, line))
+    y -= BODY_LINE_HEIGHT
+  return pages
+
+def embed_file(pdf, file):
+  """
+  Add an attached file to the PDF, compressed by chunks like WeasyPrint does
+  Returns:
+      the file specification dictionary
+  """
+  compress = zlib.compressobj()
+  chunks = []
+  md5 = hashlib.md5()
+  size = 0
+  for data in iter(lambda: file.read(1024 * 1024), b''):
+    size += len(data)
+    md5.update(data)
+    chunks.append(compress.compress(data))
+  chunks.append(compress.flush())
+  stream = pydyf.Stream([b''.join(chunks)], pydyf.Dictionary({
+    'Type': '/EmbeddedFile',
+    'Filter': '/FlateDecode',
+    'Params': pydyf.Dictionary({'CheckSum': '<%s>' % md5.hexdigest(), 'Size': size}),
+  }))
+  pdf.add_object(stream)
+  specification = pydyf.Dictionary({
+    'Type': '/Filespec',
+    'F': pydyf.String(),
+    'UF': pydyf.String(file.name),
+    'EF': pydyf.Dictionary({'F': stream.reference}),
+    'Desc': pydyf.String(''),
+  })
+  pdf.add_object(specification)
+  return specification
+
+def write_pdf(pages, attachment_files, target):
+  """
+  Write the pages produced by layout to a PDF file
+  Arguments:
+      pages: list of pages returned by layout
+      attachment_files: list of file objects to embed, named after the attachment filename
+      target: PDF filename or binary file object
+  """
+  pdf = pydyf.PDF()
+  fonts = pydyf.Dictionary()
+  for name, base_font in FONTS.items():
+    font = pydyf.Dictionary({'Type': '/Font', 'Subtype': '/Type1', 'BaseFont': '/' + base_font, 'Encoding': '/WinAnsiEncoding'})
+    pdf.add_object(font)
+    fonts[name] = font.reference
+  resources = pydyf.Dictionary({'Font': fonts})
+  pdf.add_object(resources)
+
+  for operators in pages:
+    content = pydyf.Stream([zlib.compress(b'\n'.join(operators))], pydyf.Dictionary({'Filter': '/FlateDecode'}))
+    pdf.add_object(content)
+    pdf.add_page(pydyf.Dictionary({
+      'Type': '/Page',
+      'Parent': pdf.pages.reference,
+      'MediaBox': pydyf.Array([0, 0, PAGE_WIDTH, PAGE_HEIGHT]),
+      'Contents': content.reference,
+      'Resources': resources.reference,
+    }))
+
+  if len(attachment_files) > 0:
+    names = pydyf.Array()
+    for index, file in enumerate(attachment_files):
+      names.append(pydyf.String('attachment%d' % index))
+      names.append(embed_file(pdf, file).reference)
+    embedded_files = pydyf.Dictionary({'Names': names})
+    pdf.add_object(embedded_files)
+    pdf.catalog['Names'] = pydyf.Dictionary({'EmbeddedFiles': embedded_files.reference})
+
+  if hasattr(target, 'write'):
+    pdf.write(target)
+  else:
+    with open(target, 'wb') as file:
+      pdf.write(file)
@@ -0,0 +1,112 @@
+import math
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from supervisor import current_rss
+
+# stages of common.Converter.convert, in order
+STAGES = ['parse', 'attachments', 'html', 'layout', 'write']
+
+def peak_rss():
+  """
+  Return the peak resident set size of the current process in bytes.
+  It is the high-water mark of the whole life of the process, not of one conversion.
+  """
+  maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # ru_maxrss is in bytes on macOS but in kilobytes on Linux
+  return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+class Profile:
+  """
+  Wall time and memory of each stage of the conversion of one file, with the sizes of the email.
+  The memory is the resident set size of the process after the stage and how much it grew during the stage,
+  measured on the current process so that it belongs to this file even in a worker converting many files.
+  The record is a JSON serializable dictionary like:
+  {"filename": ..., "stages": {"parse": {"seconds": 0.1, "rss": 52428800, "rss_delta": 1048576}, ...}, "sizes": {"email_bytes": 1024, ...}}
+  rss and rss_delta are None when the memory of the process can't be read.
+  """
+
+  def __init__(self, filename=None):
+    self.record = {'filename': filename, 'stages': {}, 'sizes': {}}
+
+  @contextmanager
+  def stage(self, name):
+    start_rss = current_rss(os.getpid())
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      seconds = time.perf_counter() - start
+      rss = current_rss(os.getpid())
+      rss_delta = rss - start_rss if rss != None and start_rss != None else None
+      # a stage entered twice adds up
+      previous = self.record['stages'].get(name)
+      if previous != None:
+        seconds += previous['seconds']
+        rss_delta = rss_delta + previous['rss_delta'] if rss_delta != None and previous['rss_delta'] != None else None
+      self.record['stages'][name] = {'seconds': seconds, 'rss': rss, 'rss_delta': rss_delta}
+
+  def size(self, name, value):
+    self.record['sizes'][name] = value
+
+class NullProfile:
+  """Profile recording nothing, used when the conversion is not profiled so that its stages cost nothing"""
+
+  @contextmanager
+  def stage(self, name):
+    yield
+
+  def size(self, name, value):
+    pass
+
+def profile_convert(source, log=False, pdf_filename=None):
+  """
+  Convert an email like common.convert, also returning its profile
+  Returns:
+      PDF filename, profile record
+  """
+  from common import convert
+  profile = Profile(source if isinstance(source, str) else pdf_filename)
+  pdf_filename = convert(source, log, profile, pdf_filename)
+  return pdf_filename, profile.record
+
+def percentile(values, percent):
+  """Nearest-rank percentile of a list of numbers"""
+  values = sorted(values)
+  return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+def summarize(records, slowest=5):
+  """
+  Summarize the profile records of a batch
+  Arguments:
+      records: list of profile records
+      slowest: number of slowest files to list
+  Returns:
+      text of the summary
+  """
+  lines = ['Profile of %d file(s)' % len(records)]
+  lines.append('%-12s %10s %10s %10s %10s %10s' % ('stage', 'p50 (s)', 'p90 (s)', 'p99 (s)', 'max (s)', 'total (s)'))
+  for stage in STAGES + ['total']:
+    if stage == 'total':
+      values = [sum(s['seconds'] for s in record['stages'].values()) for record in records]
+    else:
+      values = [record['stages'][stage]['seconds'] for record in records if stage in record['stages']]
+    if len(values) > 0:
+      lines.append('%-12s %10.3f %10.3f %10.3f %10.3f %10.3f' % (
+        stage, percentile(values, 50), percentile(values, 90), percentile(values, 99), max(values), sum(values)))
+
+  # how much the memory of the process grew while converting each file
+  growth = [sum(s['rss_delta'] for s in record['stages'].values()) for record in records
+            if len(record['stages']) > 0 and all(s['rss_delta'] != None for s in record['stages'].values())]
+  if len(growth) > 0:
+    lines.append('RSS growth per file (MB): p50 %.1f, p90 %.1f, max %.1f' % (
+      percentile(growth, 50) / 2**20, percentile(growth, 90) / 2**20, max(growth) / 2**20))
+
+  lines.append('Slowest files:')
+  records = sorted(records, key=lambda record: -sum(s['seconds'] for s in record['stages'].values()))
+  for record in records[:slowest]:
+    sizes = ', '.join('%s %s' % (name, value) for name, value in record['sizes'].items())
+    lines.append('  %.3fs %s (%s)' % (sum(s['seconds'] for s in record['stages'].values()), record['filename'], sizes))
+  return '\n'.join(lines)
@@ -0,0 +1,93 @@
+import json
+import logging
+import os
+import signal
+import socketserver
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from common import convert, configure
+
+logger = logging.getLogger('console.py')
+
+def start_worker(options):
+  """Create the converter of a worker process"""
+  # Ctrl+C is handled by the server process, which shuts the workers down itself
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+  configure(options)
+
+def warm_up():
+  """Runs once in every worker so that the conversion libraries are imported before the first request"""
+  pass
+
+class ConvertRequestHandler(socketserver.StreamRequestHandler):
+  """
+  Handle one client connection.
+  The client sends one JSON line: {"filenames": [...], "log": false}
+  The server answers with one JSON line per file as soon as it is converted: {"filename": ..., "pdf_filename": ..., "error": ...}
+  """
+
+  def handle(self):
+    try:
+      request = json.loads(self.rfile.readline())
+    except ValueError:
+      logger.info("Ignore invalid request")
+      return
+    filenames = request.get('filenames', [])
+    log = bool(request.get('log', False))
+    logger.info("Convert %d file(s)" % len(filenames))
+
+    futures = {self.server.executor.submit(convert, filename, log): filename for filename in filenames}
+    for future in as_completed(futures):
+      result = {'filename': futures[future], 'pdf_filename': None, 'error': None}
+      try:
+        result['pdf_filename'] = future.result()
+      except Exception as e:
+        result['error'] = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+        logger.info("Failed to convert " + futures[future])
+      try:
+        self.wfile.write((json.dumps(result) + '\n').encode())
+      except OSError:
+        # client went away, the remaining conversions still finish in the workers
+        pass
+
+class ConversionServer(socketserver.ThreadingUnixStreamServer):
+  daemon_threads = True
+
+  def __init__(self, socket_path, executor):
+    self.executor = executor
+    super().__init__(socket_path, ConvertRequestHandler)
+
+def serve(socket_path, jobs=1, options={}):
+  """
+  Keep warm worker processes and convert EML files sent by clients over a Unix domain socket
+  Arguments:
+      socket_path: path of the Unix domain socket to listen on
+      jobs: number of worker processes
+      options: dictionary of keyword arguments of common.Converter
+  """
+  # a socket file left over by a server that was killed would make bind fail
+  if os.path.exists(socket_path):
+    os.unlink(socket_path)
+
+  with ProcessPoolExecutor(max_workers=jobs, initializer=start_worker, initargs=(options,)) as executor:
+    # workers are started lazily, so submit one task per worker to start them all now
+    for future in [executor.submit(warm_up) for _ in range(jobs)]:
+      future.result()
+    logger.info("Started %d worker(s)" % jobs)
+
+    # only the current user may send files to convert, the socket is created private
+    # so that nobody can connect between bind and chmod
+    umask = os.umask(0o077)
+    try:
+      server = ConversionServer(socket_path, executor)
+    finally:
+      os.umask(umask)
+    os.chmod(socket_path, 0o600)
+    logger.info("Listening on " + socket_path)
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      server.server_close()
+      os.unlink(socket_path)
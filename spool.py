@@ -0,0 +1,235 @@
+import base64
+import binascii
+import email.parser
+import email.policy
+import hashlib
+import re
+import tempfile
+from io import BytesIO
+
+# attachments larger than this are decoded to temporary files instead of memory
+DEFAULT_SPOOL_THRESHOLD = 8 * 1024 * 1024
+# bytes decoded or copied at once, a multiple of 57 so that the content encoded again in base64 is made of full lines
+CHUNK_SIZE = 57 * 16 * 1024
+# blank line ending the headers of a MIME part
+BLANK_LINE_PATTERN = re.compile(rb'\r?\n\r?\n')
+# first character that is not in base64 lines, searched instead of matching the lines as the regex engine would keep a state for each
+NOT_BASE64_PATTERN = re.compile(rb'[^A-Za-z0-9+/=\r\n]')
+# bytes searched before a body for the headers of its MIME part
+HEADER_WINDOW = 64 * 1024
+# the hashes eml_parser computes for every attachment
+HASHES = ['md5', 'sha1', 'sha256', 'sha512']
+
+class NamedBytesIO(BytesIO):
+  def __init__(self,*args,**kwargs):
+    BytesIO.__init__(self, *args)
+    self.name = kwargs.get('name')
+
+class NamedSpooledTemporaryFile(tempfile.SpooledTemporaryFile):
+  """Kept in memory until it is larger than max_size, then moved to a temporary file. Its name is the attachment filename for WeasyPrint."""
+  def __init__(self, max_size, name):
+    super().__init__(max_size=max_size)
+    self.attachment_name = name
+
+  @property
+  def name(self):
+    return self.attachment_name
+
+def attachment_file(chunks, name, spool_threshold):
+  """
+  Create the file object of an attachment
+  Arguments:
+      chunks: iterable of the decoded content of the attachment, see attachment_chunks
+      name: attachment filename
+      spool_threshold: content larger than this number of bytes goes to a temporary file instead of memory
+  Returns:
+      file object positioned at the start of the content
+  """
+  file = NamedSpooledTemporaryFile(spool_threshold, name)
+  for chunk in chunks:
+    file.write(chunk)
+  file.seek(0)
+  return file
+
+def part_headers(raw_email, end):
+  """
+  Parse the headers of the MIME part whose headers end at the given position of a raw email
+  Returns:
+      email.message.Message of the headers, None when they can't be found
+  """
+  window = raw_email[max(0, end - HEADER_WINDOW):end]
+  # the headers start after the boundary line, or after the blank line ending the headers of an attached email
+  boundary = window.rfind(b'\n--')
+  if boundary >= 0:
+    line_end = window.find(b'\n', boundary + 1)
+    if line_end < 0:
+      return None
+    window = window[line_end + 1:]
+  for blank in BLANK_LINE_PATTERN.finditer(window):
+    window = window[blank.end():]
+  try:
+    return email.parser.BytesHeaderParser(policy=email.policy.default).parsebytes(window)
+  except Exception:
+    return None
+
+def is_spoolable(headers):
+  """Check if a MIME part is a base64 encoded attachment that eml_parser does not read as a body of the email"""
+  try:
+    if headers == None or headers.get('content-transfer-encoding', '').strip().lower() != 'base64':
+      return False
+    if headers.get_content_maintype() in ('multipart', 'message'):
+      return False
+    # the parts eml_parser reads as bodies, see EmlParser.get_raw_body_text
+    filename = headers.get_filename('').lower()
+  except Exception:
+    return False
+  disposition = headers.get_content_disposition()
+  return not (
+    (disposition == None and headers.get_content_maintype() == 'text')
+    or filename.endswith('.html') or filename.endswith('.htm')
+    or (disposition == 'inline' and headers.get_content_maintype() == 'text'))
+
+def spool_body(raw_email, start, end, spool_threshold):
+  """
+  Decode a base64 body of a raw email by chunks to a temporary file, hashing it like eml_parser
+  Returns:
+      dictionary with the file, size and hash of the content, None when it is not valid base64
+  """
+  file = NamedSpooledTemporaryFile(spool_threshold, None)
+  hashes = {name: hashlib.new(name) for name in HASHES}
+  size = 0
+  rest = b''
+  try:
+    for position in range(start, end, CHUNK_SIZE):
+      encoded = rest + raw_email[position:min(end, position + CHUNK_SIZE)].translate(None, b'\r\n')
+      # base64 is decoded by groups of 4 characters, the others wait for the next chunk
+      usable = len(encoded) - len(encoded) % 4 if position + CHUNK_SIZE < end else len(encoded)
+      rest = encoded[usable:]
+      data = base64.b64decode(encoded[:usable] + b'=' * (-usable % 4))
+      file.write(data)
+      for hash in hashes.values():
+        hash.update(data)
+      size += len(data)
+  except binascii.Error:
+    file.close()
+    return None
+  return {'file': file, 'size': size, 'hash': {name: hash.hexdigest() for name, hash in hashes.items()}}
+
+def spool_large_bodies(raw_email, spool_threshold):
+  """
+  Decode the base64 bodies of the attachments larger than spool_threshold straight from a raw email to temporary files,
+  and replace them with placeholders. The email package keeps the lines of a body it parses and joins them,
+  which takes several times the size of the body, so these bodies are not parsed.
+  Arguments:
+      raw_email: raw email as bytes
+      spool_threshold: bodies decoded to a larger content than this number of bytes are spooled
+  Returns:
+      raw email with the placeholders, dictionary of the spooled bodies by placeholder
+  """
+  pieces = []
+  spooled = {}
+  copied = 0
+  position = 0
+  while True:
+    blank = BLANK_LINE_PATTERN.search(raw_email, position)
+    if blank == None:
+      break
+    position = blank.end()
+    end = NOT_BASE64_PATTERN.search(raw_email, position)
+    end = len(raw_email) if end == None else end.start()
+    if (
+      (end - position) // 4 * 3 <= spool_threshold
+      # the whole body is made of base64 lines, up to the boundary line or the end of the email
+      or not (end == len(raw_email) or (raw_email.startswith(b'--', end) and raw_email[end - 1:end] == b'\n'))
+      or not is_spoolable(part_headers(raw_email, blank.start()))
+    ):
+      continue
+    spooled_body = spool_body(raw_email, position, end, spool_threshold)
+    if spooled_body == None:
+      continue
+    # the placeholder is valid base64, named after the content so that the same content gets the same one
+    placeholder = base64.b64encode(b'spooled:' + bytes.fromhex(spooled_body['hash']['sha256']))
+    spooled[placeholder.decode()] = spooled_body
+    pieces.extend([raw_email[copied:position], placeholder + b'\n'])
+    copied = position = end
+  if len(spooled) == 0:
+    return raw_email, spooled
+  pieces.append(raw_email[copied:])
+  return b''.join(pieces), spooled
+
+def parse_email(raw_email, spool_threshold=DEFAULT_SPOOL_THRESHOLD):
+  """
+  Parse an email with eml_parser, keeping the MIME part of every attachment instead of a base64 copy of its content.
+  The attachments larger than spool_threshold are decoded to temporary files before parsing, see spool_large_bodies,
+  the others are decoded from their MIME part when they are needed, see attachment_chunks.
+  Arguments:
+      raw_email: raw email as bytes
+      spool_threshold: attachments larger than this number of bytes are decoded to temporary files instead of memory
+  Returns:
+      parsed result of the email, with under 'part' the MIME part of every attachment, under 'file' the temporary file
+      of the spooled ones and under 'spooled' the spooled bodies of the email for the attached emails
+  """
+  # eml_parser is imported when parsing, so that the command line reads the defaults of this module without loading it
+  import eml_parser
+  raw_email, spooled = spool_large_bodies(raw_email, spool_threshold)
+  ep = eml_parser.EmlParser(include_raw_body=True)
+  prepare_attachment = ep.prepare_multipart_part_attachment
+  def prepare_attachment_with_part(msg, counter=0):
+    attachment = prepare_attachment(msg, counter)
+    for value in attachment.values():
+      value['part'] = msg
+      if msg.get_content_type() == 'message/rfc822':
+        value['spooled'] = spooled
+        continue
+      payload = msg.get_payload()
+      spooled_body = spooled.get(payload.strip()) if isinstance(payload, str) and len(payload) < 100 else None
+      if spooled_body != None:
+        # eml_parser described the placeholder
+        value.update(file=spooled_body['file'], size=spooled_body['size'], hash=spooled_body['hash'])
+        spooled_body['file'].seek(0)
+        mime_type, mime_type_short = ep.get_mime_type(spooled_body['file'].read(2048))
+        value.pop('mime_type', None)
+        value.pop('mime_type_short', None)
+        if mime_type != None and mime_type_short != None:
+          value.update(mime_type=mime_type, mime_type_short=mime_type_short)
+    return attachment
+  ep.prepare_multipart_part_attachment = prepare_attachment_with_part
+  return ep.decode_email_bytes(raw_email)
+
+def attachment_chunks(attachment):
+  """
+  Yield the decoded content of an attachment of parse_email by chunks, like eml_parser decodes it for its hashes.
+  The content of an attached email is its raw email, with the bodies spooled out of it encoded again in base64.
+  """
+  file = attachment.get('file')
+  if file != None:
+    file.seek(0)
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+      yield chunk
+    return
+  part = attachment.get('part')
+  if part.get_content_type() != 'message/rfc822':
+    yield part.get_payload(decode=True)
+    return
+  message = part.get_payload()[0]
+  try:
+    data = message.as_bytes()
+  except UnicodeEncodeError:
+    data = message.as_bytes(policy=email.policy.compat32)
+  spooled = attachment.get('spooled') or {}
+  if len(spooled) == 0:
+    yield data
+    return
+  placeholders = re.compile(b'(' + b'|'.join(re.escape(placeholder.encode()) for placeholder in spooled) + b')')
+  for index, piece in enumerate(placeholders.split(data)):
+    if index % 2 == 0:
+      yield piece
+      continue
+    file = spooled[piece.decode()]['file']
+    file.seek(0)
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+      yield base64.encodebytes(chunk)
+
+def attachment_data(attachment):
+  """Decode the content of an attachment of parse_email, see attachment_chunks"""
+  return b''.join(attachment_chunks(attachment))
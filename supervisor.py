@@ -0,0 +1,224 @@
+import multiprocessing
+import os
+import queue
+import signal
+import subprocess
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+
+# how often a running conversion is checked against the limits, in seconds
+POLL_INTERVAL = 0.2
+# a worker holding more than this part of the memory limit after a conversion is replaced,
+# so that the memory kept by one big file is not blamed on the next one
+RECYCLE_RATIO = 0.75
+
+class ConversionAborted(Exception):
+  """A conversion was stopped by the supervisor, the message tells why"""
+
+class LimitExceeded(ConversionAborted):
+  """A conversion was stopped because it ran longer or used more memory than allowed, the email is to blame"""
+
+class RemoteTraceback(Exception):
+  """Traceback of an exception raised in a worker process, set as the cause of the exception"""
+
+  def __init__(self, text):
+    super().__init__(text)
+    self.text = text
+
+  def __str__(self):
+    return self.text
+
+def current_rss(pid):
+  """Return the current resident set size of a process in bytes, None when it can't be read"""
+  try:
+    with open('/proc/%d/statm' % pid, 'r') as file:
+      return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+  except (OSError, ValueError, IndexError):
+    pass
+  # macOS has no /proc
+  try:
+    output = subprocess.run(['ps', '-o', 'rss=', '-p', str(pid)], capture_output=True, check=True).stdout
+    return int(output) * 1024
+  except (OSError, ValueError, subprocess.CalledProcessError):
+    return None
+
+def failure(e):
+  # the traceback is not pickled with the exception, so it is sent as text
+  return (False, e, ''.join(traceback.format_exception(type(e), e, e.__traceback__)))
+
+def run_worker(connection, initializer, initargs):
+  """Main loop of a worker process: run the tasks received on the connection and send back their results"""
+  # Ctrl+C is handled by the parent process, which stops the workers itself
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+  # a failing initializer, like a broken installation, fails every task like an ordinary error,
+  # the worker must not look like it was killed by an email
+  initializer_failure = None
+  if initializer != None:
+    try:
+      initializer(*initargs)
+    except Exception as e:
+      initializer_failure = failure(e)
+  # tell the parent that the worker is ready, so that its memory is measured before the first task
+  connection.send(None)
+  while True:
+    try:
+      task = connection.recv()
+    except EOFError:
+      return
+    if task == None:
+      return
+    fn, args, kwargs = task
+    if initializer_failure != None:
+      result = initializer_failure
+    else:
+      try:
+        result = (True, fn(*args, **kwargs), None)
+      except Exception as e:
+        result = failure(e)
+    try:
+      connection.send(result)
+    except Exception:
+      # the exception can't be pickled, send its text instead
+      connection.send((False, RuntimeError(str(result[1])), result[2]))
+
+class Worker:
+  """A worker process with the connection to send it tasks"""
+
+  def __init__(self, context, initializer, initargs):
+    self.connection, child_connection = context.Pipe()
+    self.process = context.Process(target=run_worker, args=(child_connection, initializer, initargs), daemon=True)
+    self.process.start()
+    child_connection.close()
+
+  def rss(self):
+    return current_rss(self.process.pid)
+
+  def kill(self):
+    self.process.kill()
+    self.process.join()
+    self.connection.close()
+
+  def stop(self):
+    try:
+      self.connection.send(None)
+    except OSError:
+      pass
+    self.process.join()
+    self.connection.close()
+
+class SupervisedPool:
+  """
+  Pool of worker processes in which every task runs under a wall-clock and memory limit.
+  A worker running a task over a limit is killed and replaced, the future of the task gets
+  a LimitExceeded exception and the other tasks go on. A worker dying for another reason gives
+  a ConversionAborted exception.
+  Like concurrent.futures.ProcessPoolExecutor, tasks and their results must be picklable.
+  """
+
+  def __init__(self, max_workers, timeout=None, max_rss=None, initializer=None, initargs=()):
+    """
+    Arguments:
+        max_workers: number of worker processes
+        timeout: seconds a task may run, None for no limit
+        max_rss: bytes of resident memory a worker may use, None for no limit
+        initializer: function called with initargs when a worker process starts
+    """
+    self.timeout = timeout
+    self.max_rss = max_rss
+    self.initializer = initializer
+    self.initargs = initargs
+    self.context = multiprocessing.get_context()
+    self.tasks = queue.Queue()
+    # one thread per worker process sends it tasks and watches it
+    self.threads = [threading.Thread(target=self.supervise, daemon=True) for _ in range(max_workers)]
+    for thread in self.threads:
+      thread.start()
+
+  def submit(self, fn, *args, **kwargs):
+    future = Future()
+    self.tasks.put((future, fn, args, kwargs))
+    return future
+
+  def shutdown(self, wait=True):
+    for _ in self.threads:
+      self.tasks.put(None)
+    if wait:
+      for thread in self.threads:
+        thread.join()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.shutdown()
+    return False
+
+  def supervise(self):
+    worker = None
+    try:
+      while True:
+        task = self.tasks.get()
+        if task == None:
+          return
+        future, fn, args, kwargs = task
+        if not future.set_running_or_notify_cancel():
+          continue
+        try:
+          if worker == None:
+            worker = Worker(self.context, self.initializer, self.initargs)
+            self.wait_ready(worker)
+          future.set_result(self.run(worker, fn, args, kwargs))
+        except ConversionAborted as e:
+          if worker != None:
+            worker.kill()
+          worker = None
+          future.set_exception(e)
+          continue
+        except Exception as e:
+          future.set_exception(e)
+        if self.max_rss != None and worker != None and (worker.rss() or 0) > self.max_rss * RECYCLE_RATIO:
+          worker.stop()
+          worker = None
+    finally:
+      if worker != None:
+        worker.stop()
+
+  def wait_ready(self, worker):
+    """Wait until a new worker ran the initializer, and check that it leaves room for a conversion under the memory limit"""
+    while not worker.connection.poll(POLL_INTERVAL):
+      if not worker.process.is_alive():
+        raise ConversionAborted('worker process died at start with exit code %s' % worker.process.exitcode)
+    try:
+      worker.connection.recv()
+    except EOFError:
+      worker.process.join()
+      raise ConversionAborted('worker process died at start with exit code %s' % worker.process.exitcode)
+    rss = worker.rss()
+    if self.max_rss != None and rss != None and rss > self.max_rss:
+      raise ConversionAborted('the memory limit of %g MB is below the %.0f MB a worker uses before converting anything' % (
+        self.max_rss / 2**20, rss / 2**20))
+
+  def run(self, worker, fn, args, kwargs):
+    """Run one task in the worker and wait for its result, enforcing the limits"""
+    start = time.monotonic()
+    worker.connection.send((fn, args, kwargs))
+    while not worker.connection.poll(POLL_INTERVAL):
+      if not worker.process.is_alive():
+        raise ConversionAborted('worker process died with exit code %s' % worker.process.exitcode)
+      seconds = time.monotonic() - start
+      if self.timeout != None and seconds > self.timeout:
+        raise LimitExceeded('still running after %g seconds' % self.timeout)
+      if self.max_rss != None:
+        rss = worker.rss()
+        if rss != None and rss > self.max_rss:
+          raise LimitExceeded('used %.0f MB of memory, more than the limit of %g MB' % (rss / 2**20, self.max_rss / 2**20))
+    try:
+      success, value, remote_traceback = worker.connection.recv()
+    except EOFError:
+      worker.process.join()
+      raise ConversionAborted('worker process died with exit code %s' % worker.process.exitcode)
+    if not success:
+      raise value from RemoteTraceback(remote_traceback)
+    return value
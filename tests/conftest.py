@@ -0,0 +1,11 @@
+import os
+import sys
+
+# the modules are at the top of the repository, next to console.py, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def write(path, data=b'x'):
+  """Write a test file and return its name, shared by the test modules with from conftest import write"""
+  with open(path, 'wb') as file:
+    file.write(data)
+  return str(path)
@@ -0,0 +1,44 @@
+import mailboxes
+from archive import DATE, THREAD, order_emails
+
+def message(message_id, date, subject='', in_reply_to=None, references=None):
+  headers = ['Message-ID: <%s>' % message_id, 'Subject: ' + subject]
+  if date != None:
+    headers.append('Date: ' + date)
+  if in_reply_to != None:
+    headers.append('In-Reply-To: <%s>' % in_reply_to)
+  if references != None:
+    headers.append('References: ' + ' '.join('<%s>' % reference for reference in references))
+  return ('\r\n'.join(headers) + '\r\n\r\nbody\r\n').encode()
+
+def test_order_by_date():
+  first = message('1@x', 'Mon, 01 Jan 2024 10:00:00 +0000')
+  # same time, given later
+  second = message('2@x', 'Mon, 01 Jan 2024 11:00:00 +0100')
+  third = message('3@x', 'Tue, 02 Jan 2024 09:00:00 -0500')
+  undated = message('4@x', None)
+  assert order_emails([third, second, first, undated], DATE) == [(undated, 1), (second, 1), (first, 1), (third, 1)]
+
+def test_order_by_thread():
+  question = message('q@x', 'Mon, 01 Jan 2024 10:00:00 +0000')
+  other = message('o@x', 'Mon, 01 Jan 2024 11:00:00 +0000')
+  answer = message('a@x', 'Mon, 01 Jan 2024 12:00:00 +0000', in_reply_to='q@x', references=['q@x'])
+  follow_up = message('f@x', 'Tue, 02 Jan 2024 10:00:00 +0000', references=['q@x', 'a@x'])
+  # the start of this thread is not in the archive
+  late_reply = message('l@x', 'Wed, 03 Jan 2024 10:00:00 +0000', references=['missing@x'])
+  late_reply_2 = message('l2@x', 'Thu, 04 Jan 2024 10:00:00 +0000', references=['missing@x', 'l@x'])
+  ordered = order_emails([follow_up, late_reply_2, other, answer, late_reply, question], THREAD)
+  assert ordered == [(question, 1), (answer, 2), (follow_up, 2), (other, 1), (late_reply, 1), (late_reply_2, 2)]
+
+def test_order_reads_only_the_headers_of_mailbox_emails(tmp_path):
+  path = str(tmp_path / 'Inbox.mbox')
+  with open(path, 'wb') as file:
+    file.write(b'From a@x Mon Jan  1 10:00:00 2024\n' + message('2@x', 'Tue, 02 Jan 2024 10:00:00 +0000', 'Second') +
+               b'\nFrom a@x Mon Jan  1 10:00:00 2024\n' + message('1@x', 'Mon, 01 Jan 2024 10:00:00 +0000', 'First') +
+               b'>From the body\n')
+  sources = list(mailboxes.iterate_messages(path))
+  assert [source.read() for source in sources] == list(mailboxes.iterate_mbox(path))
+  assert str(sources[0]) == 'email 1 of ' + path
+  assert b'From the body' not in sources[1].read_headers()
+  ordered = order_emails(sources, DATE)
+  assert [(source.number, level) for source, level in ordered] == [(2, 1), (1, 1)]
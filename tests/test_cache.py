@@ -0,0 +1,59 @@
+import os
+import sys
+
+import cache
+from cache import ConversionCache, data_hash, file_hash, user_cache_directory
+from conftest import write
+
+def test_file_hash_matches_data_hash(tmp_path, monkeypatch):
+  # read in several chunks
+  monkeypatch.setattr(cache, 'CHUNK_SIZE', 7)
+  data = b'From: a@example.com\r\n\r\n' + b'x' * 100
+  assert file_hash(write(tmp_path / 'a.eml', data)) == data_hash(data)
+
+def test_current_after_store(tmp_path):
+  pdf_filename = write(tmp_path / 'a.pdf', b'%PDF-1.7')
+  conversions = ConversionCache(str(tmp_path / 'cache.sqlite'))
+  assert not conversions.is_current(pdf_filename, 'hash')
+  conversions.store(pdf_filename, 'hash')
+  assert conversions.is_current(pdf_filename, 'hash')
+  assert not conversions.is_current(pdf_filename, 'other hash')
+  conversions.close()
+
+  # the record outlives the process
+  conversions = ConversionCache(str(tmp_path / 'cache.sqlite'))
+  assert conversions.is_current(pdf_filename, 'hash')
+  conversions.close()
+
+def test_not_current_when_pdf_changed_or_removed(tmp_path):
+  pdf_filename = write(tmp_path / 'a.pdf', b'%PDF-1.7')
+  conversions = ConversionCache(str(tmp_path / 'cache.sqlite'))
+  conversions.store(pdf_filename, 'hash')
+  write(pdf_filename, b'%PDF-1.7 edited')
+  assert not conversions.is_current(pdf_filename, 'hash')
+  os.remove(pdf_filename)
+  assert not conversions.is_current(pdf_filename, 'hash')
+
+def test_not_current_with_other_options(tmp_path):
+  pdf_filename = write(tmp_path / 'a.pdf', b'%PDF-1.7')
+  ConversionCache(str(tmp_path / 'cache.sqlite'), {'max_dpi': None}).store(pdf_filename, 'hash')
+  assert ConversionCache(str(tmp_path / 'cache.sqlite'), {'max_dpi': None}).is_current(pdf_filename, 'hash')
+  assert not ConversionCache(str(tmp_path / 'cache.sqlite'), {'max_dpi': 150}).is_current(pdf_filename, 'hash')
+
+def test_relative_and_absolute_filenames_are_the_same_file(tmp_path, monkeypatch):
+  monkeypatch.chdir(tmp_path)
+  write(tmp_path / 'a.pdf', b'%PDF-1.7')
+  conversions = ConversionCache('cache.sqlite')
+  conversions.store('a.pdf', 'hash')
+  assert conversions.is_current(str(tmp_path / 'a.pdf'), 'hash')
+
+def test_user_cache_directory(tmp_path, monkeypatch):
+  monkeypatch.setattr(sys, 'platform', 'linux')
+  monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'xdg'))
+  directory = user_cache_directory()
+  assert directory == str(tmp_path / 'xdg' / 'eml-to-pdf')
+  assert os.path.isdir(directory)
+
+  monkeypatch.delenv('XDG_CACHE_HOME')
+  monkeypatch.setenv('HOME', str(tmp_path / 'home'))
+  assert user_cache_directory() == str(tmp_path / 'home' / '.cache' / 'eml-to-pdf')
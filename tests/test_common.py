@@ -0,0 +1,199 @@
+import base64
+import email.message
+import io
+import os
+
+import html5lib
+import pytest
+import tinycss2
+
+pytest.importorskip('eml_parser')
+
+import common
+from common import (Converter, check_attribute, generate_header, fix_inline_block_width, inline_content_ids, nested_content_ids, parse_attachments,
+                    rewrite_tree, serialize, strip_anchor_name, strip_id)
+from nested import NestedEmailParser
+from spool import parse_email
+
+def forwarded_email():
+  """Parsed email forwarding an email with a document and a logo placed in its body, both with a content ID"""
+  inner = email.message.EmailMessage()
+  inner['From'] = 'a@example.com'
+  inner['Subject'] = 'Inner'
+  inner.set_content('<p>see <img src="cid:logo@x"></p>', subtype='html')
+  inner.add_attachment(b'%PDF doc', maintype='application', subtype='pdf', filename='doc.pdf', cid='<doc123@x>')
+  inner.add_attachment(b'png', maintype='image', subtype='png', filename='logo.png', cid='<logo@x>')
+  outer = email.message.EmailMessage()
+  outer['From'] = 'b@example.com'
+  outer['Subject'] = 'Outer'
+  outer.set_content('Forwarded')
+  outer.add_attachment(inner, filename='inner.eml')
+  return parse_email(outer.as_bytes())
+
+def test_inline_nested_email_keeps_its_files():
+  parsed_eml = forwarded_email()
+  nested_emails = NestedEmailParser().nested_emails(parsed_eml)
+  # only the logo is placed in the nested section, the document must still be attached
+  assert nested_content_ids(nested_emails, True) == {'<logo@x>'}
+  files, filenames, _ = parse_attachments(parsed_eml, nested_emails, 'Forwarded', inline_nested=True)
+  assert filenames == ['doc.pdf']
+  assert files[0].read() == b'%PDF doc'
+
+def test_attached_nested_email_holds_its_files():
+  parsed_eml = forwarded_email()
+  nested_emails = NestedEmailParser().nested_emails(parsed_eml)
+  assert nested_content_ids(nested_emails, False) == {'<doc123@x>', '<logo@x>'}
+  _, filenames, _ = parse_attachments(parsed_eml, nested_emails, 'Forwarded')
+  assert filenames == ['inner.eml']
+
+def image(content_id, data):
+  """Attachment of spool.parse_email of a PNG image with a content ID"""
+  part = email.message.EmailMessage()
+  part.set_content(data, maintype='image', subtype='png', cid=content_id)
+  return {'content_header': {'content-id': [content_id], 'content-type': ['image/png; name="image.png"']}, 'part': part}
+
+def data_uri(data):
+  return 'data:image/png;base64,' + base64.b64encode(data).decode()
+
+def test_inline_quoted_and_unquoted_references():
+  attachments = [image('<img1>', b'one')]
+  for body, expected in [
+    ('<img src="cid:img1">', '<img src="%s">'),
+    ("<img src='cid:img1'>", "<img src='%s'>"),
+    ('<img src=cid:img1>', '<img src=%s>'),
+    # the slash closes the tag, it is not part of the content ID
+    ('<img src=cid:img1/>', '<img src=%s/>'),
+    ('<img src=cid:img1 alt="">', '<img src=%s alt="">'),
+    ('<td style="background: url(cid:img1)">', '<td style="background: url(%s)">'),
+    ("<td style=\"background: url('cid:img1')\">", "<td style=\"background: url('%s')\">"),
+  ]:
+    assert inline_content_ids(attachments, body, set()) == (expected % data_uri(b'one'), {0})
+
+def test_inline_whole_content_ids_only():
+  attachments = [image('<img1>', b'one'), image('<img10>', b'ten')]
+  body, placed = inline_content_ids(attachments, '<img src="cid:img10"><img src=cid:img1>', set())
+  assert body == '<img src="%s"><img src=%s>' % (data_uri(b'ten'), data_uri(b'one'))
+  assert placed == {0, 1}
+  # an unknown content ID is left as it is, even when a known one is a prefix of it
+  assert inline_content_ids(attachments, '<img src="cid:img100">', set()) == ('<img src="cid:img100">', set())
+
+def test_inline_duplicate_content_ids():
+  attachments = [image('<logo>', b'first'), image('<logo>', b'second')]
+  body, placed = inline_content_ids(attachments, '<img src="cid:logo"><img src="cid:logo">', set())
+  # the first attachment is used for every reference, the other one is attached
+  assert body == '<img src="%s"><img src="%s">' % (data_uri(b'first'), data_uri(b'first'))
+  assert placed == {0}
+
+def test_inline_leaves_nested_content_ids():
+  attachments = [image('<nested>', b'nested'), image('<own>', b'own')]
+  body, placed = inline_content_ids(attachments, '<img src="cid:nested"><img src="cid:own">', {'<nested>'})
+  assert body == '<img src="cid:nested"><img src="%s">' % data_uri(b'own')
+  assert placed == {1}
+
+def old_fixups(elements, has_attachments):
+  """The fixups as they were done with findall before rewrite_tree"""
+  if has_attachments:
+    for element in elements.findall('*//*[@id]'):
+      del element.attrib['id']
+    for element in elements.findall('*//a[@name]'):
+      del element.attrib['name']
+  for element in elements.findall('*//*[@style]'):
+    declarations = tinycss2.parse_declaration_list(element.attrib['style'])
+    found_width_100_percent = False
+    found_display_inline_block = False
+    for d in declarations:
+      if check_attribute(d, 'name', 'display') and hasattr(d, 'value') and len(d.value) > 0 and check_attribute(d.value[0], 'lower_value', 'inline-block'):
+        found_display_inline_block = True
+      if check_attribute(d, 'name', 'width') and hasattr(d, 'value') and len(d.value) > 0 and check_attribute(d.value[0], 'type', 'percentage') and check_attribute(d.value[0], 'value', 100):
+        found_width_100_percent = True
+    if found_width_100_percent and found_display_inline_block:
+      new_styles = []
+      for d in declarations:
+        if not (hasattr(d, 'name') and d.name == 'display' and len(d.value) > 0 and d.value[0].lower_value == 'inline-block'):
+          new_styles.append(d.serialize())
+      element.attrib['style'] = ';'.join(new_styles)
+
+REWRITTEN_HTML = [
+  '<html id="root"><head id="head"><style id="s">p {}</style></head><body id="body"><p id="p">Hi <a name="top" id="a">top</a></p></body></html>',
+  '<div style="display:inline-block;width:100%">full</div><div style="display: inline-block; width: 50%">half</div>',
+  '<table><tr><td style="WIDTH: 100%; Display: Inline-Block !important; color: red" id="cell">cell</td></tr></table>',
+  '<span style="width:100%">width only</span><span style="display:inline-block">display only</span><i style="">empty</i>',
+  '<p style="display:inline-block;width:100%;display:block">twice</p><a name="x"><b id="y" style="width:100%;display:inline-block">deep</b></a>',
+]
+
+@pytest.mark.parametrize('has_attachments', [False, True])
+@pytest.mark.parametrize('content_string', REWRITTEN_HTML)
+def test_rewrite_tree_matches_the_old_fixups(content_string, has_attachments):
+  old = html5lib.parse(content_string, namespaceHTMLElements=False)
+  old_fixups(old, has_attachments)
+  new = html5lib.parse(content_string, namespaceHTMLElements=False)
+  rewriters = [fix_inline_block_width]
+  if has_attachments:
+    rewriters = [strip_id, strip_anchor_name] + rewriters
+  rewrite_tree(new, rewriters)
+  assert serialize(new) == serialize(old)
+
+def test_fix_inline_block_width():
+  element = html5lib.parse('<div style="display:inline-block; width:100%; color:red">', namespaceHTMLElements=False).find('*//div')
+  fix_inline_block_width(element)
+  assert 'display' not in element.attrib['style']
+  assert 'width:100%;' in element.attrib['style'] and element.attrib['style'].endswith('color:red')
+  # the styles that can't have both declarations are left as they are
+  element.attrib['style'] = 'display:inline-block;width:100px'
+  fix_inline_block_width(element)
+  assert element.attrib['style'] == 'display:inline-block;width:100px'
+
+def prepare_html(content_string, is_html=True, has_attachments=False):
+  # prepare_html does not use the WeasyPrint setup of the converter
+  converter = Converter.__new__(Converter)
+  return converter.prepare_html(content_string, '<table class="header"></table>', is_html, has_attachments)
+
+def test_prepare_html_inserts_the_header_in_the_first_element():
+  assert prepare_html('<div>Hello<p>World</p></div>') == '<div><table class=header></table>Hello<p>World</div>'
+
+def test_prepare_html_skips_a_leading_comment():
+  # a comment can't hold the header, it goes to the element after it
+  assert prepare_html('<body><!-- generated --><div id="a">Hello</div>', has_attachments=True) == (
+    '<body><!-- generated --><div><table class=header></table>Hello</div>')
+
+def test_prepare_html_without_elements_in_the_body():
+  assert prepare_html('Hello') == '<table class="header"></table>Hello'
+
+def test_prepare_html_of_plain_text():
+  assert prepare_html('1 < 2', is_html=False) == '<table class="header"></table><pre>1 &lt; 2</pre>'
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def simple_email(subject):
+  message = email.message.EmailMessage()
+  message['From'] = 'a@example.com'
+  message['To'] = 'b@example.com'
+  message['Subject'] = subject
+  message.set_content('<p>Hello</p>', subtype='html')
+  return message.as_bytes()
+
+def test_generate_header_from_another_directory(tmp_path, monkeypatch):
+  monkeypatch.chdir(tmp_path)
+  assert common.BASE_DIRECTORY == REPOSITORY
+  header = generate_header(parse_email(simple_email('<Hi & bye>')), ['a.pdf'])
+  with open(os.path.join(REPOSITORY, 'header.html'), 'r') as file:
+    assert header == generate_header(parse_email(simple_email('<Hi & bye>')), ['a.pdf'], file.read())
+  assert '&lt;Hi &amp; bye&gt;' in header and 'a.pdf' in header
+
+def test_converter_from_another_directory(tmp_path, monkeypatch):
+  try:
+    import weasyprint
+  except (ImportError, OSError) as e:
+    pytest.skip('WeasyPrint can not be loaded: %s' % e)
+  monkeypatch.chdir(tmp_path)
+  converter = Converter(fast_plain_text=False)
+  with open(os.path.join(REPOSITORY, 'header.html'), 'r') as file:
+    assert converter.header_template == file.read()
+  stylesheets, font_config = converter.stylesheets, converter.font_config
+  for subject in ('First', 'Second'):
+    output = io.BytesIO()
+    converter.convert(simple_email(subject), pdf_filename=output)
+    assert output.getvalue().startswith(b'%PDF')
+  # the template, the stylesheet and the fonts are loaded once for all the emails
+  assert converter.stylesheets is stylesheets and converter.font_config is font_config
+  assert os.listdir(tmp_path) == []
@@ -0,0 +1,107 @@
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+CONSOLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'console.py')
+
+def run_console(tmp_path, *arguments, stdin=b'', python_options=[]):
+  """Run console.py in tmp_path, with the cache files in tmp_path too"""
+  environment = dict(os.environ, XDG_CACHE_HOME=str(tmp_path / 'cache'))
+  return subprocess.run([sys.executable] + python_options + [CONSOLE] + list(arguments), cwd=str(tmp_path), env=environment,
+                        input=stdin, capture_output=True, timeout=60)
+
+def test_pipe_refuses_profile(tmp_path):
+  result = run_console(tmp_path, '--stdout', '--profile', 'a.eml')
+  assert result.returncode == 2
+  assert b'--profile is not available with --stdout' in result.stderr
+
+def test_pipe_refuses_several_files(tmp_path):
+  result = run_console(tmp_path, '--stdout', 'a.eml', 'b.eml')
+  assert result.returncode == 2
+  assert b'--stdout converts one email' in result.stderr
+
+def test_pipe_writes_logs(tmp_path):
+  # the email can't be read, but the log directory is there for the messages
+  result = run_console(tmp_path, '-l', '--stdout', 'missing.eml')
+  assert result.returncode == 1
+  assert result.stdout == b''
+  assert os.path.isfile(tmp_path / 'log' / 'console.txt')
+
+def imported_modules(result):
+  # -X importtime lists every imported module on stderr
+  return set(line.split('|')[-1].strip() for line in result.stderr.decode().splitlines() if line.startswith('import time:'))
+
+def test_help_does_not_import_the_conversion_libraries():
+  from benchmark import measure_startup
+  assert measure_startup(repeat=1)['heavy_modules'] == []
+
+def test_existing_pdf_files_do_not_import_the_conversion_libraries(tmp_path):
+  from benchmark import HEAVY_MODULES
+  for name in ('a.eml', 'a.pdf'):
+    with open(tmp_path / name, 'wb') as file:
+      file.write(b'')
+  result = run_console(tmp_path, 'a.eml', python_options=['-X', 'importtime'])
+  assert result.returncode == 0
+  assert b'Do nothing because there are PDF existing files' in result.stdout
+  assert [module for module in HEAVY_MODULES if module in imported_modules(result)] == []
+
+def test_archive_reports_files_it_can_not_read(tmp_path):
+  with open(tmp_path / 'notes.txt', 'wb') as file:
+    file.write(b'not an email\n')
+  result = run_console(tmp_path, '-a', 'archive.pdf', 'notes.txt', 'missing.eml')
+  assert result.returncode == 1
+  assert b'notes.txt is not an EML file or mailbox' in result.stdout
+  assert b'missing.eml does not exist' in result.stdout
+  assert not os.path.exists(tmp_path / 'archive.pdf')
+
+def test_connect_refuses_converter_options(tmp_path):
+  result = run_console(tmp_path, '--connect', '--max-dpi', '150', '--inline-nested', 'a.eml')
+  assert result.returncode == 2
+  assert b'--max-dpi, --inline-nested not available with --connect' in result.stderr
+
+def test_connect_refuses_mailboxes(tmp_path):
+  with open(tmp_path / 'box.mbox', 'wb') as file:
+    file.write(b'From a@x Mon Jan  1 10:00:00 2024\nSubject: Hello\n\nbody\n')
+  result = run_console(tmp_path, '--connect', 'box.mbox')
+  assert result.returncode == 2
+  assert b'mailboxes are not available with --connect: box.mbox' in result.stderr
+
+def convert_when_released(filename, log):
+  """Conversion task for the worker processes: slow.eml waits for a .go file, bad.eml fails"""
+  if filename.endswith('slow.eml'):
+    deadline = time.time() + 30
+    while not os.path.exists(filename + '.go'):
+      if time.time() > deadline:
+        raise TimeoutError('the other results were not yielded before this one finished')
+      time.sleep(0.01)
+  if filename.endswith('bad.eml'):
+    raise ValueError('can not convert bad.eml')
+  return os.path.basename(filename)
+
+def test_jobs_yield_results_in_completion_order(tmp_path, monkeypatch):
+  import console
+  # the workers would load WeasyPrint to configure the converter, the dummy task does not need it
+  monkeypatch.setattr(console, 'new_pool', lambda jobs: ProcessPoolExecutor(max_workers=jobs))
+  slow, fast, bad = [str(tmp_path / name) for name in ('slow.eml', 'fast.eml', 'bad.eml')]
+  results = []
+  for filename, result, error in console.convert_files([slow, fast, bad], jobs=3, task=convert_when_released):
+    results.append((filename, result, error))
+    if len(results) == 2:
+      # slow.eml only finishes once the results of the others have been received
+      open(slow + '.go', 'w').close()
+  assert sorted(result[0] for result in results[:2]) == [bad, fast]
+  assert results[2] == (slow, 'slow.eml', None)
+  assert (fast, 'fast.eml', None) in results
+  # the error of a worker is yielded with its file instead of stopping the others
+  filename, result, error = next(result for result in results if result[0] == bad)
+  assert result == None and isinstance(error, ValueError) and str(error) == 'can not convert bad.eml'
+
+def test_jobs_with_an_executor(tmp_path):
+  import console
+  filenames = [str(tmp_path / name) for name in ('a.eml', 'bad.eml')]
+  with ProcessPoolExecutor(max_workers=2) as executor:
+    results = sorted(console.convert_files(filenames, executor=executor, task=convert_when_released), key=lambda result: result[0])
+  assert results[0] == (filenames[0], 'a.eml', None)
+  assert results[1][0] == filenames[1] and results[1][1] == None and isinstance(results[1][2], ValueError)
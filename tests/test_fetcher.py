@@ -0,0 +1,85 @@
+import time
+
+import fetcher
+from fetcher import PLACEHOLDER_IMAGE, CachingUrlFetcher, UrlCache, find_urls
+
+def resource(data, mime_type='image/png'):
+  return {'string': data, 'mime_type': mime_type, 'redirected_url': None, 'filename': None, 'encoding': None}
+
+def test_find_urls():
+  content_string = '''
+    <link rel="stylesheet" href="https://example.com/style.css?a=1&amp;b=2">
+    <link href='https://example.com/print.css' rel='alternate stylesheet'>
+    <link rel="icon" href="https://example.com/favicon.ico">
+    <script src="https://example.com/tracker.js"></script>
+    <img width=1 SRC=https://example.com/logo.png>
+    <img data-src="https://example.com/lazy.png" src="cid:image001">
+    <div style="background-image: url( 'http://example.com/background.jpg' )"></div>
+    <a href="https://example.com/unsubscribe">Unsubscribe</a>
+    <img src="https://example.com/logo.png">'''
+  assert find_urls(content_string) == [
+    'https://example.com/style.css?a=1&b=2', 'https://example.com/print.css',
+    'https://example.com/logo.png', 'http://example.com/background.jpg']
+
+def test_cache_stores_resources(tmp_path):
+  path = str(tmp_path / 'urls.sqlite')
+  cache = UrlCache(path)
+  assert cache.get('https://example.com/a.png') == None
+  cache.store('https://example.com/a.png', resource(b'png'))
+  cache.close()
+
+  cache = UrlCache(path)
+  assert cache.get('https://example.com/a.png') == resource(b'png')
+
+def test_cache_removes_least_recently_used(tmp_path, monkeypatch):
+  now = [1000.0]
+  monkeypatch.setattr(time, 'time', lambda: now[0])
+  cache = UrlCache(str(tmp_path / 'urls.sqlite'), max_size=25)
+  for name in 'abc':
+    now[0] += 1
+    cache.store('https://example.com/%s.png' % name, resource(name.encode() * 10))
+  # c pushed a out
+  assert cache.get('https://example.com/a.png') == None
+  now[0] += 1
+  cache.get('https://example.com/b.png')
+  now[0] += 1
+  cache.store('https://example.com/d.png', resource(b'd' * 10))
+  # b was used after c
+  assert cache.get('https://example.com/c.png') == None
+  assert cache.get('https://example.com/b.png') != None
+  assert cache.get('https://example.com/d.png') != None
+
+def test_cache_skips_resources_larger_than_the_cache(tmp_path):
+  cache = UrlCache(str(tmp_path / 'urls.sqlite'), max_size=5)
+  cache.store('https://example.com/big.png', resource(b'x' * 6))
+  assert cache.get('https://example.com/big.png') == None
+
+def test_offline_uses_the_cache_then_placeholders(tmp_path, monkeypatch):
+  cache_path = str(tmp_path / 'urls.sqlite')
+  UrlCache(cache_path).store('https://example.com/cached.png', resource(b'png'))
+  url_fetcher = CachingUrlFetcher(cache_path, offline=True)
+  url_fetcher.prefetch(['https://example.com/cached.png', 'https://example.com/missing.png', 'https://example.com/style.css?v=2'])
+  assert url_fetcher.resources['https://example.com/cached.png']['string'] == b'png'
+  assert url_fetcher.resources['https://example.com/missing.png']['string'] == PLACEHOLDER_IMAGE
+  assert url_fetcher.resources['https://example.com/style.css?v=2'] == {
+    'string': b'', 'mime_type': 'text/css', 'redirected_url': 'https://example.com/style.css?v=2'}
+
+  # resources already fetched for the document are not fetched again
+  monkeypatch.setattr(url_fetcher, 'fetch', lambda url: resource(b'again'))
+  url_fetcher.prefetch(['https://example.com/cached.png'])
+  assert url_fetcher.resources['https://example.com/cached.png']['string'] == b'png'
+  url_fetcher.clear()
+  assert url_fetcher.resources == {}
+
+def test_prefetch_runs_in_parallel(monkeypatch):
+  monkeypatch.setattr(fetcher, 'PREFETCH_THREADS', 4)
+  url_fetcher = CachingUrlFetcher()
+  def slow_fetch(url):
+    time.sleep(0.2)
+    return resource(url.encode())
+  monkeypatch.setattr(url_fetcher, 'fetch', slow_fetch)
+  urls = ['https://example.com/%d.png' % index for index in range(4)]
+  start = time.monotonic()
+  url_fetcher.prefetch(urls)
+  assert time.monotonic() - start < 0.6
+  assert [url_fetcher.resources[url]['string'] for url in urls] == [url.encode() for url in urls]
@@ -0,0 +1,62 @@
+import base64
+import io
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+from images import PAGE_WIDTH, ImageOptimizer
+
+def encode(image, format, **options):
+  output = io.BytesIO()
+  image.save(output, format, **options)
+  return base64.b64encode(output.getvalue())
+
+def decode(data):
+  return Image.open(io.BytesIO(base64.b64decode(data)))
+
+def noise(size):
+  # random pixels, so that the image does not compress to nothing
+  return Image.frombytes('RGB', size, bytes((index * 7919) % 251 for index in range(size[0] * size[1] * 3)))
+
+def test_large_jpeg_is_downscaled_to_the_page():
+  optimizer = ImageOptimizer(max_dpi=50)
+  content_type, data = optimizer.optimize('image/jpeg', encode(noise((1200, 300)), 'JPEG', quality=95))
+  assert content_type == 'image/jpeg'
+  image = decode(data)
+  assert image.format == 'JPEG'
+  assert image.size == (round(PAGE_WIDTH * 50), round(PAGE_WIDTH * 50 / 4))
+
+def test_png_stays_png():
+  optimizer = ImageOptimizer(max_dpi=50)
+  content_type, data = optimizer.optimize('image/png', encode(noise((1200, 300)).convert('RGBA'), 'PNG'))
+  assert content_type == 'image/png'
+  assert decode(data).mode == 'RGBA'
+
+def test_small_image_is_kept_when_it_does_not_get_smaller():
+  optimizer = ImageOptimizer(max_dpi=300)
+  data = encode(Image.new('RGB', (10, 10), 'red'), 'PNG', optimize=True)
+  assert optimizer.optimize('image/png', data) == ('image/png', data)
+
+def test_other_and_broken_images_are_left_to_weasyprint():
+  optimizer = ImageOptimizer(max_dpi=50)
+  gif = encode(Image.new('P', (2000, 2000)), 'GIF')
+  assert optimizer.optimize('image/gif', gif) == ('image/gif', gif)
+  broken = base64.b64encode(b'not an image')
+  assert optimizer.optimize('image/jpeg', broken) == ('image/jpeg', broken)
+
+def test_exif_orientation_is_applied():
+  optimizer = ImageOptimizer(max_dpi=50)
+  exif = Image.Exif()
+  # rotated by 90 degrees
+  exif[0x0112] = 6
+  content_type, data = optimizer.optimize('image/jpeg', encode(noise((1200, 300)), 'JPEG', exif=exif))
+  width, height = decode(data).size
+  assert height > width
+
+def test_same_image_is_processed_once(monkeypatch):
+  optimizer = ImageOptimizer(max_dpi=50)
+  data = encode(noise((1200, 300)), 'JPEG')
+  result = optimizer.optimize('image/jpeg', data)
+  monkeypatch.setattr(optimizer, 'process', lambda content_type, data: pytest.fail('processed again'))
+  assert optimizer.optimize('image/jpeg', data) == result
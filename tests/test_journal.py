@@ -0,0 +1,128 @@
+import os
+import sqlite3
+import time
+
+import journal
+from journal import DONE, FAILED, PENDING, RUNNING, SKIPPED, Journal
+from conftest import write
+
+def row(jobs, filename):
+  return jobs.execute("SELECT state, attempts, next_attempt, error FROM jobs WHERE filename = ?", (os.path.abspath(filename),))[0]
+
+def test_states(tmp_path):
+  jobs = Journal(str(tmp_path / 'journal.sqlite'))
+  filename = write(tmp_path / 'a.eml')
+  assert jobs.add(filename)
+  assert row(jobs, filename)[:2] == (PENDING, 0)
+  jobs.start(filename)
+  assert row(jobs, filename)[:2] == (RUNNING, 1)
+  jobs.finish(filename)
+  assert row(jobs, filename) == (DONE, 1, None, None)
+  jobs.skip(filename)
+  assert row(jobs, filename)[0] == SKIPPED
+  jobs.forget(filename)
+  assert jobs.execute("SELECT * FROM jobs") == []
+
+def test_recover_interrupted_conversions(tmp_path):
+  path = str(tmp_path / 'journal.sqlite')
+  jobs = Journal(path)
+  running, waiting, done = [write(tmp_path / name) for name in ('running.eml', 'waiting.eml', 'done.eml')]
+  for filename in (running, waiting, done):
+    jobs.add(filename)
+  jobs.start(running)
+  jobs.start(done)
+  jobs.finish(done)
+  jobs.close()
+
+  # after a crash, the file being converted is converted again
+  jobs = Journal(path)
+  assert sorted(jobs.recover()) == sorted([running, waiting])
+  assert row(jobs, running)[0] == PENDING
+
+def test_failures_back_off_until_the_attempts_are_used(tmp_path, monkeypatch):
+  jobs = Journal(str(tmp_path / 'journal.sqlite'), max_attempts=3)
+  filename = write(tmp_path / 'a.eml')
+  jobs.add(filename)
+  delays = []
+  for attempt in range(3):
+    if attempt > 0:
+      monkeypatch.setattr(time, 'time', lambda: next_attempt)
+      assert jobs.retry_due() == [filename]
+      monkeypatch.undo()
+    start = time.time()
+    jobs.start(filename)
+    jobs.fail(filename, 'error %d' % attempt)
+    state, attempts, next_attempt, error = row(jobs, filename)
+    assert (state, attempts, error) == (FAILED, attempt + 1, 'error %d' % attempt)
+    if next_attempt != None:
+      delays.append(round((next_attempt - start) / journal.RETRY_DELAY))
+  # the third attempt was the last one
+  assert next_attempt == None
+  assert delays == [1, 2]
+  assert jobs.retry_due() == []
+
+def test_retry_is_not_due_before_its_time(tmp_path):
+  jobs = Journal(str(tmp_path / 'journal.sqlite'))
+  filename = write(tmp_path / 'a.eml')
+  jobs.add(filename)
+  jobs.start(filename)
+  jobs.fail(filename, 'error')
+  assert jobs.retry_due() == []
+
+def test_quarantined_file_is_not_retried(tmp_path):
+  jobs = Journal(str(tmp_path / 'journal.sqlite'))
+  filename = write(tmp_path / 'a.eml')
+  jobs.add(filename)
+  jobs.start(filename)
+  jobs.fail(filename, 'too big', retry=False)
+  assert row(jobs, filename)[:3] == (FAILED, 1, None)
+
+def test_unchanged_failed_file_keeps_its_attempts(tmp_path):
+  jobs = Journal(str(tmp_path / 'journal.sqlite'), max_attempts=3)
+  filename = write(tmp_path / 'a.eml')
+  jobs.add(filename)
+  jobs.start(filename)
+  jobs.fail(filename, 'error')
+  before = row(jobs, filename)
+
+  # found again by the scan of a restarted watcher
+  assert not jobs.add(filename)
+  assert row(jobs, filename) == before
+
+  # a new version of the file gets all its attempts
+  stat = os.stat(filename)
+  write(filename, b'changed')
+  os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+  assert jobs.add(filename)
+  assert row(jobs, filename) == (PENDING, 0, None, None)
+
+def test_done_file_is_converted_again(tmp_path):
+  jobs = Journal(str(tmp_path / 'journal.sqlite'))
+  filename = write(tmp_path / 'a.eml')
+  jobs.add(filename)
+  jobs.start(filename)
+  jobs.finish(filename)
+  assert jobs.add(filename)
+  assert row(jobs, filename)[:2] == (PENDING, 0)
+
+def test_journal_without_size_and_mtime_columns(tmp_path):
+  path = str(tmp_path / 'journal.sqlite')
+  connection = sqlite3.connect(path)
+  connection.execute("""
+    CREATE TABLE jobs (
+      filename TEXT PRIMARY KEY,
+      state TEXT NOT NULL,
+      attempts INTEGER NOT NULL DEFAULT 0,
+      next_attempt REAL,
+      error TEXT,
+      updated REAL NOT NULL
+    )""")
+  connection.commit()
+  connection.close()
+
+  jobs = Journal(path)
+  filename = write(tmp_path / 'a.eml')
+  assert jobs.add(filename)
+  jobs.start(filename)
+  jobs.fail(filename, 'error')
+  assert not jobs.add(filename)
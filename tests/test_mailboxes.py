@@ -0,0 +1,59 @@
+import os
+
+import mailboxes
+from mailboxes import MAILDIR, MBOX, iterate_mailbox, iterate_pdf_targets, mailbox_type, output_directory, pdf_name
+from conftest import write
+
+FIRST = b'From: a@example.com\nSubject: First\n\nHello\n>From the start\n>>From quoted\n\nFrom someone else, not a separator\n'
+SECOND = b'From: b@example.com\r\nSubject: =?utf-8?q?Caf=C3=A9_/_menu?=\r\n\r\nBye\r\n'
+
+def mbox(path):
+  return write(path, b'From a@example.com Mon Jan  3 01:05:34 2022\n' + FIRST +
+               b'\nFrom b@example.com Tue Jan 11 11:05:34 2022\r\n' + SECOND)
+
+def test_mbox_emails_are_split_and_unquoted(tmp_path):
+  emails = list(mailboxes.iterate_mbox(mbox(tmp_path / 'Inbox.mbox')))
+  assert len(emails) == 2
+  assert emails[0] == FIRST.replace(b'>From the start', b'From the start').replace(b'>>From', b'>From') + b'\n'
+  assert emails[1] == SECOND
+
+def test_mbox_exported_by_apple_mail(tmp_path):
+  os.makedirs(tmp_path / 'Inbox.mbox')
+  mbox(tmp_path / 'Inbox.mbox' / 'mbox')
+  assert mailbox_type(str(tmp_path / 'Inbox.mbox')) == MBOX
+  assert len(list(iterate_mailbox(str(tmp_path / 'Inbox.mbox')))) == 2
+
+def test_mailbox_type(tmp_path):
+  assert mailbox_type(mbox(tmp_path / 'export')) == MBOX
+  assert mailbox_type(write(tmp_path / 'empty.mbox', b'')) == MBOX
+  assert mailbox_type(write(tmp_path / 'a.eml', b'From a@example.com Mon Jan  3 01:05:34 2022\n')) == None
+  assert mailbox_type(write(tmp_path / 'notes.txt', b'From me: call back\n')) == None
+  assert mailbox_type(str(tmp_path / 'missing')) == None
+  os.makedirs(tmp_path / 'Maildir' / 'cur')
+  os.makedirs(tmp_path / 'Maildir' / 'new')
+  assert mailbox_type(str(tmp_path / 'Maildir')) == MAILDIR
+  assert mailbox_type(str(tmp_path)) == None
+
+def test_maildir(tmp_path):
+  for subdirectory in ('cur', 'new', 'tmp'):
+    os.makedirs(tmp_path / subdirectory)
+  write(tmp_path / 'new' / '2.host', SECOND)
+  write(tmp_path / 'cur' / '1.host:2,S', FIRST)
+  write(tmp_path / 'cur' / '.hidden', b'')
+  # emails still being delivered are not taken
+  write(tmp_path / 'tmp' / '3.host', b'')
+  assert list(iterate_mailbox(str(tmp_path))) == [FIRST, SECOND]
+
+def test_pdf_name():
+  assert pdf_name(1, FIRST) == '00001 - First.pdf'
+  assert pdf_name(2, SECOND) == '00002 - Café _ menu.pdf'
+  assert pdf_name(3, b'From: a@example.com\n\nSubject: in the body\n') == '00003.pdf'
+  assert pdf_name(4, b'Subject: Folded\n  subject line\n\nbody') == '00004 - Folded subject line.pdf'
+
+def test_pdf_targets(tmp_path):
+  path = mbox(tmp_path / 'Inbox.mbox')
+  assert output_directory(path) == str(tmp_path / 'Inbox PDF')
+  targets = list(iterate_pdf_targets(path))
+  assert [filename for filename, _ in targets] == [
+    str(tmp_path / 'Inbox PDF' / '00001 - First.pdf'), str(tmp_path / 'Inbox PDF' / '00002 - Café _ menu.pdf')]
+  assert targets[1][1] == SECOND
@@ -0,0 +1,77 @@
+import email.message
+import email.policy
+
+import pytest
+
+eml_parser = pytest.importorskip('eml_parser')
+
+from nested import NestedEmailParser, content_ids, is_email
+from spool import parse_email
+
+def build(subject, attached=(), files=()):
+  """Raw email with emails attached as message/rfc822 and files attached as (name, content ID, data)"""
+  message = email.message.EmailMessage()
+  message['From'] = 'a@example.com'
+  message['To'] = 'b@example.com'
+  message['Subject'] = subject
+  message.set_content('Body of ' + subject)
+  for raw_email in attached:
+    message.add_attachment(email.message_from_bytes(raw_email, policy=email.policy.default), filename=subject + '.eml')
+  for name, content_id, data in files:
+    message.add_attachment(data, maintype='image', subtype='png', filename=name, cid=content_id)
+  return message.as_bytes()
+
+def parse(raw_email):
+  return parse_email(raw_email)
+
+def subjects(nested_emails):
+  return [(nested_email.depth, nested_email.parsed_eml['header']['subject']) for nested_email in nested_emails]
+
+def test_tree_of_forwarded_emails():
+  innermost = build('Innermost', files=[('logo.png', '<logo@x>', b'png')])
+  inner = build('Inner', attached=[innermost])
+  other = build('Other')
+  outer = parse(build('Outer', attached=[inner, other]))
+  assert sum(is_email(attachment) for attachment in outer['attachment']) > 2
+
+  tree = NestedEmailParser().nested_emails(outer)
+  # the email nested in Inner is not also listed next to it
+  assert subjects(tree) == [(1, 'Inner'), (1, 'Other')]
+  assert subjects(tree[0].children) == [(2, 'Innermost')]
+  assert subjects(tree[0].walk()) == [(1, 'Inner'), (2, 'Innermost')]
+  assert tree[0].children[0].children == []
+  assert content_ids(tree[0].children[0].parsed_eml) == {'<logo@x>'}
+
+def test_depth_limit():
+  deepest = build('Level 3')
+  outer = parse(build('Outer', attached=[build('Level 1', attached=[build('Level 2', attached=[deepest])])]))
+  tree = NestedEmailParser(max_depth=2).nested_emails(outer)
+  assert subjects(tree) == [(1, 'Level 1')]
+  assert subjects(tree[0].children) == [(2, 'Level 2')]
+  # too deep to be parsed, it stays an attachment of Level 2
+  assert tree[0].children[0].children == []
+
+def test_forwarded_email_is_parsed_once(monkeypatch):
+  forwarded = build('Forwarded')
+  first = parse(build('First', attached=[forwarded]))
+  second = parse(build('Second', attached=[forwarded]))
+  parser = NestedEmailParser()
+  decoded = []
+  original = eml_parser.EmlParser.decode_email_bytes
+  def decode_email_bytes(self, raw_email):
+    decoded.append(raw_email)
+    return original(self, raw_email)
+  monkeypatch.setattr(eml_parser.EmlParser, 'decode_email_bytes', decode_email_bytes)
+  assert subjects(parser.nested_emails(first)) == subjects(parser.nested_emails(second)) == [(1, 'Forwarded')]
+  assert len(decoded) == 1
+
+def test_cache_size():
+  parser = NestedEmailParser(cache_size=len(build('A')) * 2 + 100)
+  for subject in ('A', 'B', 'C'):
+    parser.nested_emails(parse(build('Outer ' + subject, attached=[build(subject)])))
+  assert len(parser.cache) == 2
+  assert parser.cached_bytes <= parser.cache_size
+  # too big to be kept
+  parser = NestedEmailParser(cache_size=10)
+  parser.nested_emails(parse(build('Outer', attached=[build('A')])))
+  assert len(parser.cache) == 0
@@ -0,0 +1,55 @@
+import io
+import re
+
+from plaintext import can_render, layout, text_width, wrap_lines, wrap_words, write_pdf
+from spool import NamedBytesIO
+
+def test_can_render():
+  assert can_render('Café – €5', 'plain')
+  assert not can_render('plain', '日本語')
+  assert not can_render('emoji 🙂')
+
+def test_wrap_lines_keeps_line_breaks_and_spaces():
+  assert wrap_lines('a\r\nb\rc\n\n  indented  \n', 80) == ['a', 'b', 'c', '', '  indented']
+  assert wrap_lines('', 80) == ['']
+  assert wrap_lines('\n', 80) == ['']
+
+def test_wrap_lines_splits_long_lines():
+  assert wrap_lines('x' * 25, 10) == ['x' * 10, 'x' * 10, 'x' * 5]
+  assert wrap_lines('x' * 20, 10) == ['x' * 10, 'x' * 10]
+
+def test_wrap_lines_expands_tabs_and_control_characters():
+  assert wrap_lines('a\tb', 80) == ['a' + ' ' * 7 + 'b']
+  assert wrap_lines('bell\x07\x0cform feed', 80) == ['bell  form feed']
+
+def test_wrap_words():
+  lines = wrap_words('The quick brown fox jumps over the lazy dog', 60, 10)
+  assert ' '.join(lines) == 'The quick brown fox jumps over the lazy dog'
+  assert len(lines) > 1
+  assert all(text_width(line, 10) <= 60 for line in lines)
+  # a word longer than the line is cut
+  lines = wrap_words('x' * 50, 60, 10)
+  assert ''.join(lines) == 'x' * 50
+  assert all(text_width(line, 10) <= 60 for line in lines)
+  assert wrap_words('', 60, 10) == ['']
+
+def test_layout_breaks_pages():
+  fields = [('From', 'a@example.com'), ('Subject', 'Long')]
+  assert len(layout(fields, 'short')) == 1
+  pages = layout(fields, 'line\n' * 200)
+  assert len(pages) == 4
+  assert sum(len(page) for page in pages) == 200 + 2 * 2 + 1
+
+def test_layout_escapes_strings():
+  pages = layout([('Subject', 'a (b) \\ c')], 'x')
+  assert b'(a \\(b\\) \\\\ c) Tj' in b'\n'.join(pages[0])
+
+def test_write_pdf_with_attachments():
+  output = io.BytesIO()
+  write_pdf(layout([('Subject', 'Hi')], 'line\n' * 200), [NamedBytesIO(b'data' * 1000, name='a.txt')], output)
+  data = output.getvalue()
+  assert data.startswith(b'%PDF-')
+  assert data.rstrip().endswith(b'%%EOF')
+  assert len(re.findall(rb'/Type /Page\b(?!s)', data)) == 4
+  assert b'/EmbeddedFiles' in data
+  assert b'(a.txt)' in data
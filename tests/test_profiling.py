@@ -0,0 +1,63 @@
+import pytest
+
+import profiling
+from profiling import NullProfile, Profile, percentile, summarize
+
+def test_percentile():
+  values = [5, 1, 4, 2, 3]
+  assert percentile(values, 50) == 3
+  assert percentile(values, 90) == 5
+  assert percentile(values, 0) == 1
+  assert percentile([7], 99) == 7
+
+def test_stage_records_time_and_memory_growth(monkeypatch):
+  rss = iter([100, 150, 150, 140])
+  monkeypatch.setattr(profiling, 'current_rss', lambda pid: next(rss))
+  profile = Profile('a.eml')
+  with profile.stage('parse'):
+    pass
+  # a stage entered twice adds up
+  with profile.stage('parse'):
+    pass
+  stage = profile.record['stages']['parse']
+  assert stage['rss'] == 140
+  assert stage['rss_delta'] == 40
+  assert stage['seconds'] >= 0
+
+def test_stage_without_memory(monkeypatch):
+  monkeypatch.setattr(profiling, 'current_rss', lambda pid: None)
+  profile = Profile('a.eml')
+  with profile.stage('parse'):
+    pass
+  assert profile.record['stages']['parse']['rss_delta'] == None
+  assert 'RSS growth' not in summarize([profile.record])
+
+def test_stage_is_recorded_when_it_fails():
+  profile = Profile('a.eml')
+  with pytest.raises(ValueError):
+    with profile.stage('layout'):
+      raise ValueError()
+  assert 'layout' in profile.record['stages']
+
+def test_null_profile_does_not_measure(monkeypatch):
+  def current_rss(pid):
+    raise AssertionError('the memory is read without profiling')
+  monkeypatch.setattr(profiling, 'current_rss', current_rss)
+  profile = NullProfile()
+  with profile.stage('parse'):
+    profile.size('email_bytes', 10)
+  with pytest.raises(ValueError):
+    with profile.stage('layout'):
+      raise ValueError()
+
+def record(filename, seconds, rss_delta):
+  return {'filename': filename, 'sizes': {'email_bytes': 10},
+          'stages': {'parse': {'seconds': seconds, 'rss': 2**30, 'rss_delta': rss_delta}}}
+
+def test_summarize():
+  records = [record('fast.eml', 0.1, 0), record('slow.eml', 2.0, 3 * 2**20), record('medium.eml', 1.0, 2**20)]
+  summary = summarize(records, slowest=2)
+  assert summary.startswith('Profile of 3 file(s)')
+  assert 'RSS growth per file (MB): p50 1.0, p90 3.0, max 3.0' in summary
+  slowest = summary.split('Slowest files:\n')[1].split('\n')
+  assert slowest == ['  2.000s slow.eml (email_bytes 10)', '  1.000s medium.eml (email_bytes 10)']
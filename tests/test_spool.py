@@ -0,0 +1,88 @@
+import email.message
+import hashlib
+import os
+import tracemalloc
+
+import pytest
+
+from spool import NamedSpooledTemporaryFile, attachment_data, attachment_file, parse_email
+
+def test_small_attachment_stays_in_memory():
+  file = attachment_file([b'small ', b'attachment'], 'a.txt', spool_threshold=1024)
+  assert not file._rolled
+  assert file.name == 'a.txt'
+  assert file.read() == b'small attachment'
+
+def test_large_attachment_goes_to_a_file():
+  data = bytes(range(256)) * 4
+  file = attachment_file([data[:500], data[500:]], 'big.bin', spool_threshold=100)
+  assert isinstance(file, NamedSpooledTemporaryFile)
+  # larger than the threshold, so it was moved from memory to a temporary file
+  assert file._rolled
+  assert file.name == 'big.bin'
+  assert file.read() == data
+  file.close()
+
+def test_attachments_are_decoded_from_their_part():
+  pytest.importorskip('eml_parser')
+  forwarded = email.message.EmailMessage()
+  forwarded['Subject'] = 'Forwarded'
+  forwarded.set_content('Forwarded body')
+  message = email.message.EmailMessage()
+  message['Subject'] = 'Outer'
+  message.set_content('Body')
+  message.add_attachment(bytes(range(256)), maintype='application', subtype='octet-stream', filename='data.bin')
+  message.add_attachment(forwarded, filename='forwarded.eml')
+
+  attachments = parse_email(message.as_bytes())['attachment']
+  assert [attachment['filename'] for attachment in attachments] == ['data.bin', 'forwarded.eml']
+  # no base64 copy of the content is kept next to the MIME part
+  assert all('raw' not in attachment for attachment in attachments)
+  assert attachment_data(attachments[0]) == bytes(range(256))
+  assert b'Forwarded body' in attachment_data(attachments[1])
+  # the content is the one eml_parser hashed
+  assert all(hashlib.sha256(attachment_data(attachment)).hexdigest() == attachment['hash']['sha256'] for attachment in attachments)
+
+def email_with_large_attachments(data):
+  """Email with data attached, and forwarding an email with data attached, its text body is base64 encoded too"""
+  forwarded = email.message.EmailMessage()
+  forwarded['Subject'] = 'Forwarded'
+  forwarded.set_content('Forwarded body')
+  forwarded.add_attachment(data, maintype='application', subtype='pdf', filename='forwarded.pdf')
+  message = email.message.EmailMessage()
+  message['Subject'] = 'Outer'
+  message.set_content('Body ' * 1000, cte='base64')
+  message.add_attachment(data, maintype='application', subtype='octet-stream', filename='data.bin')
+  message.add_attachment(forwarded, filename='forwarded.eml')
+  return message.as_bytes()
+
+def test_large_attachments_are_spooled_before_parsing():
+  pytest.importorskip('eml_parser')
+  data = os.urandom(4 * 1024 * 1024)
+  raw_email = email_with_large_attachments(data)
+  tracemalloc.start()
+  try:
+    parsed_eml = parse_email(raw_email, spool_threshold=1000)
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  # the email package would need several times the size of the email to parse the attachments,
+  # spooling them only needs a few chunks
+  assert peak < len(raw_email) / 2
+  # the body is not an attachment, it is parsed as usual
+  assert parsed_eml['body'][0]['content'].startswith('Body Body')
+  data_bin, forwarded_eml, forwarded_pdf = parsed_eml['attachment']
+  assert data_bin['file']._rolled and forwarded_pdf['file']._rolled
+  assert data_bin['size'] == forwarded_pdf['size'] == len(data)
+  assert data_bin['hash']['sha256'] == hashlib.sha256(data).hexdigest()
+  assert attachment_data(data_bin) == attachment_data(forwarded_pdf) == data
+  # the attached email gets its attachment back
+  forwarded = parse_email(attachment_data(forwarded_eml), spool_threshold=len(data) * 2)
+  assert forwarded['header']['subject'] == 'Forwarded'
+  assert attachment_data(forwarded['attachment'][0]) == data
+
+def test_attachments_below_the_threshold_are_parsed_in_memory():
+  pytest.importorskip('eml_parser')
+  parsed_eml = parse_email(email_with_large_attachments(b'data' * 1000), spool_threshold=10000)
+  assert all(attachment.get('file') == None for attachment in parsed_eml['attachment'])
+  assert attachment_data(parsed_eml['attachment'][0]) == b'data' * 1000
@@ -0,0 +1,78 @@
+import os
+import time
+
+import pytest
+
+from supervisor import ConversionAborted, LimitExceeded, RemoteTraceback, SupervisedPool, current_rss
+
+# the tasks run in worker processes, so they are functions of this module
+
+def sleep(seconds):
+  time.sleep(seconds)
+  return seconds
+
+def allocate(megabytes):
+  data = bytearray(megabytes * 2**20)
+  # touch every page, so that it is resident
+  data[::4096] = b'x' * len(data[::4096])
+  time.sleep(5)
+  return len(data)
+
+def fail():
+  raise ValueError('broken email')
+
+def exit_worker():
+  os._exit(3)
+
+def broken_installation():
+  raise ImportError('no pango')
+
+def test_results_and_errors():
+  with SupervisedPool(2) as pool:
+    futures = [pool.submit(sleep, 0.1), pool.submit(fail), pool.submit(sleep, 0)]
+    assert futures[0].result() == 0.1
+    with pytest.raises(ValueError, match='broken email') as error:
+      futures[1].result()
+    assert isinstance(error.value.__cause__, RemoteTraceback)
+    assert 'in fail' in str(error.value.__cause__)
+    assert futures[2].result() == 0
+
+def test_timeout_kills_only_the_slow_task():
+  with SupervisedPool(1, timeout=0.5) as pool:
+    start = time.monotonic()
+    slow = pool.submit(sleep, 30)
+    fast = pool.submit(sleep, 0)
+    with pytest.raises(LimitExceeded, match='still running after 0.5 seconds'):
+      slow.result()
+    assert time.monotonic() - start < 10
+    # a new worker takes the next task
+    assert fast.result() == 0
+
+def test_memory_limit_kills_only_the_big_task():
+  # the workers start with the memory of this process
+  max_rss = current_rss(os.getpid()) + 100 * 2**20
+  with SupervisedPool(1, max_rss=max_rss) as pool:
+    big = pool.submit(allocate, 300)
+    small = pool.submit(sleep, 0)
+    with pytest.raises(LimitExceeded, match='more than the limit'):
+      big.result()
+    assert small.result() == 0
+
+def test_dying_worker_is_not_over_the_limits():
+  with SupervisedPool(1) as pool:
+    with pytest.raises(ConversionAborted, match='exit code 3') as error:
+      pool.submit(exit_worker).result()
+    assert not isinstance(error.value, LimitExceeded)
+    assert pool.submit(sleep, 0).result() == 0
+
+def test_failing_initializer_fails_every_task():
+  with SupervisedPool(1, initializer=broken_installation) as pool:
+    for _ in range(2):
+      with pytest.raises(ImportError, match='no pango'):
+        pool.submit(sleep, 0).result()
+
+def test_memory_limit_below_an_idle_worker():
+  with SupervisedPool(1, max_rss=2**20) as pool:
+    with pytest.raises(ConversionAborted, match='below the') as error:
+      pool.submit(sleep, 0).result()
+    assert not isinstance(error.value, LimitExceeded)
@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+
+from journal import Journal
+from watcher import ConversionQueue, EmlPdfEventHandler, find_unconverted
+from conftest import write
+
+DELAY = 0.1
+
+class Recorder:
+  """process function of a ConversionQueue recording the files it was called with"""
+
+  def __init__(self, seconds=0):
+    self.seconds = seconds
+    self.filenames = []
+    self.active = 0
+    self.max_active = 0
+    self.lock = threading.Lock()
+
+  def __call__(self, filenames):
+    with self.lock:
+      self.active += 1
+      self.max_active = max(self.max_active, self.active)
+    time.sleep(self.seconds)
+    with self.lock:
+      self.active -= 1
+      self.filenames.extend(filenames)
+
+def run_queue(recorder, actions, jobs=1, seconds=1):
+  queue = ConversionQueue(recorder, jobs, DELAY)
+  queue.start()
+  try:
+    actions(queue)
+    time.sleep(seconds)
+  finally:
+    queue.stop()
+
+def test_events_of_a_file_are_merged(tmp_path):
+  filename = write(tmp_path / 'a.eml')
+  recorder = Recorder()
+  def actions(queue):
+    for _ in range(5):
+      queue.put(filename)
+      time.sleep(DELAY / 5)
+    # not ready before the delay after the last event
+    assert recorder.filenames == []
+  run_queue(recorder, actions)
+  assert recorder.filenames == [filename]
+
+def test_growing_file_waits(tmp_path):
+  filename = write(tmp_path / 'a.eml')
+  recorder = Recorder()
+  def actions(queue):
+    queue.put(filename)
+    # the size changes without an event, like a file copied slowly
+    for size in range(2, 10):
+      time.sleep(DELAY / 2)
+      write(filename, b'x' * size)
+    assert recorder.filenames == []
+  run_queue(recorder, actions)
+  assert recorder.filenames == [filename]
+
+def test_deleted_file_is_dropped(tmp_path):
+  filename = write(tmp_path / 'a.eml')
+  recorder = Recorder()
+  def actions(queue):
+    queue.put(filename)
+    os.remove(filename)
+  run_queue(recorder, actions, seconds=DELAY * 3)
+  assert recorder.filenames == []
+
+def test_files_run_in_parallel_but_a_file_only_once(tmp_path):
+  filenames = [write(tmp_path / ('%d.eml' % index)) for index in range(3)]
+  recorder = Recorder(seconds=DELAY * 3)
+  def actions(queue):
+    for filename in filenames:
+      queue.put(filename)
+    time.sleep(DELAY * 2)
+    # queued again while it is being processed, it runs again afterwards
+    queue.put(filenames[0])
+  run_queue(recorder, actions, jobs=3, seconds=DELAY * 12)
+  assert sorted(recorder.filenames) == sorted(filenames + [filenames[0]])
+  assert recorder.max_active == 3
+
+def test_find_unconverted(tmp_path):
+  os.makedirs(tmp_path / 'sub' / 'deeper')
+  write(tmp_path / 'done.eml')
+  write(tmp_path / 'done.pdf')
+  write(tmp_path / 'notes.txt')
+  expected = [write(tmp_path / 'new.EML'), write(tmp_path / 'sub' / 'deeper' / 'b.eml')]
+  assert sorted(find_unconverted(str(tmp_path))) == sorted(expected)
+
+class ListQueue:
+  def __init__(self):
+    self.filenames = []
+
+  def put(self, filename):
+    self.filenames.append(filename)
+
+def test_event_handler_ignores_quarantine_and_other_files(tmp_path):
+  os.makedirs(tmp_path / 'quarantine')
+  queue = ListQueue()
+  handler = EmlPdfEventHandler(queue, Journal(str(tmp_path / 'journal.sqlite')), str(tmp_path / 'quarantine'))
+  handler.enqueue(write(tmp_path / 'quarantine' / 'big.eml'))
+  handler.enqueue(write(tmp_path / 'a.pdf'))
+  handler.enqueue(write(tmp_path / 'a.eml'))
+  assert queue.filenames == [str(tmp_path / 'a.eml')]
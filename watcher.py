@@ -0,0 +1,181 @@
+import logging
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from watchdog.events import FileSystemEventHandler
+
+logger = logging.getLogger('console.py')
+
+# directories listed at the same time when scanning, which mostly helps on network shares
+SCAN_THREADS = 8
+
+def file_size(path):
+  """Return the size of a file, or None when it does not exist (anymore)"""
+  try:
+    return os.stat(path).st_size
+  except OSError:
+    return None
+
+def scan_directory(directory):
+  """
+  List one directory
+  Returns:
+      EML files of the directory without a PDF file next to them, subdirectories
+  """
+  filenames = set()
+  subdirectories = []
+  try:
+    with os.scandir(directory) as entries:
+      for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+          subdirectories.append(entry.path)
+        else:
+          filenames.add(entry.name)
+  except OSError:
+    return [], []
+  unconverted = []
+  for filename in filenames:
+    name, extension = os.path.splitext(filename)
+    if extension.lower() == '.eml' and name + '.pdf' not in filenames:
+      unconverted.append(os.path.join(directory, filename))
+  return unconverted, subdirectories
+
+def find_unconverted(directory):
+  """Find the EML files without a PDF file in a directory and all its subdirectories, listing several directories at once"""
+  unconverted = []
+  with ThreadPoolExecutor(max_workers=SCAN_THREADS) as executor:
+    futures = {executor.submit(scan_directory, directory)}
+    while len(futures) > 0:
+      done, futures = wait(futures, return_when=FIRST_COMPLETED)
+      for future in done:
+        filenames, subdirectories = future.result()
+        unconverted.extend(filenames)
+        futures |= {executor.submit(scan_directory, subdirectory) for subdirectory in subdirectories}
+  return unconverted
+
+class ConversionQueue:
+  """
+  Collect files reported by file system events and process each of them once it stopped changing.
+  A file is ready when no event was reported for it during `delay` seconds and its size did not change
+  in the meantime, so a file that is still being written is not converted half way.
+  Several events for the same file are merged into one job, and a file is never processed by two workers at once:
+  events received while it is being processed queue it again for when the worker is done.
+  """
+
+  def __init__(self, process, jobs=1, delay=2.0):
+    """
+    Arguments:
+        process: function called with a list containing the filename to process
+        jobs: number of files processed at the same time
+        delay: seconds without events and size changes before a file is processed
+    """
+    self.process = process
+    self.delay = delay
+    self.pending = {}  # filename -> (time of the last event, size at the last event)
+    self.running = set()
+    self.stopped = False
+    self.condition = threading.Condition()
+    self.executor = ThreadPoolExecutor(max_workers=jobs)
+    self.thread = threading.Thread(target=self.dispatch, name='ConversionQueue', daemon=True)
+
+  def start(self):
+    self.thread.start()
+
+  def stop(self):
+    """Stop dispatching files and wait until the files being processed are done"""
+    with self.condition:
+      self.stopped = True
+      self.condition.notify()
+    self.thread.join()
+    self.executor.shutdown(wait=True)
+
+  def put(self, filename):
+    """Queue a file, or postpone it when it is already queued"""
+    with self.condition:
+      self.pending[filename] = (time.monotonic(), file_size(filename))
+      self.condition.notify()
+
+  def dispatch(self):
+    with self.condition:
+      while not self.stopped:
+        now = time.monotonic()
+        timeout = None
+        for filename, (last_event, last_size) in list(self.pending.items()):
+          if filename in self.running:
+            continue
+          wait = last_event + self.delay - now
+          if wait > 0:
+            timeout = wait if timeout == None else min(timeout, wait)
+            continue
+          size = file_size(filename)
+          if size == None:
+            # deleted or moved away before we got to it
+            del self.pending[filename]
+          elif size != last_size:
+            # still being written, check again later
+            self.pending[filename] = (now, size)
+            timeout = self.delay if timeout == None else min(timeout, self.delay)
+          else:
+            del self.pending[filename]
+            self.running.add(filename)
+            self.executor.submit(self.run, filename)
+        self.condition.wait(timeout)
+
+  def run(self, filename):
+    try:
+      self.process([filename])
+    except Exception:
+      traceback.print_exc()
+    finally:
+      with self.condition:
+        self.running.discard(filename)
+        self.condition.notify()
+
+class EmlPdfEventHandler(FileSystemEventHandler):
+  """Queue EML files to convert to PDF"""
+
+  def __init__(self, queue, journal, ignored_directory=None):
+    """
+    Arguments:
+        queue: ConversionQueue receiving the files
+        journal: Journal recording the files
+        ignored_directory: directory inside the watched one whose files are not converted, like the quarantine
+    """
+    super().__init__()
+    self.queue = queue
+    self.journal = journal
+    self.ignored_directory = None if ignored_directory == None else os.path.abspath(ignored_directory) + os.sep
+
+  def enqueue(self, filename):
+    if os.path.splitext(filename)[-1].lower() == ".eml":
+      filename = os.path.abspath(filename)
+      if self.ignored_directory != None and filename.startswith(self.ignored_directory):
+        return
+      # a failed file that did not change waits for its next attempt
+      if self.journal.add(filename):
+        self.queue.put(filename)
+
+  def on_moved(self, event):
+    super().on_moved(event)
+    if not event.is_directory:
+      logger.info("Move " + event.dest_path)
+      self.enqueue(event.dest_path)
+
+  def on_created(self, event):
+    super().on_created(event)
+
+    if not event.is_directory:
+      logger.info("Create " + event.src_path)
+      self.enqueue(event.src_path)
+
+  def on_deleted(self, event):
+    super().on_deleted(event)
+
+  def on_modified(self, event):
+    super().on_modified(event)
+
+    if not event.is_directory:
+      logger.info("Modify " + event.src_path)
+      self.enqueue(event.src_path)